@@ -11,7 +11,6 @@ from typing import List
 import click
 import yaml
 from flask.cli import FlaskGroup
-from sqlalchemy.exc import IntegrityError
 from sqlalchemy import select
 
 import pebbles.models
@@ -19,6 +18,7 @@ import pebbles.views.commons
 from pebbles import models
 from pebbles.app import create_app, db
 from pebbles.config import RuntimeConfig
+from pebbles.data_import import DATA_IMPORT_BATCH_SIZE, import_data
 from pebbles.models import User, Application, ApplicationTemplate
 from pebbles.utils import create_password
 
@@ -112,7 +112,8 @@ def update_password(ext_id, password=None):
 @click.option('-d', 'domain_name', help='account domain name (default example.org)')
 @click.option('-c', 'count', default=0, help='count')
 @click.option('-l', 'lifetime_in_days', default=0, help='lifetime in days (default no limit)')
-def createuser_bulk(user_prefix=None, domain_name=None, count=0, lifetime_in_days=0):
+@click.option('-j', 'max_workers', default=None, type=int, help='password hashing processes (default CPU count)')
+def createuser_bulk(user_prefix=None, domain_name=None, count=0, lifetime_in_days=0, max_workers=None):
     """Creates new demo users"""
     if not count:
         count = int(input('Enter the number of demo user accounts needed: '))
@@ -130,18 +131,27 @@ def createuser_bulk(user_prefix=None, domain_name=None, count=0, lifetime_in_day
 
     expiry_ts = time.time() + 3600 * 24 * lifetime_in_days if lifetime_in_days else None
 
-    for i in range(count):
-        for retry in range(5):
+    # pick random account names that are not taken yet, checking a whole round of candidates with one query
+    accounts = dict()
+    for retry in range(5):
+        candidates = set()
+        for _ in range(10 * count):
+            if len(accounts) + len(candidates) >= count:
+                break
             # eg: demo_user_Rgv4@example.com
             ext_id = user_prefix + "_" + ''.join(
                 random.choice(string.ascii_lowercase + string.digits) for _ in range(3)) + "@" + domain_name
-
-            password = create_password(8)
-
-            a = pebbles.views.commons.create_user(ext_id, password, expiry_ts=expiry_ts)
-            if a:
-                print('Username: %s\t Password: %s' % (ext_id, password))
-                break
+            ext_id = ext_id.lower()
+            if ext_id not in accounts:
+                candidates.add(ext_id)
+        existing = set(db.session.scalars(select(User._ext_id).where(User._ext_id.in_(candidates))))
+        accounts.update((ext_id, create_password(8)) for ext_id in candidates - existing)
+        if len(accounts) >= count:
+            break
+
+    created = pebbles.views.commons.create_users(accounts.items(), expiry_ts=expiry_ts, max_workers=max_workers)
+    for ext_id in created:
+        print('Username: %s\t Password: %s' % (ext_id, accounts[ext_id]))
 
     print("\n")
 
@@ -150,7 +160,8 @@ def createuser_bulk(user_prefix=None, domain_name=None, count=0, lifetime_in_day
 @click.argument('ext_id_string')
 @click.option('-p', 'password', help='shared password')
 @click.option('-l', 'lifetime_in_days', default=0, help='lifetime in days (default no limit)')
-def createuser_list_samepwd(ext_id_string=None, password=None, lifetime_in_days=0):
+@click.option('-j', 'max_workers', default=None, type=int, help='password hashing processes (default CPU count)')
+def createuser_list_samepwd(ext_id_string=None, password=None, lifetime_in_days=0, max_workers=None):
     """Creates new users with shared password. Takes a comma separated string of ext_ids as an argument"""
     if not ext_id_string:
         ext_id_string = input("TO CREATE USER\n Enter comma separated list of ext_ids without space: \
@@ -162,8 +173,9 @@ def createuser_list_samepwd(ext_id_string=None, password=None, lifetime_in_days=
 
     ext_id_list = [x for x in ext_id_string.split(',')]
     print("List of users to create %s " % ext_id_list)
-    for ext_id in ext_id_list:
-        pebbles.views.commons.create_user(ext_id, password, expiry_ts=expiry_ts)
+    # every account gets a hash with its own salt, even though the password is shared
+    pebbles.views.commons.create_users(
+        [(ext_id, password) for ext_id in ext_id_list], expiry_ts=expiry_ts, max_workers=max_workers)
 
 
 @cli.command('deleteuser_bulk')
@@ -195,34 +207,18 @@ def createworker():
 @cli.command('load_data')
 @click.argument('file')
 @click.option('-u', 'update', is_flag=True, help='update existing entries')
-def load_data(file, update=False):
+@click.option('-b', 'batch_size', default=DATA_IMPORT_BATCH_SIZE, help='objects written per transaction')
+def load_data(file, update=False, batch_size=DATA_IMPORT_BATCH_SIZE):
     """
     Loads an annotated YAML file into database. Use -u/--update to update existing entries instead of skipping.
     """
     with open(file, 'r') as f:
-        data = models.load_yaml(f)
-        for obj in data['data']:
-            try:
-                db.session.add(obj)
-                db.session.commit()
-                logging.info('inserted %s %s' % (
-                    type(obj).__name__,
-                    getattr(obj, 'id', '')
-                ))
-            except IntegrityError:
-                db.session.rollback()
-                if update:
-                    db.session.merge(obj)
-                    db.session.commit()
-                    logging.info('updated %s %s' % (
-                        type(obj).__name__,
-                        getattr(obj, 'id', '')
-                    ))
-                else:
-                    logging.info('skipping %s %s, it already exists' % (
-                        type(obj).__name__,
-                        getattr(obj, 'id', '')
-                    ))
+        counts = import_data(models.iter_yaml_data(f), update=update, batch_size=batch_size)
+
+    print('%-30s %9s %9s %9s' % ('table', 'inserted', 'updated', 'skipped'))
+    for table_name, table_counts in counts.items():
+        print('%-30s %9d %9d %9d' % (
+            table_name, table_counts['inserted'], table_counts['updated'], table_counts['skipped']))
 
 
 @cli.command('reset_worker_password')
@@ -293,17 +289,12 @@ def list_application_images():
     images = []
     # collect the images per application
     for a in applications:
-        image = a.config.get('image_url', '')
-        if image:
-            if image not in images:
-                images.append(image)
-        else:
-            image = a.base_config.get('image', '')
-            if image not in images:
-                images.append(image)
+        image = a.get_image()
+        if image not in images:
+            images.append(image)
 
     # filter out strings that are obviously wrong (image_url in config can basically have anything)
-    print('\n'.join([image for image in sorted(images) if '/' in image and ' ' not in image]))
+    print('\n'.join([image for image in sorted(images) if models.is_valid_image_reference(image)]))
 
 
 @cli.command('replace_application_image')
@@ -340,5 +331,76 @@ def replace_application_image(old_image, new_image, dry_run=False):
         print('No changes')
 
 
+@cli.command('benchmark_responses')
+@click.option('-n', 'iterations', default=20, help='number of encoding rounds per endpoint (default 20)')
+@click.option('-p', 'paths', multiple=True, help='API path to benchmark, can be repeated (default: largest lists)')
+def benchmark_responses(iterations=20, paths=None):
+    """
+    Measures JSON encoding time and compressed sizes for API responses, using the data in the database
+    """
+    import json
+    from flask import current_app
+    from pebbles.representations import dumps_json, compress_data, brotli
+
+    if not paths:
+        paths = (
+            '/api/v1/users',
+            '/api/v1/alerts?include_archived=1',
+            '/api/v1/application_sessions',
+            '/api/v1/applications?show_all=1',
+            '/api/v1/workspaces',
+        )
+    admin = db.session.scalar(select(User).where(User.is_admin).where(User.is_deleted.is_(False)).limit(1))
+    if not admin:
+        logging.warning('no admin user found')
+        return
+    token = admin.generate_auth_token(current_app.config['SECRET_KEY'], expires_in=600)
+    client = current_app.test_client()
+    level = current_app.config['API_COMPRESSION_LEVEL']
+    encodings = ['gzip', 'br'] if brotli else ['gzip']
+
+    def time_it(f):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            res = f()
+        return (time.perf_counter() - start) / iterations * 1000, res
+
+    print('%-40s %9s %9s %9s' % ('path', 'json ms', 'orjson ms', 'bytes') + ''.join(
+        ' %9s %9s' % (e + ' B', e + ' ms') for e in encodings))
+    for path in paths:
+        resp = client.get(path, auth=(token, ''), headers={'Accept-Encoding': 'identity'})
+        if resp.status_code != 200:
+            print('%-40s failed with %d' % (path, resp.status_code))
+            continue
+        data = json.loads(resp.data)
+        json_ms, _ = time_it(lambda: json.dumps(data).encode('utf-8'))
+        orjson_ms, encoded = time_it(lambda: dumps_json(data))
+        line = '%-40s %9.2f %9.2f %9d' % (path, json_ms, orjson_ms, len(encoded))
+        for encoding in encodings:
+            compress_ms, compressed = time_it(lambda: compress_data(encoded, encoding, level))
+            line += ' %9d %9.2f' % (len(compressed), compress_ms)
+        print(line)
+
+
+@cli.command('benchmark_queries')
+@click.option('-d', 'database_uri', required=True, help='URI of an empty scratch database, not the live one')
+@click.option('-u', 'users', default=10000, help='number of users in the synthetic dataset (default 10000)')
+@click.option('-n', 'iterations', default=20, help='number of executions per query (default 20)')
+def benchmark_queries(database_uri, users=10000, iterations=20):
+    """
+    Prints query plans and latencies for the hot queries on a synthetic dataset, without and with the indexes
+    """
+    from sqlalchemy import create_engine
+    from pebbles.query_benchmark import run_benchmark
+
+    engine = create_engine(database_uri)
+    try:
+        run_benchmark(engine, users=users, iterations=iterations)
+    except RuntimeError as e:
+        logging.warning(e)
+    finally:
+        engine.dispose()
+
+
 if __name__ == '__main__':
     cli()
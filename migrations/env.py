@@ -82,6 +82,10 @@ def run_migrations_online():
         )
 
         with context.begin_transaction():
+            # rewriting and indexing large tables can take a long time, do not apply the statement timeout of
+            # the API connections (DB_STATEMENT_TIMEOUT_MS) or of the database role to migrations
+            if connection.dialect.name == 'postgresql':
+                context.execute('SET statement_timeout = 0')
             context.run_migrations()
 
 
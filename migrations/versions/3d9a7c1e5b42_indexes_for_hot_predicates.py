@@ -0,0 +1,49 @@
+"""add indexes for frequently filtered columns
+
+Revision ID: 3d9a7c1e5b42
+Revises: 8c2f4e6a1d37
+Create Date: 2026-10-19 17:05:12.318406
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3d9a7c1e5b42'
+down_revision = '8c2f4e6a1d37'
+
+from alembic import op
+import sqlalchemy as sa
+
+# deleted rows make up most of these tables and are not looked up by state
+NOT_DELETED = sa.text("state != 'deleted'")
+
+
+def upgrade():
+    op.create_index('ix_workspace_memberships_user_id', 'workspace_memberships', ['user_id'])
+    op.create_index('ix_applications_workspace_id_status', 'applications', ['workspace_id', 'status'])
+    op.create_index(
+        'ix_application_sessions_user_id_active', 'application_sessions', ['user_id'],
+        postgresql_where=NOT_DELETED,
+    )
+    op.create_index(
+        'ix_application_sessions_state_active', 'application_sessions', ['state', 'to_be_deleted'],
+        postgresql_where=NOT_DELETED,
+    )
+    op.create_index(
+        'ix_application_sessions_application_id_state', 'application_sessions', ['application_id', 'state']
+    )
+    op.create_index('ix_tasks_state_create_ts', 'tasks', ['state', 'create_ts'])
+    op.create_index('ix_custom_images_workspace_id', 'custom_images', ['workspace_id'])
+    op.create_index('ix_custom_images_state_active', 'custom_images', ['state'], postgresql_where=NOT_DELETED)
+    op.create_index('ix_alerts_target_source_status', 'alerts', ['target', 'source', 'status'])
+
+
+def downgrade():
+    op.drop_index('ix_alerts_target_source_status', table_name='alerts')
+    op.drop_index('ix_custom_images_state_active', table_name='custom_images')
+    op.drop_index('ix_custom_images_workspace_id', table_name='custom_images')
+    op.drop_index('ix_tasks_state_create_ts', table_name='tasks')
+    op.drop_index('ix_application_sessions_application_id_state', table_name='application_sessions')
+    op.drop_index('ix_application_sessions_state_active', table_name='application_sessions')
+    op.drop_index('ix_application_sessions_user_id_active', table_name='application_sessions')
+    op.drop_index('ix_applications_workspace_id_status', table_name='applications')
+    op.drop_index('ix_workspace_memberships_user_id', table_name='workspace_memberships')
@@ -0,0 +1,49 @@
+"""unique keys for provisioning log lines and running logs
+
+Revision ID: 6f1b2d8e4a90
+Revises: 3d9a7c1e5b42
+Create Date: 2026-10-19 18:42:37.120954
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6f1b2d8e4a90'
+down_revision = '3d9a7c1e5b42'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # remove duplicate provisioning lines, keep one of each
+    op.execute("""
+        DELETE FROM application_session_logs a
+        USING application_session_logs b
+        WHERE a.log_type = 'provisioning' AND b.log_type = 'provisioning'
+            AND a.application_session_id = b.application_session_id
+            AND a.timestamp = b.timestamp
+            AND a.id > b.id
+    """)
+    # keep only the latest running log of each session
+    op.execute("""
+        DELETE FROM application_session_logs a
+        USING application_session_logs b
+        WHERE a.log_type = 'running' AND b.log_type = 'running'
+            AND a.application_session_id = b.application_session_id
+            AND (a.timestamp < b.timestamp OR (a.timestamp = b.timestamp AND a.id > b.id))
+    """)
+    op.create_index(
+        'ix_application_session_logs_provisioning', 'application_session_logs',
+        ['application_session_id', 'log_type', 'timestamp'], unique=True,
+        postgresql_where=sa.text("log_type = 'provisioning'"),
+    )
+    op.create_index(
+        'ix_application_session_logs_running', 'application_session_logs',
+        ['application_session_id', 'log_type'], unique=True,
+        postgresql_where=sa.text("log_type = 'running'"),
+    )
+
+
+def downgrade():
+    op.drop_index('ix_application_session_logs_running', table_name='application_session_logs')
+    op.drop_index('ix_application_session_logs_provisioning', table_name='application_session_logs')
@@ -0,0 +1,78 @@
+"""store JSON documents as jsonb, add an index on membership expiry policy kind
+
+Revision ID: 8c2f4e6a1d37
+Revises: 5b8e0c4d2a61
+Create Date: 2026-10-19 15:21:44.902117
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8c2f4e6a1d37'
+down_revision = '5b8e0c4d2a61'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+JSON_COLUMNS = (
+    ('users', 'annotations'),
+    ('workspaces', 'membership_expiry_policy'),
+    ('workspaces', 'membership_join_policy'),
+    ('workspaces', 'config'),
+    ('application_templates', 'base_config'),
+    ('application_templates', 'attribute_limits'),
+    ('applications', 'labels'),
+    ('applications', 'base_config'),
+    ('applications', 'config'),
+    ('applications', 'attribute_limits'),
+    ('application_sessions', 'provisioning_config'),
+    ('application_sessions', 'session_data'),
+    ('alerts', 'data'),
+    ('tasks', 'data'),
+    ('tasks', 'results'),
+    ('custom_images', 'definition'),
+)
+
+
+def upgrade():
+    # legacy rows can contain text that is not valid JSON, which would abort the type change
+    op.execute("""
+        CREATE FUNCTION pg_temp.is_valid_jsonb(value text) RETURNS boolean AS $$
+        BEGIN
+            PERFORM value::jsonb;
+            RETURN true;
+        EXCEPTION WHEN others THEN
+            RETURN false;
+        END;
+        $$ LANGUAGE plpgsql IMMUTABLE
+    """)
+    for table, column in JSON_COLUMNS:
+        # empty strings were read as empty documents and invalid JSON could not be read at all, store them as NULL
+        op.execute(
+            'UPDATE %s SET %s = NULL WHERE %s IS NOT NULL AND NOT pg_temp.is_valid_jsonb(%s)'
+            % (table, column, column, column)
+        )
+        op.alter_column(
+            table, column,
+            existing_type=sa.Text(),
+            type_=postgresql.JSONB(),
+            postgresql_using='%s::jsonb' % column,
+        )
+    op.execute('DROP FUNCTION pg_temp.is_valid_jsonb(text)')
+
+    op.create_index(
+        'ix_workspaces_membership_expiry_policy_kind', 'workspaces',
+        [sa.text("(membership_expiry_policy ->> 'kind')")],
+    )
+
+
+def downgrade():
+    op.drop_index('ix_workspaces_membership_expiry_policy_kind', table_name='workspaces')
+
+    for table, column in JSON_COLUMNS:
+        op.alter_column(
+            table, column,
+            existing_type=postgresql.JSONB(),
+            type_=sa.Text(),
+            postgresql_using='%s::text' % column,
+        )
@@ -0,0 +1,24 @@
+"""index for workspace member pagination
+
+Revision ID: 9b5e3f7a2c64
+Revises: e2b7f4c1d856
+Create Date: 2026-10-19 23:31:52.118304
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9b5e3f7a2c64'
+down_revision = 'e2b7f4c1d856'
+
+from alembic import op
+
+
+def upgrade():
+    op.create_index(
+        'ix_workspace_memberships_workspace_id_created_at', 'workspace_memberships',
+        ['workspace_id', 'created_at', 'user_id'],
+    )
+
+
+def downgrade():
+    op.drop_index('ix_workspace_memberships_workspace_id_created_at', table_name='workspace_memberships')
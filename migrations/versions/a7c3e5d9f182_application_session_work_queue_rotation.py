@@ -0,0 +1,38 @@
+"""rotate the worker session queue by the last processing attempt
+
+Revision ID: a7c3e5d9f182
+Revises: 9b5e3f7a2c64
+Create Date: 2026-10-20 09:12:37.640218
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e5d9f182'
+down_revision = '9b5e3f7a2c64'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('application_sessions', sa.Column('worker_attempted_at', sa.DateTime(), nullable=True))
+    # the queue also covers running sessions for the maximum lifetime check
+    op.drop_index('ix_application_sessions_work_queue', table_name='application_sessions')
+    op.create_index(
+        'ix_application_sessions_work_queue', 'application_sessions',
+        [sa.text('coalesce(worker_attempted_at, updated_at)')],
+        postgresql_where=sa.text(
+            "state != 'deleted' AND (state IN ('queueing', 'starting', 'running') OR to_be_deleted)"
+        ),
+    )
+
+
+def downgrade():
+    op.drop_index('ix_application_sessions_work_queue', table_name='application_sessions')
+    op.create_index(
+        'ix_application_sessions_work_queue', 'application_sessions', ['updated_at'],
+        postgresql_where=sa.text(
+            "state != 'deleted' AND (state IN ('queueing', 'starting') OR to_be_deleted OR log_fetch_pending)"
+        ),
+    )
+    op.drop_column('application_sessions', 'worker_attempted_at')
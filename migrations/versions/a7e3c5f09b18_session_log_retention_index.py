@@ -0,0 +1,25 @@
+"""index provisioning log lines by age for retention pruning
+
+Revision ID: a7e3c5f09b18
+Revises: 6f1b2d8e4a90
+Create Date: 2026-10-19 20:11:05.638217
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a7e3c5f09b18'
+down_revision = '6f1b2d8e4a90'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index(
+        'ix_application_session_logs_provisioning_timestamp', 'application_session_logs', ['timestamp'],
+        postgresql_where=sa.text("log_type = 'provisioning'"),
+    )
+
+
+def downgrade():
+    op.drop_index('ix_application_session_logs_provisioning_timestamp', table_name='application_session_logs')
@@ -0,0 +1,49 @@
+"""archive table for deleted application sessions
+
+Revision ID: c4d8a2b6e913
+Revises: a7e3c5f09b18
+Create Date: 2026-10-19 21:34:50.281377
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c4d8a2b6e913'
+down_revision = 'a7e3c5f09b18'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    # deleted sessions are moved here in batches by the maintenance job, no data is copied in the migration
+    op.create_table(
+        'application_session_archive',
+        sa.Column('id', sa.String(length=32), nullable=False),
+        sa.Column('name', sa.String(length=64), nullable=True),
+        sa.Column('user_id', sa.String(length=32), nullable=True),
+        sa.Column('application_id', sa.String(length=32), nullable=True),
+        sa.Column('workspace_id', sa.String(length=32), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('provisioned_at', sa.DateTime(), nullable=True),
+        sa.Column('deprovisioned_at', sa.DateTime(), nullable=True),
+        sa.Column('errored', sa.Boolean(), nullable=True),
+        sa.Column('is_warm', sa.Boolean(), nullable=True),
+        sa.Column('error_msg', sa.String(length=256), nullable=True),
+        sa.Column('provisioning_config', postgresql.JSONB(), nullable=True),
+        sa.Column('archived_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_application_session_archive'))
+    )
+    op.create_index(
+        op.f('ix_application_session_archive_user_id'), 'application_session_archive', ['user_id'], unique=False
+    )
+    op.create_index(
+        op.f('ix_application_session_archive_workspace_id'), 'application_session_archive', ['workspace_id'],
+        unique=False
+    )
+
+
+def downgrade():
+    op.drop_index(op.f('ix_application_session_archive_workspace_id'), table_name='application_session_archive')
+    op.drop_index(op.f('ix_application_session_archive_user_id'), table_name='application_session_archive')
+    op.drop_table('application_session_archive')
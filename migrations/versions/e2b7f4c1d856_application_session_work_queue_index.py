@@ -0,0 +1,27 @@
+"""partial index for the worker session queue
+
+Revision ID: e2b7f4c1d856
+Revises: c4d8a2b6e913
+Create Date: 2026-10-19 22:48:16.405731
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e2b7f4c1d856'
+down_revision = 'c4d8a2b6e913'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index(
+        'ix_application_sessions_work_queue', 'application_sessions', ['updated_at'],
+        postgresql_where=sa.text(
+            "state != 'deleted' AND (state IN ('queueing', 'starting') OR to_be_deleted OR log_fetch_pending)"
+        ),
+    )
+
+
+def downgrade():
+    op.drop_index('ix_application_sessions_work_queue', table_name='application_sessions')
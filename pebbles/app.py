@@ -1,16 +1,23 @@
 import logging
 import os as os
+from datetime import datetime, timezone, timedelta
 
 import flask_restful as restful
-from flask import Flask
+from flask import Flask, g
 from flask_bcrypt import Bcrypt
 from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
 
 from pebbles.config import TestConfig, RuntimeConfig
+from pebbles.db_pool import get_engine_options, init_pool_telemetry
+from pebbles.db_replica import RoutingSession, init_replica, pin_to_primary_after_write
+from pebbles.notifications import init_notifications
+from pebbles.profiling import init_request_profiling
+from pebbles.query_stats import init_query_stats
+from pebbles.representations import output_json, compress_response
 from pebbles.utils import init_logging
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options=dict(class_=RoutingSession))
 migrate = Migrate()
 bcrypt = Bcrypt()
 
@@ -56,8 +63,20 @@ def create_app(test_config=None):
         app.config['SQLALCHEMY_DATABASE_URI'] = (app.config['SQLALCHEMY_DATABASE_URI']
                                                  .replace('__PASSWORD__', app.config['DATABASE_PASSWORD']))
 
+    # connection pool sizing and timeouts
+    engine_options = get_engine_options(app.config)
+    if engine_options:
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+
     bcrypt.init_app(app)
     db.init_app(app)
+    init_pool_telemetry(app, db)
+    init_replica(app)
+    init_notifications(app, db)
+
+    # models import db from this module, import the cache that depends on them late
+    from pebbles.catalogue_cache import init_catalogue_cache
+    init_catalogue_cache(app, RoutingSession)
 
     # Enable debugging SQLAlchemy queries. Level must be set as an integer, take a look at logging constants for values.
     # https://docs.python.org/3.9/library/logging.html#logging-levels
@@ -68,13 +87,32 @@ def create_app(test_config=None):
     # setup API endpoints
     init_api(app)
 
+    # registered before the other hooks so that the statistics and profiles cover them too
+    init_query_stats(app)
+    init_request_profiling(app)
+
+    from pebbles.views.commons import CACHE_POLICY_NO_STORE, CACHE_POLICY_PUBLIC, CACHE_POLICY_PUBLIC_MAX_AGE
+
+    @app.before_request
+    def reset_response_caching():
+        # app context and g can outlive a request, e.g. in tests
+        g.pop('cache_policy', None)
+        g.pop('etag', None)
+
     @app.after_request
     def add_headers(r):
         r.headers['X-Content-Type-Options'] = 'nosniff'
         r.headers['X-XSS-Protection'] = '1; mode=block'
-        r.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-        r.headers['Pragma'] = 'no-cache'
-        r.headers['Expires'] = '0'
+        # handlers can opt in to a more relaxed caching policy, errors are never cached
+        policy = g.get('cache_policy', CACHE_POLICY_NO_STORE) if r.status_code in (200, 304) else CACHE_POLICY_NO_STORE
+        r.headers['Cache-Control'] = policy
+        if policy == CACHE_POLICY_PUBLIC:
+            r.expires = datetime.now(timezone.utc) + timedelta(seconds=CACHE_POLICY_PUBLIC_MAX_AGE)
+        else:
+            r.headers['Pragma'] = 'no-cache'
+            r.headers['Expires'] = '0'
+        if g.get('etag') and r.status_code in (200, 304):
+            r.set_etag(g.etag)
         r.headers['Strict-Transport-Security'] = 'max-age=31536000'
         # does not work without unsafe-inline / unsafe-eval
         csp_list = [
@@ -92,7 +130,10 @@ def create_app(test_config=None):
             r.headers['Access-Control-Allow-Headers'] = '*, Authorization'
             r.headers['Access-Control-Allow-Methods'] = '*'
 
-        return r
+        # make clients that have just written read from the primary database
+        pin_to_primary_after_write(r)
+
+        return compress_response(r)
 
     return app
 
@@ -102,22 +143,26 @@ def init_api(app: Flask):
     from pebbles.views.app_version import AppVersionList
     from pebbles.views.application_categories import ApplicationCategoryList
     from pebbles.views.application_sessions import ApplicationSessionList, ApplicationSessionView, \
-        ApplicationSessionLogs
+        ApplicationSessionLogs, ApplicationSessionLogRetention, ApplicationSessionArchiveList
     from pebbles.views.application_templates import ApplicationTemplateList, ApplicationTemplateView, \
         ApplicationTemplateCopy
     from pebbles.views.applications import ApplicationList, ApplicationView, ApplicationCopy, \
-        ApplicationAttributeLimits
+        ApplicationAttributeLimits, ApplicationImageList
     from pebbles.views.clusters import ClusterList
     from pebbles.views.custom_images import CustomImageList, CustomImageView, CustomImageBaseImageList
+    from pebbles.views.events import ApplicationSessionEventStream
     from pebbles.views.helps import HelpsList
     from pebbles.views.locks import LockView, LockList
     from pebbles.views.messages import MessageList, MessageView
+    from pebbles.views.profiles import RequestProfileList, RequestProfileView
     from pebbles.views.public_config import PublicConfigList, PublicStructuredConfigList
+    from pebbles.views.query_stats import QueryStatsList
     from pebbles.views.service_announcements import ServiceAnnouncementList, ServiceAnnouncementListPublic, \
         ServiceAnnouncementListAdmin, ServiceAnnouncementViewAdmin
     from pebbles.views.sessions import SessionView
     from pebbles.views.tasks import TaskList, TaskView, TaskAddResults
     from pebbles.views.users import UserList, UserView, UserRequestDeletion, UserWorkspaceMembershipList
+    from pebbles.views.warm_pools import WarmPoolList, WarmPoolView
     from pebbles.views.workspaces import (
         WorkspaceClearMembers, WorkspaceTransferOwnership, WorkspaceAccounting,
         WorkspaceMemoryLimitGiB, WorkspaceModifyUserFolderSize,
@@ -131,6 +176,7 @@ def init_api(app: Flask):
     from pebbles.views.sso import oauth2_login
 
     api = restful.Api(app)
+    api.representations['application/json'] = output_json
     api_root = '/api/v1'
     api.add_resource(UserList, api_root + '/users', methods=['GET', 'POST'])
     api.add_resource(UserView, api_root + '/users/<string:user_id>', methods=['GET', 'DELETE', 'PATCH'])
@@ -177,6 +223,7 @@ def init_api(app: Flask):
     api.add_resource(ApplicationView, api_root + '/applications/<string:application_id>')
     api.add_resource(ApplicationCopy, api_root + '/applications/<string:application_id>/copy')
     api.add_resource(ApplicationAttributeLimits, api_root + '/applications/<string:application_id>/attribute_limits')
+    api.add_resource(ApplicationImageList, api_root + '/application_images')
     api.add_resource(ApplicationSessionList, api_root + '/application_sessions')
     api.add_resource(
         ApplicationSessionView,
@@ -186,6 +233,11 @@ def init_api(app: Flask):
         ApplicationSessionLogs,
         api_root + '/application_sessions/<string:application_session_id>/logs',
         methods=['GET', 'PATCH', 'DELETE'])
+    api.add_resource(ApplicationSessionLogRetention, api_root + '/application_session_logs/prune')
+    api.add_resource(ApplicationSessionArchiveList, api_root + '/application_session_archive')
+    api.add_resource(ApplicationSessionEventStream, api_root + '/application_session_events')
+    api.add_resource(WarmPoolList, api_root + '/warm_pools')
+    api.add_resource(WarmPoolView, api_root + '/warm_pools/<string:application_id>')
     api.add_resource(ClusterList, api_root + '/clusters')
     api.add_resource(PublicConfigList, api_root + '/config')
     api.add_resource(PublicStructuredConfigList, api_root + '/structured_config')
@@ -198,6 +250,9 @@ def init_api(app: Flask):
     api.add_resource(AlertView, api_root + '/alerts/<string:id>')
     api.add_resource(AlertReset, api_root + '/alert_reset/<string:target>/<string:source>')
     api.add_resource(SystemStatus, api_root + '/status')
+    api.add_resource(RequestProfileList, api_root + '/request_profiles')
+    api.add_resource(RequestProfileView, api_root + '/request_profiles/<string:profile_id>')
+    api.add_resource(QueryStatsList, api_root + '/query_stats', methods=['GET', 'DELETE'])
     api.add_resource(TaskList, api_root + '/tasks')
     api.add_resource(
         TaskView,
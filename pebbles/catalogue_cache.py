@@ -0,0 +1,90 @@
+"""
+Process level cache for the application catalogue served by ApplicationList.
+
+Catalogues are cached per set of workspace memberships (workspace id and manager role), so users with the same
+memberships share the entries. Entries are dropped when the generation counter is bumped, which happens when
+a session in this process commits changes to applications, templates, workspaces or memberships. Changes made
+by other processes are caught by a change marker in the cache key and, for templates, by the entry TTL.
+"""
+import threading
+import time
+from collections import OrderedDict
+from itertools import chain
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+
+from pebbles.models import Application, ApplicationTemplate, Workspace, WorkspaceMembership
+
+# models whose changes invalidate the catalogue
+CATALOGUE_MODELS = (Application, ApplicationTemplate, Workspace, WorkspaceMembership)
+
+
+class CatalogueCache:
+    def __init__(self, ttl=60, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.generation = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if not entry:
+                return None
+            expiry_ts, value = entry
+            if expiry_ts < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, generation):
+        """Store a value that was computed when the cache was at given generation"""
+        with self.lock:
+            # the catalogue changed while the value was being computed
+            if generation != self.generation:
+                return
+            self.entries[key] = (time.time() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+
+def get_catalogue_cache():
+    return current_app.extensions.get('pebbles_catalogue_cache')
+
+
+def mark_catalogue_changes(session, flush_context):
+    if any(isinstance(obj, CATALOGUE_MODELS) for obj in chain(session.new, session.dirty, session.deleted)):
+        session.info['catalogue_changed'] = True
+
+
+def invalidate_on_commit(session):
+    if session.info.pop('catalogue_changed', False) and has_app_context():
+        cache = get_catalogue_cache()
+        if cache:
+            cache.invalidate()
+
+
+def discard_on_rollback(session):
+    session.info.pop('catalogue_changed', None)
+
+
+def init_catalogue_cache(app, session_class):
+    """Create the catalogue cache for the app and hook the invalidation to session commits"""
+    if not app.config['CATALOGUE_CACHE_TTL']:
+        return None
+    cache = CatalogueCache(ttl=app.config['CATALOGUE_CACHE_TTL'], max_entries=app.config['CATALOGUE_CACHE_MAX_ENTRIES'])
+    app.extensions['pebbles_catalogue_cache'] = cache
+    if not event.contains(session_class, 'after_flush', mark_catalogue_changes):
+        event.listen(session_class, 'after_flush', mark_catalogue_changes)
+        event.listen(session_class, 'after_commit', invalidate_on_commit)
+        event.listen(session_class, 'after_rollback', discard_on_rollback)
+    return cache
@@ -135,10 +135,15 @@ class PBClient(ClientBase):
 
         return resp.json()
 
-    def get_application_sessions(self, limit=0):
-        query = 'application_sessions'
+    def get_application_sessions(self, limit=0, work_queue=False):
+        query_opts = []
         if limit:
-            query += f'?limit={limit}'
+            query_opts.append(f'limit={limit}')
+        if work_queue:
+            query_opts.append('work_queue=1')
+        query = 'application_sessions'
+        if query_opts:
+            query += '?' + '&'.join(query_opts)
         resp = self.do_get(query)
         if resp.status_code != 200:
             raise RuntimeError('Cannot fetch data for application_sessions, %s' % resp.reason)
@@ -163,6 +168,33 @@ class PBClient(ClientBase):
 
         return resp.json()
 
+    def get_application_images(self):
+        resp = self.do_get('application_images')
+        if resp.status_code != 200:
+            raise RuntimeError('Cannot fetch data for application_images, %s' % resp.reason)
+        return resp.json()
+
+    def delete_application_session(self, application_session_id):
+        resp = self.do_delete('application_sessions/%s' % application_session_id)
+        if resp.status_code not in (202, 404):
+            raise RuntimeError(
+                'Cannot delete application_session %s, %s' % (application_session_id, resp.reason))
+        return resp
+
+    def get_warm_pools(self):
+        resp = self.do_get('warm_pools')
+        if resp.status_code != 200:
+            raise RuntimeError('Cannot fetch data for warm_pools, %s' % resp.reason)
+        return resp.json()
+
+    def create_warm_application_session(self, application_id):
+        resp = self.do_post('warm_pools/%s' % application_id)
+        if resp.status_code == 409:
+            return None
+        if resp.status_code != 200:
+            raise RuntimeError('Cannot create warm session for application %s, %s' % (application_id, resp.reason))
+        return resp.json()
+
     def add_provisioning_log(self, application_session_id, message, timestamp=None, log_type='provisioning',
                              log_level='info'):
         payload = dict(
@@ -175,6 +207,16 @@ class PBClient(ClientBase):
         )
         self.do_patch('application_sessions/%s/logs' % application_session_id, json_data=payload)
 
+    def add_provisioning_logs(self, application_session_id, log_entries, log_type='provisioning', log_level='info'):
+        """Add several log lines in one request, log_entries is a list of (timestamp, message) tuples"""
+        payload = dict(
+            log_records=[
+                dict(timestamp=timestamp, log_type=log_type, log_level=log_level, message=message)
+                for timestamp, message in log_entries
+            ]
+        )
+        self.do_patch('application_sessions/%s/logs' % application_session_id, json_data=payload)
+
     def update_application_session_running_logs(self, application_session_id, logs):
         payload = dict(
             log_record=dict(
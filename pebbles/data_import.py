@@ -0,0 +1,115 @@
+"""
+Batched import of annotated YAML data, see devel_dataset.yaml for an example.
+
+Objects are read from the YAML stream in chunks of given batch size, grouped by model and written with one
+INSERT ... ON CONFLICT statement per model and set of columns. Existing rows, matched by primary key, are either
+skipped or updated with the columns present in the data. Within a chunk the models are written in foreign key
+dependency order, across chunks the order of the file is kept. Importing the same data again is a no-op, or an
+update with -u.
+"""
+import itertools
+import logging
+from collections import Counter, defaultdict
+
+import sqlalchemy as sa
+
+from pebbles.db_upsert import insert_for
+from pebbles.models import db
+
+DATA_IMPORT_BATCH_SIZE = 500
+
+
+def get_row(obj):
+    """Return the column values set in a model object, keyed by column name"""
+    mapper = sa.inspect(type(obj))
+    state_dict = sa.inspect(obj).dict
+    return {
+        prop.columns[0].key: state_dict[prop.key]
+        for prop in mapper.column_attrs
+        if prop.key in state_dict
+    }
+
+
+def write_rows(table, rows, update):
+    """Upsert rows with the same set of columns to a table, returns counts of inserted, updated and skipped rows"""
+    pk_columns = list(table.primary_key.columns)
+    pk_keys = set(c.key for c in pk_columns)
+    if not pk_keys or not pk_keys <= rows[0].keys():
+        raise RuntimeError('rows for %s do not have values for the primary key' % table.name)
+
+    def pk_of(row):
+        return tuple(row[c.key] for c in pk_columns)
+
+    # a row can be affected only once in a statement, the last occurrence wins
+    num_rows = len(rows)
+    rows = list({pk_of(row): row for row in rows}.values())
+
+    # the existing rows are looked up first to report what happened to each row
+    existing = set(
+        tuple(row) for row in db.session.execute(
+            sa.select(*pk_columns).where(sa.tuple_(*pk_columns).in_([pk_of(row) for row in rows]))
+        )
+    )
+    num_existing = len(existing)
+    num_duplicates = num_rows - len(rows)
+
+    stmt = insert_for(db.session, table)
+    if update:
+        update_columns = {key: stmt.excluded[key] for key in rows[0] if key not in pk_keys}
+        # ON CONFLICT DO UPDATE does not apply onupdate defaults by itself, use the fresh insert default instead
+        update_columns.update({
+            c.key: stmt.excluded[c.key] for c in table.columns
+            if c.onupdate is not None and c.default is not None and c.key not in rows[0]
+        })
+        if update_columns:
+            db.session.execute(stmt.on_conflict_do_update(index_elements=pk_columns, set_=update_columns), rows)
+            return dict(inserted=len(rows) - num_existing, updated=num_existing, skipped=num_duplicates)
+
+    new_rows = [row for row in rows if pk_of(row) not in existing]
+    inserted = 0
+    if new_rows:
+        # rows can still conflict with other unique constraints, those are skipped as well
+        result = db.session.execute(stmt.on_conflict_do_nothing().returning(*pk_columns), new_rows)
+        inserted = len(result.all())
+    return dict(inserted=inserted, updated=0, skipped=num_rows - inserted)
+
+
+def write_objects(objects, update=False):
+    """Write a chunk of model objects, returns counts per model"""
+    rows_by_table = defaultdict(list)
+    for obj in objects:
+        if not hasattr(type(obj), '__table__'):
+            raise RuntimeError('cannot import %s, it is not a model object' % type(obj).__name__)
+        rows_by_table[type(obj).__table__].append(get_row(obj))
+
+    counts = defaultdict(Counter)
+    for table in db.metadata.sorted_tables:
+        # rows with the same columns share a statement, columns that are not set get their defaults
+        rows_by_columns = defaultdict(list)
+        for row in rows_by_table.get(table, []):
+            rows_by_columns[frozenset(row.keys())].append(row)
+        for rows in rows_by_columns.values():
+            counts[table.name].update(write_rows(table, rows, update))
+    return counts
+
+
+def import_data(objects, update=False, batch_size=DATA_IMPORT_BATCH_SIZE):
+    """
+    Import model objects from an iterable, committing once per batch. Returns inserted, updated and skipped
+    counts per table.
+    """
+    counts = defaultdict(Counter)
+    objects = iter(objects)
+    while True:
+        batch = list(itertools.islice(objects, batch_size))
+        if not batch:
+            break
+        try:
+            for table_name, table_counts in write_objects(batch, update).items():
+                counts[table_name].update(table_counts)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        logging.info('imported a batch of %d objects', len(batch))
+    return counts
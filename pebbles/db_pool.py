@@ -0,0 +1,183 @@
+"""
+Database connection pool configuration and telemetry for the API processes.
+
+The pool options are driven by configuration (see DB_POOL_* in pebbles.config). PoolTelemetry follows the
+pool events and keeps track of how long requests wait for a connection, how close the pool is to being
+exhausted and how often connections are opened and closed. The numbers are logged periodically and
+warnings are logged when the pool saturates.
+"""
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+
+def get_engine_options(config, uri=None):
+    """Return SQLALCHEMY_ENGINE_OPTIONS for the given configuration, optionally for another database"""
+    uri = uri if uri else config['SQLALCHEMY_DATABASE_URI']
+    # SQLite, used in unit tests, does not benefit from a connection pool
+    if uri.startswith('sqlite'):
+        return dict()
+
+    options = dict(
+        poolclass=TelemetryQueuePool,
+        pool_size=config['DB_POOL_SIZE'],
+        max_overflow=config['DB_POOL_MAX_OVERFLOW'],
+        pool_timeout=config['DB_POOL_TIMEOUT'],
+        pool_recycle=config['DB_POOL_RECYCLE'],
+        pool_pre_ping=config['DB_POOL_PRE_PING'],
+    )
+    if config['DB_STATEMENT_TIMEOUT_MS'] and uri.startswith('postgresql'):
+        options['connect_args'] = dict(options='-c statement_timeout=%d' % config['DB_STATEMENT_TIMEOUT_MS'])
+
+    return options
+
+
+class TelemetryQueuePool(QueuePool):
+    """QueuePool that reports the time spent waiting for a connection to the attached PoolTelemetry"""
+
+    telemetry = None
+
+    def _do_get(self):
+        if not self.telemetry:
+            return super()._do_get()
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.telemetry.record_checkout_wait(time.perf_counter() - start)
+
+    def recreate(self):
+        # pool is recreated on engine.dispose(), carry the telemetry over to the new pool
+        pool = super().recreate()
+        pool.telemetry = self.telemetry
+        return pool
+
+
+class PoolTelemetry:
+    """Collects connection pool statistics from pool events"""
+
+    def __init__(self, capacity, slow_checkout_ms=500, report_interval=300, logger=None):
+        self.capacity = capacity
+        self.slow_checkout_secs = slow_checkout_ms / 1000
+        self.report_interval = report_interval
+        self.logger = logger if logger else logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.pool = None
+        self.last_report_ts = time.time()
+        # connections currently in use, not reset between the reporting periods
+        self.checked_out = 0
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.checkouts = 0
+            self.checkout_wait_total = 0.0
+            self.checkout_wait_max = 0.0
+            self.slow_checkouts = 0
+            self.checked_out_peak = self.checked_out
+            self.saturated_checkouts = 0
+            self.connects = 0
+            self.closes = 0
+            self.invalidations = 0
+
+    def attach(self, engine):
+        """Start following the pool events of given engine"""
+        pool = engine.pool
+        if isinstance(pool, TelemetryQueuePool):
+            pool.telemetry = self
+        self.pool = pool
+        event.listen(pool, 'connect', self.on_connect)
+        event.listen(pool, 'close', self.on_close)
+        event.listen(pool, 'invalidate', self.on_invalidate)
+        event.listen(pool, 'checkout', self.on_checkout)
+        event.listen(pool, 'checkin', self.on_checkin)
+
+    def record_checkout_wait(self, wait):
+        with self.lock:
+            self.checkout_wait_total += wait
+            self.checkout_wait_max = max(self.checkout_wait_max, wait)
+            if wait >= self.slow_checkout_secs:
+                self.slow_checkouts += 1
+        if wait >= self.slow_checkout_secs:
+            self.logger.warning('database connection checkout took %.3fs', wait)
+
+    def on_connect(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.connects += 1
+
+    def on_close(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.closes += 1
+
+    def on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self.lock:
+            self.invalidations += 1
+        self.logger.info('database connection invalidated: %s', exception)
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self.lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.checked_out_peak = max(self.checked_out_peak, self.checked_out)
+            saturated = self.capacity and self.checked_out >= self.capacity
+            if saturated:
+                self.saturated_checkouts += 1
+        if saturated:
+            self.logger.warning('database connection pool saturated, %d connections in use', self.checked_out)
+
+    def on_checkin(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.checked_out = max(self.checked_out - 1, 0)
+        if self.report_interval and time.time() - self.last_report_ts > self.report_interval:
+            self.report()
+
+    def get_stats(self):
+        with self.lock:
+            return dict(
+                pid=os.getpid(),
+                capacity=self.capacity,
+                checked_out=self.checked_out,
+                checked_out_peak=self.checked_out_peak,
+                saturation=self.checked_out / self.capacity if self.capacity else 0.0,
+                saturated_checkouts=self.saturated_checkouts,
+                checkouts=self.checkouts,
+                checkout_wait_avg_ms=1000 * self.checkout_wait_total / self.checkouts if self.checkouts else 0.0,
+                checkout_wait_max_ms=1000 * self.checkout_wait_max,
+                slow_checkouts=self.slow_checkouts,
+                connects=self.connects,
+                closes=self.closes,
+                invalidations=self.invalidations,
+                pool_status=self.pool.status() if self.pool else None,
+            )
+
+    def report(self):
+        """Log the statistics collected since the last report and start a new period"""
+        self.last_report_ts = time.time()
+        stats = self.get_stats()
+        self.logger.info(
+            'database pool: checkouts %d, wait avg %.1fms max %.1fms, slow %d, in use peak %d/%d, saturated %d, '
+            'connects %d, closes %d, invalidations %d',
+            stats['checkouts'], stats['checkout_wait_avg_ms'], stats['checkout_wait_max_ms'], stats['slow_checkouts'],
+            stats['checked_out_peak'], stats['capacity'], stats['saturated_checkouts'],
+            stats['connects'], stats['closes'], stats['invalidations'],
+        )
+        self.reset()
+
+
+def init_pool_telemetry(app, db):
+    """Attach pool telemetry to the engine of the app, if it uses a connection pool"""
+    if not issubclass(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}).get('poolclass', object), QueuePool):
+        return None
+    telemetry = PoolTelemetry(
+        capacity=app.config['DB_POOL_SIZE'] + max(app.config['DB_POOL_MAX_OVERFLOW'], 0),
+        slow_checkout_ms=app.config['DB_POOL_SLOW_CHECKOUT_MS'],
+        report_interval=app.config['DB_POOL_TELEMETRY_INTERVAL'],
+    )
+    with app.app_context():
+        telemetry.attach(db.engine)
+    app.extensions['pebbles_pool_telemetry'] = telemetry
+    return telemetry
@@ -0,0 +1,155 @@
+"""
+Optional routing of read-only queries to a PostgreSQL read replica.
+
+GET handlers that only read from the database are decorated with @replica_read. When a replica has
+been configured (SQLALCHEMY_REPLICA_DATABASE_URI), the queries in those handlers are sent to the replica,
+except when
+
+- the replica is lagging behind the primary more than DB_REPLICA_MAX_LAG_SECS, or the lag cannot be checked
+- the client has recently made a write request. Write requests set a short-lived cookie, so that the same
+  client reads its own writes from the primary (browsers and pebbles.client.PBClient keep cookies)
+
+Flushes and everything outside the decorated handlers always go to the primary.
+"""
+import functools
+import logging
+import threading
+import time
+
+from flask import current_app, g, has_app_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, text
+
+from pebbles.db_pool import get_engine_options
+
+# cookie that pins the client to the primary database after a write
+READ_PRIMARY_COOKIE = 'pb_read_primary_until'
+
+REPLICA_LAG_QUERY = """
+SELECT CASE
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+END
+"""
+
+
+class ReplicaRouter:
+    """Holds the replica engine and keeps track of the replication lag"""
+
+    def __init__(self, engine, max_lag_secs, lag_check_interval, read_your_writes_secs):
+        self.engine = engine
+        self.max_lag_secs = max_lag_secs
+        self.lag_check_interval = lag_check_interval
+        self.read_your_writes_secs = read_your_writes_secs
+        self.lock = threading.Lock()
+        self.lag = None
+        self.lag_checked_ts = 0
+
+    def measure_lag(self):
+        """Return the replication lag in seconds, zero for other databases than PostgreSQL"""
+        if self.engine.dialect.name != 'postgresql':
+            return 0.0
+        with self.engine.connect() as conn:
+            lag = conn.execute(text(REPLICA_LAG_QUERY)).scalar()
+        return float(lag) if lag is not None else None
+
+    def get_lag(self):
+        """Return the cached replication lag, refreshing it when it is older than the check interval"""
+        if time.time() - self.lag_checked_ts < self.lag_check_interval:
+            return self.lag
+        # only one thread checks the lag, the others use the previous value
+        if not self.lock.acquire(blocking=False):
+            return self.lag
+        try:
+            try:
+                lag = self.measure_lag()
+            except Exception as e:
+                logging.warning('checking replica lag failed: %s', e)
+                lag = None
+            if lag is not None and lag > self.max_lag_secs:
+                logging.warning('replica lag %s exceeds the limit, reading from primary', lag)
+            self.lag = lag
+            self.lag_checked_ts = time.time()
+        finally:
+            self.lock.release()
+        return self.lag
+
+    def is_usable(self):
+        lag = self.get_lag()
+        return lag is not None and lag <= self.max_lag_secs
+
+
+def init_replica(app):
+    """Create the replica engine if a replica has been configured"""
+    uri = app.config.get('SQLALCHEMY_REPLICA_DATABASE_URI')
+    if not uri:
+        return None
+    if app.config['DATABASE_PASSWORD']:
+        uri = uri.replace('__PASSWORD__', app.config['DATABASE_PASSWORD'])
+    router = ReplicaRouter(
+        engine=create_engine(uri, **get_engine_options(app.config, uri)),
+        max_lag_secs=app.config['DB_REPLICA_MAX_LAG_SECS'],
+        lag_check_interval=app.config['DB_REPLICA_LAG_CHECK_INTERVAL'],
+        read_your_writes_secs=app.config['DB_REPLICA_READ_YOUR_WRITES_SECS'],
+    )
+    app.extensions['pebbles_replica'] = router
+    logging.info('read replica enabled')
+    return router
+
+
+def get_replica_router():
+    return current_app.extensions.get('pebbles_replica')
+
+
+def can_read_from_replica():
+    """Check if the queries in the current request can be served from the replica"""
+    router = get_replica_router()
+    if not router or request.method != 'GET':
+        return False
+    # read-your-writes: the client has made changes recently
+    try:
+        if float(request.cookies.get(READ_PRIMARY_COOKIE, 0)) > time.time():
+            return False
+    except ValueError:
+        pass
+
+    return router.is_usable()
+
+
+def replica_read(f):
+    """Decorator for GET handlers that only read from the database"""
+
+    @functools.wraps(f)
+    def decorated(*args, **kwargs):
+        g.use_replica = can_read_from_replica()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            g.use_replica = False
+
+    return decorated
+
+
+def pin_to_primary_after_write(response):
+    """Set the read-your-writes cookie on responses to successful write requests"""
+    router = get_replica_router()
+    if router and request.method in ('POST', 'PUT', 'PATCH', 'DELETE') and response.status_code < 400:
+        response.set_cookie(
+            READ_PRIMARY_COOKIE,
+            str(int(time.time() + router.read_your_writes_secs)),
+            max_age=router.read_your_writes_secs,
+            httponly=True,
+            samesite='Strict',
+        )
+    return response
+
+
+class RoutingSession(Session):
+    """Session that sends queries to the replica when the current request has been marked replica-safe"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_app_context() and g.get('use_replica'):
+            router = get_replica_router()
+            if router:
+                return router.engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
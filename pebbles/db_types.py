@@ -0,0 +1,320 @@
+"""
+Column types and SQL helpers for JSON documents stored in the database.
+
+JSON documents (configs, policies, task data) are stored as JSONB on PostgreSQL, so that their contents can be
+indexed and queried in SQL, and as JSON text on SQLite which is used in unit tests. On the Python side the
+columns hold the serialised JSON text like before, models decode it in their hybrid properties.
+
+json_field() extracts a top level key from a JSON column and renders the same expression that the expression
+indexes in the migrations are built on, so that PostgreSQL can use them.
+
+epoch_seconds() converts a naive UTC timestamp column to seconds since the epoch, for comparing timestamps and
+durations in SQL the same way on both databases.
+
+load_json_column() and store_json_column() are used by the hybrid properties of the models. The parsed documents
+are memoized per instance, so that hot code paths do not parse the same text over and over.
+"""
+import copy
+import json
+import weakref
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql import expression
+from sqlalchemy.sql.visitors import InternalTraversal
+
+
+# key in the instance __dict__ for the parsed JSON documents
+JSON_MEMO_KEY = '_json_memo'
+
+
+class JSONBText(JSONB):
+    """JSONB that is bound and fetched as JSON text, the driver and casts in SQL do the conversions"""
+
+    def bind_processor(self, dialect):
+        return None
+
+    def result_processor(self, dialect, coltype):
+        return None
+
+
+class JSONText(sa.types.TypeDecorator):
+    """JSON document held as text in Python, stored as JSONB on PostgreSQL and as text elsewhere"""
+    impl = sa.Text
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(JSONBText())
+        return dialect.type_descriptor(sa.Text())
+
+    def column_expression(self, column):
+        return postgresql_cast(column, 'TEXT')
+
+
+class postgresql_cast(expression.ColumnElement):
+    """CAST to given type on PostgreSQL, the plain expression on other databases"""
+    inherit_cache = True
+    _traverse_internals = [
+        ('clause', InternalTraversal.dp_clauseelement),
+        ('type_name', InternalTraversal.dp_string),
+    ]
+
+    def __init__(self, clause, type_name):
+        self.clause = clause
+        self.type_name = type_name
+        self.type = clause.type
+
+
+@compiles(postgresql_cast)
+def compile_cast(element, compiler, **kw):
+    return compiler.process(element.clause, **kw)
+
+
+@compiles(postgresql_cast, 'postgresql')
+def compile_cast_postgresql(element, compiler, **kw):
+    return 'CAST(%s AS %s)' % (compiler.process(element.clause, **kw), element.type_name)
+
+
+class json_field(expression.ColumnElement):
+    """Text value of a top level key in a JSON column"""
+    inherit_cache = True
+    type = sa.Text()
+    _traverse_internals = [
+        ('column', InternalTraversal.dp_clauseelement),
+        ('key', InternalTraversal.dp_string),
+    ]
+
+    def __init__(self, column, key):
+        self.column = column
+        self.key = key
+
+
+@compiles(json_field)
+def compile_json_field(element, compiler, **kw):
+    path = '$.%s' % json.dumps(element.key)
+    return 'JSON_EXTRACT(%s, %s)' % (
+        compiler.process(element.column, **kw),
+        compiler.render_literal_value(path, sa.String()),
+    )
+
+
+@compiles(json_field, 'postgresql')
+def compile_json_field_postgresql(element, compiler, **kw):
+    # the key is rendered as a literal to match the expression indexes
+    return '(%s ->> %s)' % (
+        compiler.process(element.column, **kw),
+        compiler.render_literal_value(element.key, sa.String()),
+    )
+
+
+class epoch_seconds(expression.ColumnElement):
+    """Seconds since the epoch for a naive UTC timestamp"""
+    inherit_cache = True
+    type = sa.Float()
+    _traverse_internals = [
+        ('column', InternalTraversal.dp_clauseelement),
+    ]
+
+    def __init__(self, column):
+        self.column = column
+
+    @property
+    def _from_objects(self):
+        return self.column._from_objects
+
+
+@compiles(epoch_seconds)
+def compile_epoch_seconds(element, compiler, **kw):
+    return "CAST(strftime('%%s', %s) AS INTEGER)" % compiler.process(element.column, **kw)
+
+
+@compiles(epoch_seconds, 'postgresql')
+def compile_epoch_seconds_postgresql(element, compiler, **kw):
+    return 'EXTRACT(EPOCH FROM %s)' % compiler.process(element.column, **kw)
+
+
+class TrackedDict(dict):
+    """dict that reports changes, also in nested containers, to the JSON column it was loaded from"""
+
+    def __init__(self, data, on_change):
+        super().__init__((key, track_changes(value, on_change)) for key, value in data.items())
+        self._on_change = on_change
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, track_changes(value, self._on_change))
+        self._on_change()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._on_change()
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            super().__setitem__(key, track_changes(value, self._on_change))
+        self._on_change()
+
+    def pop(self, *args):
+        value = super().pop(*args)
+        self._on_change()
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        self._on_change()
+        return item
+
+    def clear(self):
+        super().clear()
+        self._on_change()
+
+    # copies are plain containers that are not connected to the column
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(dict(self), memo)
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
+class TrackedList(list):
+    """list that reports changes, also in nested containers, to the JSON column it was loaded from"""
+
+    def __init__(self, data, on_change):
+        super().__init__(track_changes(value, on_change) for value in data)
+        self._on_change = on_change
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = [track_changes(v, self._on_change) for v in value]
+        else:
+            value = track_changes(value, self._on_change)
+        super().__setitem__(index, value)
+        self._on_change()
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self._on_change()
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def __imul__(self, n):
+        super().__imul__(n)
+        self._on_change()
+        return self
+
+    def append(self, value):
+        super().append(track_changes(value, self._on_change))
+        self._on_change()
+
+    def extend(self, values):
+        super().extend(track_changes(value, self._on_change) for value in values)
+        self._on_change()
+
+    def insert(self, index, value):
+        super().insert(index, track_changes(value, self._on_change))
+        self._on_change()
+
+    def pop(self, *args):
+        value = super().pop(*args)
+        self._on_change()
+        return value
+
+    def remove(self, value):
+        super().remove(value)
+        self._on_change()
+
+    def clear(self):
+        super().clear()
+        self._on_change()
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self._on_change()
+
+    def reverse(self):
+        super().reverse()
+        self._on_change()
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(list(self), memo)
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+
+def track_changes(value, on_change):
+    if isinstance(value, dict) and not (isinstance(value, TrackedDict) and value._on_change is on_change):
+        return TrackedDict(value, on_change)
+    if isinstance(value, list) and not (isinstance(value, TrackedList) and value._on_change is on_change):
+        return TrackedList(value, on_change)
+    return value
+
+
+class JSONWriteBack:
+    """Serialises a loaded document back to its column when the document is modified in place"""
+
+    def __init__(self, instance, attr):
+        self.instance_ref = weakref.ref(instance)
+        self.attr = attr
+        self.value = None
+
+    def __call__(self):
+        instance = self.instance_ref()
+        if instance is None:
+            return
+        memo = instance.__dict__.get(JSON_MEMO_KEY, {})
+        entry = memo.get(self.attr)
+        # the column has been refreshed or assigned since the document was loaded, the document is stale
+        if not entry or entry[1] is not self.value:
+            return
+        raw = json.dumps(self.value)
+        setattr(instance, self.attr, raw)
+        memo[self.attr] = (raw, self.value)
+
+
+def load_json_column(instance, attr):
+    """
+    Return the decoded document in a JSON column of a model instance. The document is parsed once and reused
+    as long as the column holds the same text. Assigning the column or refreshing the instance from the
+    database replaces the text and thus invalidates the parsed document. Changes made to the returned document
+    in place are written back to the column.
+    """
+    raw = getattr(instance, attr)
+    memo = instance.__dict__.setdefault(JSON_MEMO_KEY, {})
+    entry = memo.get(attr)
+    if entry and entry[0] is raw:
+        return entry[1]
+
+    try:
+        value = json.loads(raw)
+    except (TypeError, ValueError):
+        value = {}
+    on_change = JSONWriteBack(instance, attr)
+    value = track_changes(value, on_change)
+    on_change.value = value
+    memo[attr] = (raw, value)
+    return value
+
+
+def store_json_column(instance, attr, value):
+    """Serialise a document to a JSON column of a model instance, the next read parses it again"""
+    setattr(instance, attr, json.dumps(value))
+    instance.__dict__.get(JSON_MEMO_KEY, {}).pop(attr, None)
@@ -0,0 +1,21 @@
+"""
+INSERT ... ON CONFLICT statements.
+
+Both PostgreSQL and SQLite, which is used in unit tests, support ON CONFLICT clauses, but SQLAlchemy has
+separate insert constructs for them. insert_for() returns the one for the database the session writes to, so
+that rows can be written idempotently with a single statement instead of reading the existing rows first.
+"""
+from sqlalchemy.dialects import postgresql, sqlite
+
+DIALECT_INSERTS = dict(
+    postgresql=postgresql.insert,
+    sqlite=sqlite.insert,
+)
+
+
+def insert_for(session, table):
+    """Return an insert construct for given table that supports on_conflict_do_nothing/update()"""
+    dialect_name = session.get_bind().dialect.name
+    if dialect_name not in DIALECT_INSERTS:
+        raise RuntimeError('INSERT ... ON CONFLICT is not supported on %s' % dialect_name)
+    return DIALECT_INSERTS[dialect_name](table)
@@ -172,6 +172,11 @@ class ProvisioningDriverBase(object):
             pbclient.update_application_session_running_logs(application_session_id, logs)
         pbclient.do_application_session_patch(application_session_id, json_data={'log_fetch_pending': False})
 
+    def disconnect(self):
+        """ called by worker when this driver instance is replaced with a new one, override to release resources
+        """
+        pass
+
     @abc.abstractmethod
     def is_expired(self):
         """ called by worker to check if a new instance of this driver needs to be created
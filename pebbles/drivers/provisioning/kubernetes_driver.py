@@ -15,12 +15,30 @@ from kubernetes.client.rest import ApiException
 from kubernetes.dynamic import DynamicClient
 
 from pebbles.drivers.provisioning import base_driver
+from pebbles.drivers.provisioning.kubernetes_informer import ClusterInformers
 from pebbles.models import ApplicationSession
 from pebbles.utils import b64encode_string
 
 # limit for application session startup duration before it is marked as failed
 SESSION_STARTUP_TIME_LIMIT = 30 * 60
 
+# running logs are fetched as a bounded tail: the server sends at most RUNNING_LOGS_TAIL_LINES lines and
+# RUNNING_LOGS_LIMIT_BYTES bytes, of which we keep the last RUNNING_LOGS_MAX_BYTES
+RUNNING_LOGS_TAIL_LINES = 1000
+RUNNING_LOGS_LIMIT_BYTES = 256 * 1024
+RUNNING_LOGS_MAX_BYTES = 64 * 1024
+RUNNING_LOGS_CHUNK_SIZE = 16 * 1024
+
+# how long to wait for the informers to complete the initial listing when connecting
+INFORMER_SYNC_TIMEOUT_SECS = 10
+
+# name of the DaemonSet keeping popular application images cached on the nodes
+IMAGE_PREPULL_DAEMONSET_NAME = 'pebbles-image-prepull'
+IMAGE_PREPULL_HELPER_IMAGE = 'docker.io/library/busybox:stable-musl'
+
+# label set on all namespaced resources belonging to an application session
+SESSION_LABEL = 'pebbles.csc.fi/session'
+
 
 @unique
 class VolumePersistenceLevel(Enum):
@@ -40,6 +58,32 @@ def parse_template(name, values):
         return format_with_jinja2(template, values)
 
 
+def read_stream_tail(chunks, max_bytes):
+    """Consume an iterable of byte chunks and return the last max_bytes of it as a string"""
+    tail = bytearray()
+    for chunk in chunks:
+        tail.extend(chunk)
+        if len(tail) > max_bytes:
+            del tail[:len(tail) - max_bytes]
+
+    return tail.decode('utf-8', errors='replace')
+
+
+def is_image_cached(image, cached_names):
+    """Check if image reference is found in the image names reported in node status"""
+    if image in cached_names:
+        return True
+    # container runtimes report fully qualified names, e.g. docker.io/library/busybox:latest for busybox
+    if ':' not in image.split('/')[-1] and '@' not in image:
+        image += ':latest'
+    candidates = {image, 'docker.io/' + image, 'docker.io/library/' + image}
+    return not candidates.isdisjoint(cached_names)
+
+
+def get_session_label_selector(application_session):
+    return '%s=%s' % (SESSION_LABEL, application_session['name'])
+
+
 def get_session_volume_name(application_session, persistence_level=VolumePersistenceLevel.SESSION_LIFETIME):
     if persistence_level == VolumePersistenceLevel.SESSION_LIFETIME:
         return 'pvc-%s-%s' % (application_session['user']['pseudonym'], application_session['name'])
@@ -99,6 +143,7 @@ class KubernetesDriverBase(base_driver.ProvisioningDriverBase):
         self._namespace = None
         self.kubernetes_api_client = None
         self.dynamic_client = None
+        self.informers = None
 
     def get_application_session_hostname(self, application_session):
         return self.ingress_app_domain
@@ -139,6 +184,48 @@ class KubernetesDriverBase(base_driver.ProvisioningDriverBase):
         # create dynamic client for actual use - this requires a working connection
         self.dynamic_client = DynamicClient(self.kubernetes_api_client)
 
+        # optionally serve reads from local caches that follow the cluster state with list+watch
+        if self.cluster_config.get('useInformers', False):
+            self.informers = ClusterInformers(self.dynamic_client, self.logger)
+            self.informers.start()
+            if not self.informers.wait_for_sync(INFORMER_SYNC_TIMEOUT_SECS):
+                self.logger.warning('informers for cluster %s not synced yet, reading from API server for now',
+                                    self.cluster_config.get('name'))
+
+    def disconnect(self):
+        if self.informers:
+            self.informers.stop()
+            self.informers = None
+
+    def get_informer(self, kind):
+        """Return a synced informer for the given kind, or None if reads should go to the API server"""
+        if self.informers:
+            return self.informers.get_informer(kind)
+        return None
+
+    def get_cached_object(self, api_version, kind, namespace, name):
+        """Get an object from the informer cache, falling back to the API server. Raises ApiException 404
+        if the object does not exist."""
+        informer = self.get_informer(kind)
+        if informer:
+            obj = informer.get(namespace, name)
+            if obj is not None:
+                return obj
+        # cache miss can be just lag after creation, ask the API server to be sure
+        api = self.dynamic_client.resources.get(api_version=api_version, kind=kind)
+        return api.get(namespace=namespace, name=name)
+
+    def list_session_pods(self, namespace, application_session):
+        informer = self.get_informer('Pod')
+        if informer:
+            return informer.list_by_labels(namespace, dict(name=application_session.get('name')))
+
+        pod_api = self.dynamic_client.resources.get(api_version='v1', kind='Pod')
+        return pod_api.get(
+            namespace=namespace,
+            label_selector='name=%s' % application_session.get('name')
+        ).items
+
     def test_connection(self):
         logging.debug('testing connection to Kubernetes API')
         api = kubernetes.client.CoreV1Api(self.kubernetes_api_client)
@@ -213,7 +300,8 @@ class KubernetesDriverBase(base_driver.ProvisioningDriverBase):
         self.ensure_namespace(namespace)
         # create volumes if necessary
         self.ensure_volume(namespace, application_session,
-                           session_volume_name, session_volume_size, session_storage_class_name)
+                           session_volume_name, session_volume_size, session_storage_class_name,
+                           labels={SESSION_LABEL: application_session['name']})
         self.ensure_volume(namespace, application_session,
                            shared_volume_name, shared_volume_size, shared_storage_class_name,
                            access_mode='ReadWriteMany',
@@ -243,11 +331,7 @@ class KubernetesDriverBase(base_driver.ProvisioningDriverBase):
     def do_check_readiness(self, token, application_session_id):
         application_session = self.fetch_and_populate_application_session(token, application_session_id)
         namespace = self.get_application_session_namespace(application_session)
-        pod_api = self.dynamic_client.resources.get(api_version='v1', kind='Pod')
-        pods = pod_api.get(
-            namespace=namespace,
-            label_selector='name=%s' % application_session.get('name')
-        )
+        pods = self.list_session_pods(namespace, application_session)
 
         # if it is long since creation, mark the application session as failed
         # TODO: when we implement queueing, change the reference time
@@ -256,14 +340,14 @@ class KubernetesDriverBase(base_driver.ProvisioningDriverBase):
             raise RuntimeWarning('application_session %s takes too long to start' % application_session_id)
 
         # no pods, continue waiting
-        if len(pods.items) == 0:
+        if len(pods) == 0:
             return None
 
         # more than one pod with given search condition, we have a logic error
-        if len(pods.items) > 1:
-            raise RuntimeWarning('pod results length is not one. dump: %s' % pods.to_str())
+        if len(pods) > 1:
+            raise RuntimeWarning('pod results length is not one. dump: %s' % pods)
 
-        pod = pods.items[0]
+        pod = pods[0]
         # first check that the pod is running, then check readiness of all containers
         if pod.status.phase == 'Running' and not [x for x in pod.status.containerStatuses if not x.ready]:
             # application session ready, create and publish an endpoint url. note that we pick the protocol
@@ -312,11 +396,10 @@ class KubernetesDriverBase(base_driver.ProvisioningDriverBase):
             log_entries = map(extract_log_entries, event_resp.items)
             log_entries = [x for x in log_entries if x]
             if log_entries:
-                ts, message = log_entries[-1]
-                self.get_pb_client().add_provisioning_log(
+                # lines that have been sent before are skipped by the API
+                self.get_pb_client().add_provisioning_logs(
                     application_session_id=application_session_id,
-                    timestamp=ts,
-                    message=message
+                    log_entries=log_entries,
                 )
 
         return None
@@ -324,6 +407,33 @@ class KubernetesDriverBase(base_driver.ProvisioningDriverBase):
     def do_deprovision(self, token, application_session_id):
         application_session = self.fetch_and_populate_application_session(token, application_session_id)
         namespace = self.get_application_session_namespace(application_session)
+        label_selector = get_session_label_selector(application_session)
+
+        # remove all resources labelled with the session name, one collection delete per kind
+        num_deleted = 0
+        for api_version, kind in self.get_session_resource_kinds():
+            api = self.dynamic_client.resources.get(api_version=api_version, kind=kind)
+            self.logger.debug('deleting %s objects matching %s' % (kind, label_selector))
+            resp = api.delete(namespace=namespace, label_selector=label_selector)
+            num_deleted += len(resp.items) if resp.items else 0
+
+        # sessions provisioned before resources were labelled have to be cleaned up one by one
+        if num_deleted == 0:
+            self.logger.info('no labelled resources found for %s, deleting by name' % application_session['name'])
+            self.deprovision_unlabelled_resources(namespace, application_session)
+
+    def get_session_resource_kinds(self):
+        """Return (api_version, kind) tuples of the resources created for each session"""
+        return [
+            ('apps/v1', 'Deployment'),
+            ('v1', 'Secret'),
+            ('v1', 'ConfigMap'),
+            ('v1', 'Service'),
+            ('networking.k8s.io/v1', 'Ingress'),
+            ('v1', 'PersistentVolumeClaim'),
+        ]
+
+    def deprovision_unlabelled_resources(self, namespace, application_session):
         # remove deployment
         try:
             self.delete_deployment(namespace, application_session)
@@ -385,19 +495,26 @@ class KubernetesDriverBase(base_driver.ProvisioningDriverBase):
     def do_get_running_logs(self, token, application_session_id):
         application_session = self.fetch_and_populate_application_session(token, application_session_id)
         namespace = self.get_application_session_namespace(application_session)
-        api = self.dynamic_client.resources.get(api_version='v1', kind='Pod')
-        pods = api.get(
-            namespace=namespace,
-            label_selector='name=%s' % application_session.get('name')
-        )
-        if len(pods.items) != 1:
-            raise RuntimeWarning('pod results length is not one. dump: %s' % pods.to_str())
+        pods = self.list_session_pods(namespace, application_session)
+        if len(pods) != 1:
+            raise RuntimeWarning('pod results length is not one. dump: %s' % pods)
 
-        # now we got the pod, query the logs
+        # now we got the pod, query the tail of the logs and stream it, keeping only the last
+        # RUNNING_LOGS_MAX_BYTES in memory
         resp = self.dynamic_client.request(
             'GET',
-            '/api/v1/namespaces/%s/pods/%s/log?container=pebbles-session' % (namespace, pods.items[0].metadata.name))
-        return resp
+            '/api/v1/namespaces/%s/pods/%s/log' % (namespace, pods[0].metadata.name),
+            query_params=[
+                ('container', 'pebbles-session'),
+                ('tailLines', RUNNING_LOGS_TAIL_LINES),
+                ('limitBytes', RUNNING_LOGS_LIMIT_BYTES),
+            ],
+            serialize=False,
+        )
+        try:
+            return read_stream_tail(resp.stream(RUNNING_LOGS_CHUNK_SIZE), RUNNING_LOGS_MAX_BYTES)
+        finally:
+            resp.release_conn()
 
     def is_expired(self):
         if 'token_expires_at' in self.cluster_config.keys():
@@ -632,18 +749,18 @@ class KubernetesDriverBase(base_driver.ProvisioningDriverBase):
         api.delete(namespace=namespace, name=application_session.get('name'))
 
     def ensure_volume(self, namespace, application_session, volume_name, volume_size, storage_class_name,
-                      access_mode='ReadWriteOnce', annotations=None):
-        api = self.dynamic_client.resources.get(api_version='v1', kind='PersistentVolumeClaim')
+                      access_mode='ReadWriteOnce', annotations=None, labels=None):
         try:
-            api.get(namespace=namespace, name=volume_name)
+            self.get_cached_object('v1', 'PersistentVolumeClaim', namespace, volume_name)
             return
         except ApiException as e:
             if e.status != 404:
                 raise e
-        return self.create_volume(namespace, volume_name, volume_size, storage_class_name, access_mode, annotations)
+        return self.create_volume(namespace, volume_name, volume_size, storage_class_name, access_mode, annotations,
+                                  labels)
 
     def create_volume(self, namespace, volume_name, volume_size, storage_class_name,
-                      access_mode='ReadWriteOnce', annotations=None):
+                      access_mode='ReadWriteOnce', annotations=None, labels=None):
         pvc_yaml = parse_template('pvc.yaml.j2', dict(
             name=volume_name,
             volume_size=volume_size,
@@ -654,6 +771,8 @@ class KubernetesDriverBase(base_driver.ProvisioningDriverBase):
             pvc_dict['spec']['storageClassName'] = storage_class_name
         if annotations:
             pvc_dict['metadata']['annotations'] = annotations
+        if labels:
+            pvc_dict['metadata']['labels'].update(labels)
         self.logger.debug('creating pvc\n%s' % yaml.safe_dump(pvc_dict))
         api = self.dynamic_client.resources.get(api_version='v1', kind='PersistentVolumeClaim')
         return api.create(body=pvc_dict, namespace=namespace)
@@ -666,6 +785,67 @@ class KubernetesDriverBase(base_driver.ProvisioningDriverBase):
             name=volume_name
         )
 
+    def ensure_image_prepull_daemonset(self, namespace, images):
+        """Create or update the DaemonSet that keeps the given images cached on the nodes"""
+        daemonset_dict = yaml.safe_load(parse_template('image_prepull_daemonset.yaml.j2', dict(
+            name=IMAGE_PREPULL_DAEMONSET_NAME,
+            images=images,
+            helper_image=self.cluster_config.get('imagePrepullHelperImage', IMAGE_PREPULL_HELPER_IMAGE),
+        )))
+        # follow the node selection of the session deployments
+        if 'nodeSelector' in self.cluster_config:
+            daemonset_dict['spec']['template']['spec']['nodeSelector'] = self.cluster_config['nodeSelector']
+
+        api = self.dynamic_client.resources.get(api_version='apps/v1', kind='DaemonSet')
+        try:
+            existing = api.get(namespace=namespace, name=IMAGE_PREPULL_DAEMONSET_NAME)
+        except ApiException as e:
+            if e.status != 404:
+                raise e
+            self.logger.info('creating image pre-pull daemonset in %s with %d images' % (namespace, len(images)))
+            return api.create(body=daemonset_dict, namespace=namespace)
+
+        existing_images = [c.image for c in existing.spec.template.spec.containers]
+        if existing_images == list(images):
+            self.logger.debug('image pre-pull daemonset in %s is up to date' % namespace)
+            return existing
+
+        # merge patch replaces the container list as a whole
+        self.logger.info('updating image pre-pull daemonset in %s with %d images' % (namespace, len(images)))
+        return api.patch(
+            body=daemonset_dict,
+            namespace=namespace,
+            name=IMAGE_PREPULL_DAEMONSET_NAME,
+            content_type='application/merge-patch+json'
+        )
+
+    def delete_image_prepull_daemonset(self, namespace):
+        api = self.dynamic_client.resources.get(api_version='apps/v1', kind='DaemonSet')
+        try:
+            api.delete(namespace=namespace, name=IMAGE_PREPULL_DAEMONSET_NAME)
+        except ApiException as e:
+            if e.status != 404:
+                raise e
+
+    def get_image_cache_coverage(self, images):
+        """Return a dict of image -> number of nodes having the image cached, and the number of nodes considered"""
+        node_api = self.dynamic_client.resources.get(api_version='v1', kind='Node')
+        label_selector = None
+        if 'nodeSelector' in self.cluster_config:
+            label_selector = ','.join('%s=%s' % (k, v) for k, v in self.cluster_config['nodeSelector'].items())
+        nodes = node_api.get(label_selector=label_selector).items
+
+        coverage = {image: 0 for image in images}
+        for node in nodes:
+            cached_names = set()
+            for node_image in node.status.images or []:
+                cached_names.update(node_image.names or [])
+            for image in images:
+                if is_image_cached(image, cached_names):
+                    coverage[image] += 1
+
+        return coverage, len(nodes)
+
     def fetch_and_populate_application_session(self, token, application_session_id):
         pbclient = self.get_pb_client()
         application_session = pbclient.get_application_session(application_session_id)
@@ -727,7 +907,7 @@ class KubernetesDriverBase(base_driver.ProvisioningDriverBase):
         pod_api = self.dynamic_client.resources.get(api_version='v1', kind='Pod')
         secret_api = self.dynamic_client.resources.get(api_version='v1', kind='Secret')
 
-        job = job_api.get(namespace=namespace, name='backup-pvc-%s' % volume_name)
+        job = self.get_cached_object('batch/v1', 'Job', namespace, 'backup-pvc-%s' % volume_name)
 
         if job['status'].get('active') == 1:
             return False
@@ -797,7 +977,7 @@ class KubernetesDriverBase(base_driver.ProvisioningDriverBase):
         pod_api = self.dynamic_client.resources.get(api_version='v1', kind='Pod')
         secret_api = self.dynamic_client.resources.get(api_version='v1', kind='Secret')
 
-        job = job_api.get(namespace=namespace, name='restore-pvc-%s' % volume_name)
+        job = self.get_cached_object('batch/v1', 'Job', namespace, 'restore-pvc-%s' % volume_name)
 
         if job['status'].get('active') == 1:
             return False
@@ -848,6 +1028,12 @@ class KubernetesRemoteDriver(KubernetesDriverBase):
 
 class OpenShiftLocalDriver(KubernetesLocalDriver):
 
+    def get_session_resource_kinds(self):
+        return [
+            ('route.openshift.io/v1', 'Route') if kind == 'Ingress' else (api_version, kind)
+            for api_version, kind in super().get_session_resource_kinds()
+        ]
+
     def create_ingress(self, namespace, application_session):
         pod_name = application_session.get('name')
         route_yaml = parse_template('route.yaml.j2', dict(
@@ -0,0 +1,163 @@
+import logging
+import threading
+import time
+
+from kubernetes import watch
+from kubernetes.client.rest import ApiException
+
+# label of the volumes created by the driver, see pvc.yaml.j2
+VOLUME_LABEL_SELECTOR = 'application=pebbles-volume'
+
+# resources cached by the informers: (api_version, kind, label_selector). Objects outside the selectors, like
+# volumes created before they were labeled, are read from the API server on a cache miss.
+INFORMER_RESOURCES = [
+    ('v1', 'Pod', 'application in (pebbles-session,pebbles-backup-pvc,pebbles-restore-pvc)'),
+    ('v1', 'PersistentVolumeClaim', VOLUME_LABEL_SELECTOR),
+    ('batch/v1', 'Job', 'application in (pebbles-backup-pvc,pebbles-restore-pvc)'),
+]
+
+# watch connections are renewed after this timeout
+INFORMER_WATCH_TIMEOUT_SECS = 300
+# delay before retrying a failed list or watch
+INFORMER_RETRY_DELAY_SECS = 10
+
+
+class ResourceInformer:
+    """
+    Keeps an in-memory copy of the resources of one kind, cluster-wide, by listing them once and then
+    following a watch. The store is indexed by namespace and name, and lookups by labels scan
+    the objects in the namespace.
+    """
+
+    def __init__(self, dynamic_client, api_version, kind, label_selector=None, logger=None):
+        self.dynamic_client = dynamic_client
+        self.api = dynamic_client.resources.get(api_version=api_version, kind=kind)
+        self.kind = kind
+        self.label_selector = label_selector
+        self.logger = logger if logger else logging.getLogger()
+        self.lock = threading.Lock()
+        self.store = dict()
+        self.synced = False
+        self.stopped = threading.Event()
+        self.watcher = None
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='informer-%s' % self.kind, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.watcher:
+            self.watcher.stop()
+
+    def has_synced(self):
+        return self.synced and not self.stopped.is_set()
+
+    def run(self):
+        resource_version = None
+        while not self.stopped.is_set():
+            try:
+                if resource_version is None:
+                    resource_version = self.list()
+                resource_version = self.watch(resource_version)
+            except ApiException as e:
+                # resource version too old, we have to relist
+                if e.status == 410:
+                    resource_version = None
+                    continue
+                self.logger.warning('informer for %s failed: %s', self.kind, e.reason)
+                self.synced = False
+                resource_version = None
+                self.stopped.wait(INFORMER_RETRY_DELAY_SECS)
+            except Exception as e:
+                self.logger.warning('informer for %s failed: %s', self.kind, e)
+                self.synced = False
+                resource_version = None
+                self.stopped.wait(INFORMER_RETRY_DELAY_SECS)
+
+    def list(self):
+        resp = self.api.get(label_selector=self.label_selector)
+        store = dict()
+        for item in resp.items:
+            store[(item.metadata.namespace, item.metadata.name)] = item
+        with self.lock:
+            self.store = store
+        self.synced = True
+        self.logger.debug('informer for %s listed %d objects', self.kind, len(store))
+        return resp.metadata.resourceVersion
+
+    def watch(self, resource_version):
+        self.watcher = watch.Watch()
+        for event in self.dynamic_client.watch(
+                self.api,
+                label_selector=self.label_selector,
+                resource_version=resource_version,
+                timeout=INFORMER_WATCH_TIMEOUT_SECS,
+                watcher=self.watcher):
+            if self.stopped.is_set():
+                break
+            event_type = event['type']
+            raw_object = event['raw_object']
+            if event_type == 'ERROR':
+                if raw_object.get('code') == 410:
+                    return None
+                raise RuntimeError('watch error: %s' % raw_object.get('message'))
+
+            obj = event['object']
+            resource_version = obj.metadata.resourceVersion
+            if event_type == 'BOOKMARK':
+                continue
+            key = (obj.metadata.namespace, obj.metadata.name)
+            with self.lock:
+                if event_type == 'DELETED':
+                    self.store.pop(key, None)
+                else:
+                    self.store[key] = obj
+
+        return resource_version
+
+    def get(self, namespace, name):
+        with self.lock:
+            return self.store.get((namespace, name))
+
+    def list_by_labels(self, namespace, labels):
+        with self.lock:
+            objs = [obj for (ns, _), obj in self.store.items() if ns == namespace]
+        return [
+            obj for obj in objs
+            if all((obj.metadata.labels or {}).get(k) == v for k, v in labels.items())
+        ]
+
+
+class ClusterInformers:
+    """Set of informers for the resources Pebbles manages in a cluster"""
+
+    def __init__(self, dynamic_client, logger=None):
+        self.informers = {
+            kind: ResourceInformer(dynamic_client, api_version, kind, label_selector, logger)
+            for api_version, kind, label_selector in INFORMER_RESOURCES
+        }
+
+    def start(self):
+        for informer in self.informers.values():
+            informer.start()
+
+    def stop(self):
+        for informer in self.informers.values():
+            informer.stop()
+
+    def wait_for_sync(self, timeout):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if all(informer.has_synced() for informer in self.informers.values()):
+                return True
+            time.sleep(0.1)
+        return False
+
+    def get_informer(self, kind):
+        """Return the informer for given kind if it has a complete view of the resources"""
+        informer = self.informers.get(kind)
+        if informer and informer.has_synced():
+            return informer
+        return None
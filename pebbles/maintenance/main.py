@@ -66,6 +66,41 @@ def run_membership_expiry_cleanup(pb_client, logger):
     logger.info('membership expiry cleanup done')
 
 
+def call_in_batches(pb_client, url, result_key):
+    """Calls an admin endpoint that processes one batch per call until a partial batch is returned"""
+    total = 0
+    while True:
+        res = pb_client.do_post(url)
+        if res.status_code != 200:
+            msg = 'Got error %d: %s from %s' % (res.status_code, res.json() if res.json else res.text, url)
+            raise RuntimeError(msg)
+        num_processed = res.json().get(result_key, 0)
+        total += num_processed
+        # a partial batch means there is nothing left to process
+        if num_processed < res.json().get('batch_size', 1):
+            return total
+
+
+def run_session_log_retention(pb_client, logger, batch_size=None):
+    """Prunes old provisioning logs in batches, each batch is deleted in its own transaction in the API"""
+    logger.info('session log retention starting')
+    url = 'application_session_logs/prune'
+    if batch_size:
+        url += '?batch_size=%d' % batch_size
+    num_deleted = call_in_batches(pb_client, url, 'num_deleted')
+    logger.info('session log retention done, %d log lines deleted', num_deleted)
+
+
+def run_session_archiving(pb_client, logger, batch_size=None):
+    """Moves deleted application sessions to the archive table in batches"""
+    logger.info('session archiving starting')
+    url = 'application_session_archive'
+    if batch_size:
+        url += '?batch_size=%d' % batch_size
+    num_archived = call_in_batches(pb_client, url, 'num_archived')
+    logger.info('session archiving done, %d sessions archived', num_archived)
+
+
 if __name__ == '__main__':
     config = RuntimeConfig()
     init_logging(config, 'maintenance')
@@ -88,6 +123,10 @@ if __name__ == '__main__':
             run_workspace_expiry_cleanup(client, logger)
         if 'run_membership_expiry_cleanup' in sys.argv:
             run_membership_expiry_cleanup(client, logger)
+        if 'run_session_log_retention' in sys.argv:
+            run_session_log_retention(client, logger)
+        if 'run_session_archiving' in sys.argv:
+            run_session_archiving(client, logger)
     except Exception as e:
         logger.critical('maintenance job exiting due to an error', exc_info=e)
         sys.exit(1)
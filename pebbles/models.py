@@ -19,6 +19,7 @@ from sqlalchemy.schema import MetaData
 
 import pebbles
 from pebbles.app import db, bcrypt
+from pebbles.db_types import JSONText, json_field, load_json_column, store_json_column
 from pebbles.utils import get_application_fields_from_config, read_list_from_text_file
 
 PEBBLES_TAINT_KEY = 'pebbles.csc.fi/taint'
@@ -58,12 +59,9 @@ class CaseInsensitiveComparator(Comparator):
         return func.lower(self.__clause_element__()) == func.lower(other)
 
 
-def load_column(column):
-    try:
-        value = json.loads(column)
-    except:
-        value = {}
-    return value
+def get_utc_now():
+    """Naive UTC timestamp. Used for updated_at columns, as it is taken at flush time with sub-second precision"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
 
 class User(db.Model):
@@ -86,13 +84,13 @@ class User(db.Model):
     latest_seen_message_ts = db.Column(db.DateTime)
     workspace_quota = db.Column(db.Integer, default=0)
     tc_acceptance_date = db.Column(db.DateTime)
-    _annotations = db.Column('annotations', db.Text)
+    _annotations = db.Column('annotations', JSONText)
     application_sessions = db.relationship('ApplicationSession', backref='user', lazy='dynamic')
     workspace_memberships = db.relationship("WorkspaceMembership", back_populates="user", lazy='dynamic')
     deletion_requested_date = db.Column(db.DateTime, nullable=True)
 
     def __init__(self, ext_id, password=None, is_admin=False, email_id=None, expiry_ts=None, pseudonym=None,
-                 workspace_quota=None, annotations=None):
+                 workspace_quota=None, annotations=None, password_hash=None):
         self.id = uuid.uuid4().hex
         self.ext_id = ext_id
         self.is_admin = is_admin
@@ -101,7 +99,11 @@ class User(db.Model):
             self.expiry_ts = expiry_ts
         if email_id:
             self.email_id = email_id
-        if password:
+        if password_hash:
+            # hashed in advance, see commons.create_users()
+            self.password = password_hash
+            self.is_active = True
+        elif password:
             self.set_password(password)
             self.is_active = True
         else:
@@ -188,7 +190,7 @@ class User(db.Model):
     @hybrid_property
     def annotations(self):
         if self._annotations:
-            return load_column(self._annotations)
+            return load_json_column(self, '_annotations')
         else:
             return []
 
@@ -197,7 +199,7 @@ class User(db.Model):
         if not value:
             self._annotations = None
         elif isinstance(value, list):
-            self._annotations = json.dumps(value)
+            store_json_column(self, '_annotations', value)
         else:
             raise RuntimeWarning('user annotations need to be a list of key value pairs')
 
@@ -281,13 +283,20 @@ class User(db.Model):
 class WorkspaceMembership(db.Model):
     __tablename__ = 'workspace_memberships'
     workspace_id = db.Column(db.String(32), db.ForeignKey('workspaces.id'), primary_key=True)
-    user_id = db.Column(db.String(32), db.ForeignKey('users.id'), primary_key=True)
+    # the primary key starts with workspace_id, user_id needs an index of its own
+    user_id = db.Column(db.String(32), db.ForeignKey('users.id'), primary_key=True, index=True)
     is_manager = db.Column(db.Boolean, default=False)
     is_owner = db.Column(db.Boolean, default=False)
     is_banned = db.Column(db.Boolean, default=False)
     user = db.relationship("User", back_populates="workspace_memberships")
     workspace = db.relationship("Workspace", back_populates="memberships")
-    created_at = db.Column(db.DateTime, default=func.now())
+    created_at = db.Column(db.DateTime, default=get_utc_now)
+    updated_at = db.Column(db.DateTime, default=get_utc_now, onupdate=get_utc_now)
+
+    __table_args__ = (
+        # keyset pagination of workspace member lists
+        db.Index('ix_workspace_memberships_workspace_id_created_at', workspace_id, created_at, user_id),
+    )
 
 
 class Workspace(db.Model):
@@ -327,15 +336,23 @@ class Workspace(db.Model):
     )
     memberships = db.relationship("WorkspaceMembership", back_populates="workspace", lazy='dynamic',
                                   cascade="all, delete-orphan")
-    _membership_expiry_policy = db.Column('membership_expiry_policy', db.Text)
-    _membership_join_policy = db.Column('membership_join_policy', db.Text)
+    _membership_expiry_policy = db.Column('membership_expiry_policy', JSONText)
+    _membership_join_policy = db.Column('membership_join_policy', JSONText)
     application_quota = db.Column(db.Integer, default=10)
     memory_limit_gib = db.Column(db.Integer, default=50)
-    _config = db.Column('config', db.Text)
+    _config = db.Column('config', JSONText)
     contact = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, default=get_utc_now, onupdate=get_utc_now)
 
     applications = db.relationship('Application', backref='workspace', lazy='dynamic')
 
+    # JSON indexes are only available on PostgreSQL
+    __table_args__ = (
+        db.Index(
+            'ix_workspaces_membership_expiry_policy_kind', json_field(_membership_expiry_policy, 'kind')
+        ).ddl_if(dialect='postgresql'),
+    )
+
     def __init__(self, name, description='', cluster=None, memory_limit_gib=50, config=None):
         self.id = uuid.uuid4().hex
         # Here we opportunistically create a pseudonym without actually checking the existing workspaces,
@@ -391,15 +408,15 @@ class Workspace(db.Model):
 
     @hybrid_property
     def config(self):
-        return load_column(self._config)
+        return load_json_column(self, '_config')
 
     @config.setter
     def config(self, value):
-        self._config = json.dumps(value)
+        store_json_column(self, '_config', value)
 
     @hybrid_property
     def membership_expiry_policy(self):
-        return load_column(self._membership_expiry_policy)
+        return load_json_column(self, '_membership_expiry_policy')
 
     @membership_expiry_policy.setter
     def membership_expiry_policy(self, value):
@@ -407,11 +424,11 @@ class Workspace(db.Model):
         if error:
             raise RuntimeWarning('Invalid membership_expiry_policy: "%s"' % error)
         else:
-            self._membership_expiry_policy = json.dumps(value)
+            store_json_column(self, '_membership_expiry_policy', value)
 
     @hybrid_property
     def membership_join_policy(self):
-        return load_column(self._membership_join_policy)
+        return load_json_column(self, '_membership_join_policy')
 
     @hybrid_property
     def allow_expiry_extension(self):
@@ -423,7 +440,7 @@ class Workspace(db.Model):
         if error:
             raise RuntimeWarning('Invalid membership_expiry_policy: "%s"' % error)
         else:
-            self._membership_join_policy = json.dumps(value)
+            store_json_column(self, '_membership_join_policy', value)
 
     @staticmethod
     def check_membership_expiry_policy(mep):
@@ -506,9 +523,9 @@ class ApplicationTemplate(db.Model):
     name = db.Column(db.String(MAX_NAME_LENGTH))
     description = db.Column(db.Text)
     application_type = db.Column(db.String(MAX_NAME_LENGTH))
-    _base_config = db.Column('base_config', db.Text)
+    _base_config = db.Column('base_config', JSONText)
     is_enabled = db.Column(db.Boolean, default=False)
-    _attribute_limits = db.Column('attribute_limits', db.Text)
+    _attribute_limits = db.Column('attribute_limits', JSONText)
     created_at = db.Column(db.DateTime, default=func.now())
 
     def __init__(self, name=None, description=None, application_type='generic', attribute_limits=None,
@@ -525,19 +542,19 @@ class ApplicationTemplate(db.Model):
 
     @hybrid_property
     def base_config(self):
-        return load_column(self._base_config)
+        return load_json_column(self, '_base_config')
 
     @base_config.setter
     def base_config(self, value):
-        self._base_config = json.dumps(value)
+        store_json_column(self, '_base_config', value)
 
     @hybrid_property
     def attribute_limits(self):
-        return load_column(self._attribute_limits)
+        return load_json_column(self, '_attribute_limits')
 
     @attribute_limits.setter
     def attribute_limits(self, value):
-        self._attribute_limits = json.dumps(value)
+        store_json_column(self, '_attribute_limits', value)
 
 
 class Application(db.Model):
@@ -557,18 +574,23 @@ class Application(db.Model):
     description = db.Column(db.Text)
     template_id = db.Column(db.String(32), db.ForeignKey('application_templates.id'))
     workspace_id = db.Column(db.String(32), db.ForeignKey('workspaces.id'))
-    _labels = db.Column('labels', db.Text)
+    _labels = db.Column('labels', JSONText)
     application_type = db.Column(db.String(MAX_NAME_LENGTH))
     maximum_lifetime = db.Column(db.Integer)
-    _base_config = db.Column('base_config', db.Text)
-    _config = db.Column('config', db.Text)
-    _attribute_limits = db.Column('attribute_limits', db.Text)
+    _base_config = db.Column('base_config', JSONText)
+    _config = db.Column('config', JSONText)
+    _attribute_limits = db.Column('attribute_limits', JSONText)
     is_enabled = db.Column(db.Boolean, default=False)
     expiry_time = db.Column(db.DateTime)
     application_sessions = db.relationship('ApplicationSession', backref='application', lazy='dynamic')
     # status when created is "active". Later there are options to be "archived" or "deleted".
     _status = db.Column('status', db.String(32), default='active')
     created_at = db.Column(db.DateTime, default=func.now())
+    updated_at = db.Column(db.DateTime, default=get_utc_now, onupdate=get_utc_now)
+
+    __table_args__ = (
+        db.Index('ix_applications_workspace_id_status', workspace_id, _status),
+    )
 
     def __init__(self, name=None, description=None, template_id=None, workspace_id=None, labels=None,
                  maximum_lifetime=3600, is_enabled=False, config=None,
@@ -595,35 +617,35 @@ class Application(db.Model):
 
     @hybrid_property
     def base_config(self):
-        return load_column(self._base_config)
+        return load_json_column(self, '_base_config')
 
     @base_config.setter
     def base_config(self, value):
-        self._base_config = json.dumps(value)
+        store_json_column(self, '_base_config', value)
 
     @hybrid_property
     def config(self):
-        return load_column(self._config)
+        return load_json_column(self, '_config')
 
     @config.setter
     def config(self, value):
-        self._config = json.dumps(value)
+        store_json_column(self, '_config', value)
 
     @hybrid_property
     def attribute_limits(self):
-        return load_column(self._attribute_limits)
+        return load_json_column(self, '_attribute_limits')
 
     @attribute_limits.setter
     def attribute_limits(self, value):
-        self._attribute_limits = json.dumps(value)
+        store_json_column(self, '_attribute_limits', value)
 
     @hybrid_property
     def labels(self):
-        return json.loads(self._labels)
+        return load_json_column(self, '_labels')
 
     @labels.setter
     def labels(self, value):
-        self._labels = json.dumps(value)
+        store_json_column(self, '_labels', value)
 
     @hybrid_property
     def status(self):
@@ -640,6 +662,10 @@ class Application(db.Model):
     def cost_multiplier(self):
         return get_application_fields_from_config(self, 'cost_multiplier')
 
+    def get_image(self) -> str:
+        """ image used by the application, image_url in config overrides the template image in base_config """
+        return self.config.get('image_url', '') or self.base_config.get('image', '')
+
     def replace_application_image(self, old_image: str, new_image: str) -> bool:
         """ replace image in both base_config and config """
         change = False
@@ -692,9 +718,36 @@ class ApplicationSession(db.Model):
     _state = db.Column('state', db.String(32))
     to_be_deleted = db.Column(db.Boolean, default=False)
     log_fetch_pending = db.Column(db.Boolean, default=False)
+    # warm sessions are pre-provisioned by the worker and handed over to the next user launching the application
+    is_warm = db.Column(db.Boolean, default=False)
     error_msg = db.Column(db.String(256))
-    _provisioning_config = db.Column('provisioning_config', db.Text)
-    _session_data = db.Column('session_data', db.Text)
+    _provisioning_config = db.Column('provisioning_config', JSONText)
+    _session_data = db.Column('session_data', JSONText)
+    updated_at = db.Column(db.DateTime, default=get_utc_now, onupdate=get_utc_now)
+    # last time a worker locked the session for processing, rotates the work queue
+    worker_attempted_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        # deleted sessions pile up, the partial indexes only cover the live ones
+        db.Index(
+            'ix_application_sessions_user_id_active', user_id,
+            postgresql_where=_state != STATE_DELETED, sqlite_where=_state != STATE_DELETED,
+        ),
+        db.Index(
+            'ix_application_sessions_state_active', _state, to_be_deleted,
+            postgresql_where=_state != STATE_DELETED, sqlite_where=_state != STATE_DELETED,
+        ),
+        db.Index('ix_application_sessions_application_id_state', application_id, _state),
+        # work queue for the worker, sessions waiting for provisioning, deprovisioning, log fetching or
+        # lifetime checks, least recently attempted first
+        db.Index(
+            'ix_application_sessions_work_queue', func.coalesce(worker_attempted_at, updated_at),
+            postgresql_where=(_state != STATE_DELETED) & (
+                _state.in_([STATE_QUEUEING, STATE_STARTING, STATE_RUNNING]) | to_be_deleted),
+            sqlite_where=(_state != STATE_DELETED) & (
+                _state.in_([STATE_QUEUEING, STATE_STARTING, STATE_RUNNING]) | to_be_deleted),
+        ),
+    )
 
     def __init__(self, application, user):
         self.id = uuid.uuid4().hex
@@ -704,19 +757,19 @@ class ApplicationSession(db.Model):
 
     @hybrid_property
     def session_data(self):
-        return load_column(self._session_data)
+        return load_json_column(self, '_session_data')
 
     @session_data.setter
     def session_data(self, value):
-        self._session_data = json.dumps(value)
+        store_json_column(self, '_session_data', value)
 
     @hybrid_property
     def provisioning_config(self):
-        return load_column(self._provisioning_config)
+        return load_json_column(self, '_provisioning_config')
 
     @provisioning_config.setter
     def provisioning_config(self, value):
-        self._provisioning_config = json.dumps(value)
+        store_json_column(self, '_provisioning_config', value)
 
     @hybrid_property
     def state(self):
@@ -749,7 +802,36 @@ class ApplicationSession(db.Model):
             return 0
 
 
+class ApplicationSessionArchive(db.Model):
+    """
+    Deleted application sessions are moved here by a background job, so that the live table only holds active
+    sessions. The archive keeps what is needed for accounting and reporting.
+    """
+    __tablename__ = 'application_session_archive'
+    id = db.Column(db.String(32), primary_key=True)
+    name = db.Column(db.String(64))
+    user_id = db.Column(db.String(32), index=True)
+    application_id = db.Column(db.String(32))
+    # workspace of the application at the time of archiving, for accounting
+    workspace_id = db.Column(db.String(32), index=True)
+    created_at = db.Column(db.DateTime)
+    provisioned_at = db.Column(db.DateTime)
+    deprovisioned_at = db.Column(db.DateTime)
+    errored = db.Column(db.Boolean, default=False)
+    is_warm = db.Column(db.Boolean, default=False)
+    error_msg = db.Column(db.String(256))
+    _provisioning_config = db.Column('provisioning_config', JSONText)
+    archived_at = db.Column(db.DateTime, default=get_utc_now)
+
+    @hybrid_property
+    def provisioning_config(self):
+        return load_json_column(self, '_provisioning_config')
+
+
 class ApplicationSessionLog(db.Model):
+    LOG_TYPE_PROVISIONING = 'provisioning'
+    LOG_TYPE_RUNNING = 'running'
+
     __tablename__ = 'application_session_logs'
     id = db.Column(db.String(32), primary_key=True)
     application_session_id = db.Column(db.String(32), db.ForeignKey('application_sessions.id'), index=True,
@@ -759,6 +841,24 @@ class ApplicationSessionLog(db.Model):
     timestamp = db.Column(db.Float)
     message = db.Column(db.Text)
 
+    # conflict targets for log ingestion: provisioning lines are unique by timestamp and each session has
+    # a single running log that is replaced
+    __table_args__ = (
+        db.Index(
+            'ix_application_session_logs_provisioning', application_session_id, log_type, timestamp, unique=True,
+            postgresql_where=log_type == LOG_TYPE_PROVISIONING, sqlite_where=log_type == LOG_TYPE_PROVISIONING,
+        ),
+        db.Index(
+            'ix_application_session_logs_running', application_session_id, log_type, unique=True,
+            postgresql_where=log_type == LOG_TYPE_RUNNING, sqlite_where=log_type == LOG_TYPE_RUNNING,
+        ),
+        # retention pruning scans provisioning lines by age
+        db.Index(
+            'ix_application_session_logs_provisioning_timestamp', timestamp,
+            postgresql_where=log_type == LOG_TYPE_PROVISIONING, sqlite_where=log_type == LOG_TYPE_PROVISIONING,
+        ),
+    )
+
     def __init__(self, application_session_id, log_level, log_type, timestamp, message):
         self.id = uuid.uuid4().hex
         self.application_session_id = application_session_id
@@ -788,10 +888,14 @@ class Alert(db.Model):
     target = db.Column(db.String(64), nullable=False)
     source = db.Column(db.String(64), nullable=False)
     status = db.Column(db.String(64), nullable=False, index=True)
-    _data = db.Column('data', db.Text)
+    _data = db.Column('data', JSONText)
     _first_seen_ts = db.Column('first_seen_ts', db.DateTime, default=func.now())
     _last_seen_ts = db.Column('last_seen_ts', db.DateTime, default=func.now())
 
+    __table_args__ = (
+        db.Index('ix_alerts_target_source_status', target, source, status),
+    )
+
     def __init__(self, id, target, source, status, data):
         self.id = id if id else Alert.generate_alert_id(target, source, data)
         self.target = target
@@ -822,11 +926,11 @@ class Alert(db.Model):
 
     @hybrid_property
     def data(self):
-        return load_column(self._data)
+        return load_json_column(self, '_data')
 
     @data.setter
     def data(self, value):
-        self._data = json.dumps(value)
+        store_json_column(self, '_data', value)
 
 
 class Task(db.Model):
@@ -855,11 +959,15 @@ class Task(db.Model):
     id = db.Column(db.String(64), primary_key=True)
     _kind = db.Column('kind', db.String(32), primary_key=True)
     _state = db.Column('state', db.String(32))
-    _data = db.Column('data', db.Text)
+    _data = db.Column('data', JSONText)
     _create_ts = db.Column('create_ts', db.DateTime, default=func.now())
     _complete_ts = db.Column('complete_ts', db.DateTime)
     _update_ts = db.Column('update_ts', db.DateTime, default=func.now())
-    _results = db.Column('results', db.Text)
+    _results = db.Column('results', JSONText)
+
+    __table_args__ = (
+        db.Index('ix_tasks_state_create_ts', _state, _create_ts),
+    )
 
     def __init__(self, kind, state, data):
         self.id = uuid.uuid4().hex
@@ -892,20 +1000,20 @@ class Task(db.Model):
     @hybrid_property
     def results(self):
         if self._results:
-            return load_column(self._results)
+            return load_json_column(self, '_results')
         return []
 
     @results.setter
     def results(self, value):
-        self._results = json.dumps(value)
+        store_json_column(self, '_results', value)
 
     @hybrid_property
     def data(self):
-        return load_column(self._data)
+        return load_json_column(self, '_data')
 
     @data.setter
     def data(self, value):
-        self._data = json.dumps(value)
+        store_json_column(self, '_data', value)
 
     @hybrid_property
     def create_ts(self):
@@ -949,10 +1057,10 @@ class CustomImage(db.Model):
 
     __tablename__ = 'custom_images'
     id = db.Column(db.String(32), primary_key=True)
-    workspace_id = db.Column(db.String(32), db.ForeignKey('workspaces.id'))
+    workspace_id = db.Column(db.String(32), db.ForeignKey('workspaces.id'), index=True)
     name = db.Column(db.String(64))
     tag = db.Column(db.String(64))
-    _definition = db.Column('definition', db.Text)
+    _definition = db.Column('definition', JSONText)
     dockerfile = db.Column(db.Text)
     build_system_id = db.Column(db.String(64))
     build_system_output = db.Column(db.Text)
@@ -965,6 +1073,13 @@ class CustomImage(db.Model):
     created_at = db.Column('created_at', db.DateTime, default=func.now())
     updated_at = db.Column('updated_at', db.DateTime, onupdate=func.now())
 
+    __table_args__ = (
+        db.Index(
+            'ix_custom_images_state_active', _state,
+            postgresql_where=_state != STATE_DELETED, sqlite_where=_state != STATE_DELETED,
+        ),
+    )
+
     def __init__(self, id=None, workspace_id=None, name=None, tag=None, dockerfile=None, ):
         self.id = id if id else uuid.uuid4().hex
         self.workspace_id = workspace_id
@@ -986,50 +1101,91 @@ class CustomImage(db.Model):
 
     @hybrid_property
     def definition(self):
-        return load_column(self._definition)
+        return load_json_column(self, '_definition')
 
     @definition.setter
     def definition(self, value):
-        self._definition = json.dumps(value)
+        store_json_column(self, '_definition', value)
 
 
-def load_yaml(yaml_data):
-    """
-    A function to load annotated yaml data into the database.
-    Example can be found in devel_dataset.yaml
-    """
+def model_object_constructor(loader, node):
+    """Callback function for constructing custom objects from yaml"""
+    values = loader.construct_mapping(node, deep=True)
+    # figure out class and use its constructor
+    cls = getattr(
+        importlib.import_module('pebbles.models'),
+        node.tag[1:],
+        None
+    )
+    # we could not find a matching class, return value dict
+    if not cls:
+        return values
 
-    # callback function for constructing custom objects from yaml
-    def model_object_constructor(loader, node):
-        values = loader.construct_mapping(node, deep=True)
-        # figure out class and use its constructor
-        cls = getattr(
-            importlib.import_module('pebbles.models'),
-            node.tag[1:],
-            None
-        )
-        # we could not find a matching class, return value dict
-        if not cls:
-            return values
-
-        if 'id' in values:
-            id = values.pop('id')
-            obj = cls(**values)
-            obj.id = id
-        else:
-            obj = cls(**values)
+    if 'id' in values:
+        id = values.pop('id')
+        obj = cls(**values)
+        obj.id = id
+    else:
+        obj = cls(**values)
+
+    return obj
 
-        return obj
 
+def register_yaml_constructors():
     # wire custom construction for all pebbles.models classes
     for class_info in inspect.getmembers(pebbles.models, inspect.isclass):
         yaml.add_constructor('!' + class_info[0], model_object_constructor)
 
+
+def load_yaml(yaml_data):
+    """
+    A function to load annotated yaml data into the database.
+    Example can be found in devel_dataset.yaml
+    """
+    register_yaml_constructors()
+
     data = yaml.unsafe_load(yaml_data)
 
     return data
 
 
+def iter_yaml_data(yaml_data):
+    """
+    Yield the objects in the 'data' list of annotated yaml data one by one. Unlike load_yaml(), the whole
+    document is never held in memory, so this can be used for large datasets.
+    """
+    register_yaml_constructors()
+
+    loader = yaml.UnsafeLoader(yaml_data)
+    try:
+        # skip stream and document start
+        loader.get_event()
+        if loader.check_event(yaml.StreamEndEvent):
+            return
+        loader.get_event()
+        if not loader.check_event(yaml.MappingStartEvent):
+            raise ValueError('expected a mapping with a data key at the top level')
+        loader.get_event()
+
+        while not loader.check_event(yaml.MappingEndEvent):
+            key = loader.construct_document(loader.compose_node(None, None))
+            if key != 'data' or not loader.check_event(yaml.SequenceStartEvent):
+                # skip the value of other keys
+                loader.compose_node(None, None)
+                continue
+            loader.get_event()
+            while not loader.check_event(yaml.SequenceEndEvent):
+                yield loader.construct_document(loader.compose_node(None, None))
+            loader.get_event()
+    finally:
+        loader.dispose()
+
+
+def is_valid_image_reference(image: str) -> bool:
+    """Filter out strings that are obviously not image references (image_url in config can have anything)"""
+    return bool(image) and '/' in image and ' ' not in image
+
+
 def list_active_applications() -> list[Application]:
     """List applications in active state in valid workspaces"""
     applications = Application.query.filter(Application.status != 'deleted').all()
@@ -0,0 +1,187 @@
+"""
+Notification bus for pushing application session events to clients.
+
+Views publish small events (session state changes, new log lines) with publish_event(). Subscribers, typically
+the server-sent events stream in pebbles.views.events, get the events through a bounded queue. A subscriber
+that does not keep up loses events and is told to resynchronise.
+
+Within a single process the events are dispatched directly. With PostgreSQL, events are sent with
+NOTIFY, and a listener thread in each process that has subscribers dispatches them locally. This way
+events published by any API process reach the clients of all processes.
+"""
+import json
+import logging
+import queue
+import select
+import threading
+
+from flask import current_app
+from sqlalchemy import text
+
+# PostgreSQL NOTIFY channel
+EVENT_CHANNEL = 'pebbles_events'
+# NOTIFY payload has to be shorter than 8000 bytes, keep messages in events well below that
+MAX_EVENT_MESSAGE_LENGTH = 2000
+
+EVENT_SESSION_STATE = 'session_state'
+EVENT_SESSION_LOG = 'session_log'
+
+
+class Subscription:
+    """Bounded event queue for one subscriber"""
+
+    def __init__(self, max_queue_size):
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.overflowed = False
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout):
+        """Return the next event, or None if there were no events within timeout"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class NotificationBus:
+    """Dispatches events to the subscribers in this process"""
+
+    def __init__(self, max_subscribers=50, max_queue_size=100):
+        self.max_subscribers = max_subscribers
+        self.max_queue_size = max_queue_size
+        self.lock = threading.Lock()
+        self.subscriptions = set()
+
+    def subscribe(self):
+        """Return a new subscription, or None if the subscriber limit has been reached"""
+        with self.lock:
+            if len(self.subscriptions) >= self.max_subscribers:
+                return None
+            subscription = Subscription(self.max_queue_size)
+            self.subscriptions.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def dispatch(self, event):
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            subscription.put(event)
+
+    def publish(self, event):
+        self.dispatch(event)
+
+
+class PostgresNotificationBus(NotificationBus):
+    """Notification bus that delivers events through PostgreSQL LISTEN/NOTIFY to all API processes"""
+
+    def __init__(self, engine, max_subscribers=50, max_queue_size=100):
+        super().__init__(max_subscribers, max_queue_size)
+        self.engine = engine
+        self.listener = None
+
+    def subscribe(self):
+        subscription = super().subscribe()
+        # start listening only when there is someone to deliver the events to
+        with self.lock:
+            if subscription and not (self.listener and self.listener.is_alive()):
+                self.listener = threading.Thread(target=self.listen, name='notification-listener', daemon=True)
+                self.listener.start()
+        return subscription
+
+    def publish(self, event):
+        with self.engine.connect() as conn:
+            conn.execute(text('SELECT pg_notify(:channel, :payload)'), dict(
+                channel=EVENT_CHANNEL,
+                payload=json.dumps(event),
+            ))
+            conn.commit()
+
+    def listen(self):
+        raw_connection = self.engine.raw_connection()
+        try:
+            dbapi_connection = raw_connection.driver_connection
+            dbapi_connection.autocommit = True
+            dbapi_connection.cursor().execute('LISTEN %s' % EVENT_CHANNEL)
+            # listen as long as there are subscribers
+            while self.subscriptions:
+                if select.select([dbapi_connection], [], [], 5) == ([], [], []):
+                    continue
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    notification = dbapi_connection.notifies.pop(0)
+                    try:
+                        self.dispatch(json.loads(notification.payload))
+                    except ValueError:
+                        logging.warning('invalid notification payload')
+        except Exception as e:
+            logging.warning('notification listener failed: %s', e)
+        finally:
+            raw_connection.invalidate()
+
+
+def init_notifications(app, db):
+    """Create the notification bus for the app"""
+    config = app.config
+    kwargs = dict(
+        max_subscribers=config['EVENT_STREAM_MAX_SUBSCRIBERS'],
+        max_queue_size=config['EVENT_STREAM_MAX_QUEUE_SIZE'],
+    )
+    if config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql'):
+        with app.app_context():
+            bus = PostgresNotificationBus(db.engine, **kwargs)
+    else:
+        bus = NotificationBus(**kwargs)
+    app.extensions['pebbles_notifications'] = bus
+    return bus
+
+
+def get_notification_bus():
+    return current_app.extensions.get('pebbles_notifications')
+
+
+def publish_event(event):
+    """Publish an event, failures are logged and otherwise ignored as the events are only hints for the clients"""
+    bus = get_notification_bus()
+    if not bus or not current_app.config['EVENT_STREAM_ENABLED']:
+        return
+    try:
+        bus.publish(event)
+    except Exception as e:
+        logging.warning('publishing event failed: %s', e)
+
+
+def publish_session_state_event(application_session):
+    publish_event(dict(
+        type=EVENT_SESSION_STATE,
+        application_session_id=application_session.id,
+        user_id=application_session.user_id,
+        workspace_id=application_session.application.workspace_id,
+        state=application_session.state,
+        to_be_deleted=application_session.to_be_deleted,
+    ))
+
+
+def publish_session_log_event(application_session_id, user_id, workspace_id, log_record):
+    event = dict(
+        type=EVENT_SESSION_LOG,
+        application_session_id=application_session_id,
+        user_id=user_id,
+        workspace_id=workspace_id,
+        log_type=log_record.get('log_type'),
+    )
+    # provisioning log lines are small, pass them along. Running logs are large and replaced as a whole,
+    # clients fetch them when they need to.
+    if log_record.get('log_type') == 'provisioning':
+        event['log_level'] = log_record.get('log_level')
+        event['timestamp'] = log_record.get('timestamp')
+        event['message'] = str(log_record.get('message', ''))[:MAX_EVENT_MESSAGE_LENGTH]
+    publish_event(event)
@@ -0,0 +1,151 @@
+"""
+Opt-in request profiling for the API.
+
+A configurable fraction of requests (PROFILING_SAMPLE_RATE, with per endpoint overrides in
+PROFILING_ENDPOINT_SAMPLE_RATES) is run under cProfile. Admins can also profile a single request by sending
+the PROFILING_HEADER header with their token. Along with the profile, the number of SQL statements and the
+time spent in the database are recorded from the request statistics in pebbles.query_stats. Results are kept
+in a bounded in-memory buffer per API process, and admins can list and download them through
+/api/v1/request_profiles.
+"""
+import cProfile
+import io
+import logging
+import marshal
+import pstats
+import random
+import threading
+import time
+import uuid
+from collections import deque
+
+from flask import current_app, g, request
+
+# number of functions included in the text report
+PROFILE_REPORT_LINES = 50
+
+
+class RequestProfileBuffer:
+    """Ring buffer for the most recent request profiles"""
+
+    def __init__(self, size=20):
+        self.lock = threading.Lock()
+        self.profiles = deque(maxlen=size)
+
+    def add(self, profile):
+        with self.lock:
+            self.profiles.append(profile)
+
+    def list(self):
+        with self.lock:
+            return list(reversed(self.profiles))
+
+    def get(self, profile_id):
+        with self.lock:
+            for profile in self.profiles:
+                if profile['id'] == profile_id:
+                    return profile
+        return None
+
+
+def get_profile_buffer():
+    return current_app.extensions.get('pebbles_profiles')
+
+
+def get_sample_rate(config, endpoint):
+    return config['PROFILING_ENDPOINT_SAMPLE_RATES'].get(endpoint, config['PROFILING_SAMPLE_RATE'])
+
+
+def is_profile_requested(config):
+    return bool(config['PROFILING_HEADER'] and request.headers.get(config['PROFILING_HEADER']))
+
+
+def is_admin_request(config):
+    """Check for an admin token before the request is authenticated, passwords are not checked here"""
+    from pebbles.models import User
+    credentials = request.authorization
+    if not (credentials and credentials.username):
+        return False
+    user = User.verify_auth_token(credentials.username, config['SECRET_KEY'])
+    return bool(user and user.is_admin)
+
+
+def should_profile(config):
+    if request.endpoint in ('requestprofilelist', 'requestprofileview'):
+        return False
+    # only admins can have their requests profiled on demand
+    if is_profile_requested(config):
+        return is_admin_request(config)
+    rate = get_sample_rate(config, request.endpoint)
+    return bool(rate) and random.random() < rate
+
+
+def start_profiling():
+    config = current_app.config
+    if not should_profile(config):
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # another profiler is active in this process, e.g. in a concurrent request
+        return
+    g.profiler = profiler
+    g.profile_start_ts = time.time()
+
+
+def stop_profiling(response):
+    profiler = g.pop('profiler', None)
+    if not profiler:
+        return response
+    profiler.disable()
+    duration = time.time() - g.pop('profile_start_ts')
+    sql_stats = g.get('sql_stats', dict(count=0, db_time=0.0))
+    sql_count = sql_stats['count']
+    sql_time = sql_stats['db_time']
+
+    profiler.create_stats()
+    # serialise first, pstats.Stats takes over the statistics of the profiler
+    stats = marshal.dumps(profiler.stats)
+    report = io.StringIO()
+    pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(PROFILE_REPORT_LINES)
+    profile = dict(
+        id=uuid.uuid4().hex,
+        created_at=time.time(),
+        method=request.method,
+        path=request.path,
+        endpoint=request.endpoint,
+        status_code=response.status_code,
+        duration_ms=round(duration * 1000, 1),
+        sql_count=sql_count,
+        sql_time_ms=round(sql_time * 1000, 1),
+        report=report.getvalue(),
+        stats=stats,
+    )
+    get_profile_buffer().add(profile)
+    logging.info(
+        'profiled %s %s: %d ms, %d SQL statements, %d ms in database',
+        request.method, request.path, profile['duration_ms'], sql_count, profile['sql_time_ms']
+    )
+    response.headers['X-Pebbles-Profile-Id'] = profile['id']
+    return response
+
+
+def discard_profiling(exc):
+    # the request failed before after_request handlers were run
+    profiler = g.pop('profiler', None)
+    if profiler:
+        profiler.disable()
+
+
+def init_request_profiling(app):
+    """Create the profile buffer and register the request hooks, if profiling is configured"""
+    config = app.config
+    if not (config['PROFILING_SAMPLE_RATE'] or config['PROFILING_ENDPOINT_SAMPLE_RATES'] or config['PROFILING_HEADER']):
+        return None
+    buffer = RequestProfileBuffer(config['PROFILING_BUFFER_SIZE'])
+    app.extensions['pebbles_profiles'] = buffer
+    app.before_request(start_profiling)
+    app.after_request(stop_profiling)
+    app.teardown_request(discard_profiling)
+    return buffer
@@ -0,0 +1,214 @@
+"""
+Query plan and latency benchmark for the indexes on frequently filtered columns.
+
+A synthetic dataset is generated into an empty scratch database. The hot queries of the API and the workers are
+then timed and their query plans printed, first without the indexes in HOT_INDEXES and then with them. The
+dataset is generated with a fixed seed, so runs against the same database engine are comparable.
+
+Run with 'python manage.py benchmark_queries -d <database uri>'. The database must not contain any tables,
+they are created for the run and dropped afterwards.
+"""
+import random
+import time
+import uuid
+from datetime import timedelta
+
+import sqlalchemy as sa
+
+from pebbles.models import db, get_utc_now, Alert, Application, ApplicationSession, CustomImage, Task, Workspace, \
+    WorkspaceMembership
+
+# indexes that are dropped for the baseline measurement
+HOT_INDEXES = (
+    'ix_workspace_memberships_user_id',
+    'ix_applications_workspace_id_status',
+    'ix_application_sessions_user_id_active',
+    'ix_application_sessions_state_active',
+    'ix_application_sessions_application_id_state',
+    'ix_tasks_state_create_ts',
+    'ix_custom_images_workspace_id',
+    'ix_custom_images_state_active',
+    'ix_alerts_target_source_status',
+)
+
+INSERT_BATCH_SIZE = 5000
+
+
+def new_id(rng):
+    return uuid.UUID(int=rng.getrandbits(128)).hex
+
+
+def generate_dataset(rng, users):
+    """
+    Generate rows for a system with given number of users. Like in production, most sessions, tasks and custom
+    images are in a final state and only a small fraction is active.
+    """
+    now = get_utc_now()
+    rows = {table: [] for table in ('users', 'workspaces', 'workspace_memberships', 'applications',
+                                    'application_sessions', 'tasks', 'custom_images', 'alerts')}
+
+    user_ids = [new_id(rng) for _ in range(users)]
+    for i, user_id in enumerate(user_ids):
+        rows['users'].append(dict(
+            id=user_id, ext_id='user-%d@example.org' % i, pseudonym='u-%d' % i, is_active=True,
+            is_admin=False, is_deleted=False, is_blocked=False, joining_ts=now,
+        ))
+
+    workspace_ids = [new_id(rng) for _ in range(max(users // 20, 1))]
+    for i, workspace_id in enumerate(workspace_ids):
+        rows['workspaces'].append(dict(
+            id=workspace_id, pseudonym='ws-%d' % i, name='Workspace %d' % i, status=Workspace.STATUS_ACTIVE,
+            create_ts=now, expiry_ts=now + timedelta(days=180),
+        ))
+        for k in range(rng.randint(1, 3)):
+            rows['custom_images'].append(dict(
+                id=new_id(rng), workspace_id=workspace_id, name='image-%d' % k, tag=str(k),
+                state=CustomImage.STATE_DELETED if rng.random() < 0.8 else CustomImage.STATE_COMPLETED,
+                to_be_deleted=False, created_at=now,
+            ))
+
+    for user_id in user_ids:
+        for workspace_id in rng.sample(workspace_ids, min(3, len(workspace_ids))):
+            rows['workspace_memberships'].append(dict(
+                workspace_id=workspace_id, user_id=user_id, is_manager=False, is_owner=False, is_banned=False,
+            ))
+
+    application_ids = []
+    for workspace_id in workspace_ids:
+        for k in range(5):
+            application_id = new_id(rng)
+            application_ids.append(application_id)
+            rows['applications'].append(dict(
+                id=application_id, workspace_id=workspace_id, name='Application %d' % k, is_enabled=True,
+                status=Application.STATUS_ARCHIVED if rng.random() < 0.3 else Application.STATUS_ACTIVE,
+                created_at=now,
+            ))
+
+    live_states = (ApplicationSession.STATE_QUEUEING, ApplicationSession.STATE_PROVISIONING,
+                   ApplicationSession.STATE_RUNNING, ApplicationSession.STATE_DELETING)
+    for i in range(users * 10):
+        deleted = rng.random() < 0.95
+        rows['application_sessions'].append(dict(
+            id=new_id(rng), user_id=rng.choice(user_ids), application_id=rng.choice(application_ids),
+            name='pb-bench-%d' % i, created_at=now,
+            state=ApplicationSession.STATE_DELETED if deleted else rng.choice(live_states),
+            to_be_deleted=deleted, errored=False, log_fetch_pending=False, is_warm=False,
+        ))
+
+    for i in range(users * 5):
+        finished = rng.random() < 0.98
+        rows['tasks'].append(dict(
+            id=new_id(rng), kind=Task.KIND_WORKSPACE_VOLUME_BACKUP,
+            state=Task.STATE_FINISHED if finished else Task.STATE_NEW,
+            create_ts=now - timedelta(seconds=rng.randint(0, 3600 * 24 * 365)),
+        ))
+
+    for i in range(users // 10):
+        rows['alerts'].append(dict(
+            id=new_id(rng), target='cluster-%d' % (i % 10), source='prometheus',
+            status='archived' if rng.random() < 0.99 else 'firing', first_seen_ts=now, last_seen_ts=now,
+        ))
+
+    return rows
+
+
+def get_benchmark_queries(rng, rows):
+    """Return (name, statement) pairs for the hot queries, with parameters picked from the generated rows"""
+    user_id = rng.choice(rows['users'])['id']
+    workspace_id = rng.choice(rows['workspaces'])['id']
+    application_id = rng.choice(rows['applications'])['id']
+    return [
+        ('memberships of a user', sa.select(WorkspaceMembership).where(WorkspaceMembership.user_id == user_id)),
+        ('active applications of a workspace', sa.select(Application)
+            .where(Application.workspace_id == workspace_id)
+            .where(Application.status == Application.STATUS_ACTIVE)),
+        ('sessions of a user', sa.select(ApplicationSession)
+            .where(ApplicationSession.user_id == user_id)
+            .where(ApplicationSession.state != ApplicationSession.STATE_DELETED)),
+        ('sessions of an application', sa.select(ApplicationSession)
+            .where(ApplicationSession.application_id == application_id)
+            .where(ApplicationSession.state != ApplicationSession.STATE_DELETED)),
+        # the worker polls for live sessions, see rules.generate_application_session_query()
+        ('live sessions', sa.select(ApplicationSession.id, ApplicationSession.state)
+            .where(ApplicationSession.state != ApplicationSession.STATE_DELETED)),
+        ('oldest new task', sa.select(Task)
+            .where(Task.state == Task.STATE_NEW)
+            .order_by(Task._create_ts)
+            .limit(1)),
+        ('custom images of a workspace', sa.select(CustomImage).where(CustomImage.workspace_id == workspace_id)),
+        ('unfinished custom images', sa.select(CustomImage)
+            .where(CustomImage.state != CustomImage.STATE_DELETED)
+            .where(CustomImage.state.in_([CustomImage.STATE_NEW, CustomImage.STATE_BUILDING]))),
+        ('firing alerts of a target', sa.select(Alert)
+            .where(Alert.target == 'cluster-1')
+            .where(Alert.source == 'prometheus')
+            .where(Alert.status == 'firing')),
+    ]
+
+
+def explain(connection, statement):
+    sql = str(statement.compile(dialect=connection.dialect, compile_kwargs=dict(literal_binds=True)))
+    if connection.dialect.name == 'postgresql':
+        lines = connection.execute(sa.text('EXPLAIN ' + sql)).scalars()
+    else:
+        lines = (row[-1] for row in connection.execute(sa.text('EXPLAIN QUERY PLAN ' + sql)))
+    return list(lines)
+
+
+def time_query(connection, statement, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        connection.execute(statement).fetchall()
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def get_hot_indexes():
+    indexes = {index.name: index for table in db.metadata.tables.values() for index in table.indexes}
+    return [indexes[name] for name in HOT_INDEXES]
+
+
+def run_benchmark(engine, users=10000, iterations=20, seed=42, out=print):
+    """
+    Create the schema in an empty database, load the synthetic dataset and measure the hot queries without and
+    with the indexes. Returns the results as {query name: (ms without, ms with)}.
+    """
+    if sa.inspect(engine).get_table_names():
+        raise RuntimeError('database %s is not empty, refusing to run the benchmark' % engine.url.database)
+
+    rng = random.Random(seed)
+    db.metadata.create_all(engine)
+    try:
+        with engine.begin() as connection:
+            for index in get_hot_indexes():
+                index.drop(connection)
+            out('generating dataset for %d users' % users)
+            rows = generate_dataset(rng, users)
+            for table in db.metadata.sorted_tables:
+                for i in range(0, len(rows.get(table.name, [])), INSERT_BATCH_SIZE):
+                    connection.execute(table.insert(), rows[table.name][i:i + INSERT_BATCH_SIZE])
+                if rows.get(table.name):
+                    out('  %-25s %9d rows' % (table.name, len(rows[table.name])))
+        queries = get_benchmark_queries(rng, rows)
+
+        results = {}
+        for phase in ('without indexes', 'with indexes'):
+            with engine.begin() as connection:
+                if phase == 'with indexes':
+                    for index in get_hot_indexes():
+                        index.create(connection)
+                connection.execute(sa.text('ANALYZE'))
+            out('\n*** %s ***' % phase)
+            with engine.connect() as connection:
+                for name, statement in queries:
+                    ms = time_query(connection, statement, iterations)
+                    results.setdefault(name, []).append(ms)
+                    out('\n%s: %.2f ms' % (name, ms))
+                    for line in explain(connection, statement):
+                        out('    ' + line)
+
+        out('\n%-40s %12s %12s' % ('query', 'without ms', 'with ms'))
+        for name, (ms_without, ms_with) in results.items():
+            out('%-40s %12.2f %12.2f' % (name, ms_without, ms_with))
+        return {name: tuple(timings) for name, timings in results.items()}
+    finally:
+        db.metadata.drop_all(engine)
@@ -0,0 +1,131 @@
+"""
+Per-request SQL statement statistics.
+
+Every statement executed while handling a request is counted and timed through engine events. When a request
+goes over the statement budget (SQL_STATEMENT_BUDGET, with per endpoint overrides in
+SQL_STATEMENT_ENDPOINT_BUDGETS), or runs the same statement over and over, which is the usual sign of a lazy
+relationship being walked in a loop, a warning is logged. Aggregated numbers per endpoint are available to
+admins at /api/v1/query_stats.
+
+QueryCounter records the statements executed within a block of code, and is used in tests to pin the number
+of queries views make.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class EndpointQueryStats:
+    """Aggregated statement counts per endpoint"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = dict()
+
+    def add(self, endpoint, count, db_time, over_budget):
+        with self.lock:
+            stats = self.endpoints.setdefault(endpoint, dict(
+                endpoint=endpoint, requests=0, statements=0, max_statements=0, db_time=0.0, over_budget=0))
+            stats['requests'] += 1
+            stats['statements'] += count
+            stats['max_statements'] = max(stats['max_statements'], count)
+            stats['db_time'] += db_time
+            if over_budget:
+                stats['over_budget'] += 1
+
+    def list(self):
+        with self.lock:
+            return [dict(stats) for stats in self.endpoints.values()]
+
+    def reset(self):
+        with self.lock:
+            self.endpoints.clear()
+
+
+class QueryCounter:
+    """Context manager that records the SQL statements executed within the block"""
+
+    def __init__(self):
+        self.statements = []
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(Engine, 'before_cursor_execute', self.record)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        event.remove(Engine, 'before_cursor_execute', self.record)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+def get_query_stats():
+    return current_app.extensions.get('pebbles_query_stats')
+
+
+def get_statement_budget(config, endpoint):
+    return config['SQL_STATEMENT_ENDPOINT_BUDGETS'].get(endpoint, config['SQL_STATEMENT_BUDGET'])
+
+
+def start_request_stats():
+    g.sql_stats = dict(count=0, db_time=0.0, statements=Counter())
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'sql_stats' in g:
+        conn.info.setdefault('query_start_ts', []).append(time.time())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'sql_stats' in g and conn.info.get('query_start_ts'):
+        sql_stats = g.sql_stats
+        sql_stats['count'] += 1
+        sql_stats['db_time'] += time.time() - conn.info['query_start_ts'].pop()
+        sql_stats['statements'][statement] += 1
+
+
+def check_request_stats(response):
+    sql_stats = g.get('sql_stats')
+    if not sql_stats:
+        return response
+    config = current_app.config
+    endpoint = request.endpoint or 'unknown'
+    count = sql_stats['count']
+    budget = get_statement_budget(config, endpoint)
+    over_budget = bool(budget) and count > budget
+    if over_budget:
+        logging.warning(
+            'endpoint %s executed %d SQL statements (budget %d), %s %s took %d ms in database',
+            endpoint, count, budget, request.method, request.path, sql_stats['db_time'] * 1000
+        )
+    threshold = config['SQL_REPEATED_STATEMENT_THRESHOLD']
+    if threshold and sql_stats['statements']:
+        statement, repeats = sql_stats['statements'].most_common(1)[0]
+        if repeats >= threshold:
+            logging.warning(
+                'possible N+1 query in endpoint %s, statement executed %d times: %s',
+                endpoint, repeats, ' '.join(statement.split())[:300]
+            )
+    get_query_stats().add(endpoint, count, sql_stats['db_time'], over_budget)
+    return response
+
+
+def init_query_stats(app):
+    """Create the per endpoint statistics and register the request hooks and the engine event listeners"""
+    query_stats = EndpointQueryStats()
+    app.extensions['pebbles_query_stats'] = query_stats
+    app.before_request(start_request_stats)
+    app.after_request(check_request_stats)
+    if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+    return query_stats
@@ -0,0 +1,88 @@
+"""
+Response encoding for the API: JSON serialisation with orjson and compression of large responses.
+
+orjson is several times faster than the standard library json module on the large lists that the API
+returns (users, alerts, sessions with provisioning config). Compression is negotiated with the client
+through Accept-Encoding. Brotli is used when the optional brotli module is installed, gzip otherwise.
+"""
+import gzip
+import json
+import logging
+
+import orjson
+from flask import current_app, make_response, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# content types that are worth compressing
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/plain', 'text/html', 'text/css', 'application/javascript')
+
+
+def dumps_json(data, pretty=False):
+    """Serialise data to JSON bytes, falling back to the standard library for data orjson does not support"""
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE
+    if pretty:
+        option |= orjson.OPT_INDENT_2
+    try:
+        return orjson.dumps(data, option=option)
+    except TypeError as e:
+        # e.g. integers larger than 64 bits or unknown types, let the standard library decide
+        logging.debug('orjson could not serialise response, falling back to json: %s', e)
+        return (json.dumps(data, indent=2 if pretty else None) + '\n').encode('utf-8')
+
+
+def output_json(data, code, headers=None):
+    """flask_restful representation for application/json"""
+    resp = make_response(dumps_json(data, pretty=current_app.debug), code)
+    resp.headers.extend(headers or {})
+    resp.mimetype = 'application/json'
+    return resp
+
+
+def select_encoding(accept_encodings):
+    """Pick the content coding to use, based on the Accept-Encoding request header"""
+    if brotli and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress_data(data, encoding, level):
+    if encoding == 'br':
+        # brotli quality 0-11, scale the gzip style 1-9 level to it
+        return brotli.compress(data, quality=min(round(level * 11 / 9), 11))
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def compress_response(response):
+    """Compress the response body, if the client accepts it and the response is large enough to benefit"""
+    config = current_app.config
+    if not config['API_COMPRESSION_ENABLED']:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    if response.status_code != 200 or response.direct_passthrough or response.is_streamed:
+        return response
+    if 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+
+    encoding = select_encoding(request.accept_encodings)
+    if not encoding:
+        return response
+
+    data = response.get_data()
+    if len(data) < config['API_COMPRESSION_MIN_SIZE']:
+        return response
+
+    response.set_data(compress_data(data, encoding, config['API_COMPRESSION_LEVEL']))
+    response.headers['Content-Encoding'] = encoding
+    # the compressed representation is not byte-identical to the original, so the ETag becomes weak
+    etag, is_weak = response.get_etag()
+    if etag and not is_weak:
+        response.set_etag(etag, weak=True)
+
+    return response
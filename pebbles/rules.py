@@ -1,8 +1,11 @@
-from sqlalchemy import or_, select, false, func
+import time
+
+from sqlalchemy import and_, exists, or_, select, false, func
 from sqlalchemy.sql.expression import true
 
+from pebbles.db_types import epoch_seconds
 from pebbles.models import Application, ApplicationTemplate, ApplicationSession, User, WorkspaceMembership, Workspace, \
-    CustomImage
+    CustomImage, Lock
 
 
 def apply_rules_application_templates(user, args=None):
@@ -68,8 +71,37 @@ def generate_application_session_query(user, args=None):
                 ApplicationSession.user_id == user.id
             )
         )
+        # warm sessions are only visible to admins until they are handed over to a user
+        s = s.where(ApplicationSession.is_warm == false())
 
-    if args and args.get('limit'):
+    if args and args.get('work_queue'):
+        # only sessions that the worker has to act on, see SessionController.process(). Sessions locked by
+        # a worker are left out, so that concurrent workers do not pick the same ones.
+        s = s.where(
+            or_(
+                ApplicationSession.state.in_([ApplicationSession.STATE_QUEUEING, ApplicationSession.STATE_STARTING]),
+                ApplicationSession.to_be_deleted == true(),
+                and_(
+                    ApplicationSession.state == ApplicationSession.STATE_RUNNING,
+                    or_(
+                        ApplicationSession.log_fetch_pending == true(),
+                        # maximum lifetime exceeded
+                        and_(
+                            Application.maximum_lifetime > 0,
+                            epoch_seconds(ApplicationSession.provisioned_at) <= time.time() - Application.maximum_lifetime,
+                        ),
+                    )
+                ),
+            )
+        )
+        s = s.where(~exists().where(Lock.id == ApplicationSession.id))
+        # sessions that have waited longest since the last processing attempt, or since their last change if they
+        # have not been attempted yet, first. Sessions that stay in the queue after an attempt move to the back.
+        s = s.order_by(
+            func.coalesce(ApplicationSession.worker_attempted_at, ApplicationSession.updated_at),
+            ApplicationSession.id
+        )
+    elif args and args.get('limit'):
         # prioritize to_be_deleted
         s = s.order_by(ApplicationSession.to_be_deleted == false())
         # then sessions that are not in static states (failed, running, deleted)
@@ -80,8 +112,10 @@ def generate_application_session_query(user, args=None):
                 ApplicationSession.state == ApplicationSession.STATE_DELETED,
             )
         )
-        # finally random order as the last criteria
-        s = s.order_by(func.random())
+        # oldest first as the last criteria
+        s = s.order_by(ApplicationSession.created_at, ApplicationSession.id)
+
+    if args and args.get('limit'):
         s = s.limit(int(args.get('limit')))
 
     return s
@@ -1,14 +1,17 @@
 from datetime import datetime
+import json
 import time
 
 import flask_restful as restful
 from flask import abort, request
 from flask_restful import marshal_with, fields, reqparse
+from sqlalchemy import select, update
 
+from pebbles.db_upsert import insert_for
 from pebbles.models import Alert
 from pebbles.models import db
 from pebbles.utils import requires_admin
-from pebbles.views.commons import auth
+from pebbles.views.commons import auth, add_pagination_arguments, paginate
 
 
 alert_fields = {
@@ -25,10 +28,55 @@ alert_fields = {
 EXPIRY_AGE_LIMIT = 60 * 3
 
 
+def upsert_alerts(entries):
+    """
+    Insert or update given alert entries with a single statement. Existing alerts get the new status and their
+    last seen timestamp refreshed. Returns the ids of the alerts in the order of the entries.
+    """
+    now = datetime.fromtimestamp(time.time())
+    alert_ids = []
+    rows = dict()
+    for entry in entries:
+        data = entry.get('data', dict())
+        alert_id = Alert.generate_alert_id(entry.get('target'), entry.get('source'), data)
+        alert_ids.append(alert_id)
+        # a row can be affected only once in a statement, the last entry for an alert wins
+        rows[alert_id] = dict(
+            id=alert_id,
+            target=entry.get('target'),
+            source=entry.get('source'),
+            status=entry.get('status'),
+            data=json.dumps(data),
+            first_seen_ts=now,
+            last_seen_ts=now,
+        )
+    if not rows:
+        return alert_ids
+
+    stmt = insert_for(db.session, Alert.__table__).values(list(rows.values()))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Alert.__table__.c.id],
+        set_=dict(status=stmt.excluded.status, last_seen_ts=stmt.excluded.last_seen_ts),
+    )
+    db.session.execute(stmt)
+    return alert_ids
+
+
+def get_alerts_by_id(alert_ids):
+    """Load alerts in the order of given ids, refreshing instances that are already in the session"""
+    alerts = db.session.scalars(
+        select(Alert).where(Alert.id.in_(set(alert_ids))).execution_options(populate_existing=True)
+    ).all()
+    alerts_by_id = {alert.id: alert for alert in alerts}
+    return [alerts_by_id[alert_id] for alert_id in alert_ids]
+
+
 class AlertList(restful.Resource):
-    get_parser = reqparse.RequestParser()
+    get_parser = add_pagination_arguments(reqparse.RequestParser())
     get_parser.add_argument('include_archived', type=str, default=None, location='args')
     get_parser.add_argument('since_ts', type=int, default=0, location='args')
+    get_parser.add_argument('status', type=str, location='args')
+    get_parser.add_argument('target', type=str, location='args')
 
     @auth.login_required
     @requires_admin
@@ -36,49 +84,41 @@ class AlertList(restful.Resource):
     def get(self):
         args = self.get_parser.parse_args()
 
-        q = Alert.query
+        q = select(Alert)
         if not args.get('include_archived'):
             q = q.filter(Alert.status != 'archived')
 
         if args.get('since_ts'):
             q = q.filter(Alert._last_seen_ts > datetime.fromtimestamp(args.get('since_ts')))
 
-        alerts = q.order_by(Alert._first_seen_ts).all()
+        if args.get('status'):
+            q = q.filter(Alert.status == args.get('status'))
+
+        if args.get('target'):
+            q = q.filter(Alert.target == args.get('target'))
+
+        alerts, headers = paginate(q, Alert._first_seen_ts, Alert.id, args)
 
         # if an alert with status 'ok' is too old, set it expired
         for alert in alerts:
             if alert.status == 'ok' and alert.last_seen_ts < time.time() - EXPIRY_AGE_LIMIT:
                 alert.status = 'data expired'
 
-        return alerts
+        return alerts, 200, headers
 
     @auth.login_required
     @requires_admin
     @marshal_with(alert_fields)
     def post(self):
-        res = []
-
-        for entry in request.json:
-            target = entry.get('target')
-            source = entry.get('source')
-            status = entry.get('status')
-            data = entry.get('data', dict())
-            if not (target and source and status):
+        entries = request.json
+        for entry in entries:
+            if not (entry.get('target') and entry.get('source') and entry.get('status')):
                 return "target, source and status have to be defined", 422
 
-            alert_id = Alert.generate_alert_id(target, source, data)
-            alert = Alert.query.filter_by(id=alert_id).first()
-            if not alert:
-                alert = Alert(alert_id, target, source, status, data)
-                db.session.add(alert)
-            else:
-                alert.status = status
-                alert.last_seen_ts = time.time()
-            res.append(alert)
-
+        alert_ids = upsert_alerts(entries)
         db.session.commit()
 
-        return res
+        return get_alerts_by_id(alert_ids)
 
 
 class AlertView(restful.Resource):
@@ -98,23 +138,18 @@ class AlertReset(restful.Resource):
     @requires_admin
     @marshal_with(alert_fields)
     def post(self, target, source):
-        firing_alerts = Alert.query.filter_by(target=target, source=source, status='firing').all()
-        for alert in firing_alerts:
-            alert.status = 'archived'
-
-        status = 'ok'
-        data = dict()
+        archived_ids = db.session.scalars(
+            update(Alert)
+            .where(Alert.target == target, Alert.source == source, Alert.status == 'firing')
+            .values(status='archived')
+            .returning(Alert.id)
+            .execution_options(synchronize_session=False)
+        ).all()
 
-        alert_id = Alert.generate_alert_id(target, source, data)
-        alert = Alert.query.filter_by(id=alert_id).first()
-        if not alert:
-            alert = Alert(alert_id, target, source, status, data)
-            db.session.add(alert)
-        else:
-            alert.last_seen_ts = time.time()
+        upsert_alerts([dict(target=target, source=source, status='ok', data=dict())])
 
         db.session.commit()
-        return firing_alerts
+        return get_alerts_by_id(archived_ids)
 
 
 class SystemStatus(restful.Resource):
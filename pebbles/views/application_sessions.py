@@ -1,17 +1,25 @@
 import json
 import logging
-from datetime import datetime, timezone
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
 
 import flask_restful as restful
 from flask import abort, g, current_app
-from flask_restful import marshal_with, fields, reqparse
-from sqlalchemy import exists
+from flask_restful import marshal_with, fields, inputs, reqparse
+from sqlalchemy import delete, exists, or_, select, text, true, false, func, cast, Float
 
 from pebbles import rules, utils
+from pebbles.db_replica import replica_read
+from pebbles.db_types import json_field
+from pebbles.db_upsert import insert_for
 from pebbles.forms import ApplicationSessionForm
-from pebbles.models import db, Application, ApplicationSession, ApplicationSessionLog, User
+from pebbles.models import db, get_utc_now, Application, ApplicationSession, ApplicationSessionArchive, \
+    ApplicationSessionLog, User
+from pebbles.notifications import publish_session_state_event, publish_session_log_event
 from pebbles.utils import requires_admin
-from pebbles.views.commons import auth, is_workspace_manager, requires_workspace_manager_or_admin
+from pebbles.views.commons import auth, is_workspace_manager, requires_workspace_manager_or_admin, \
+    check_not_modified, get_change_marker
 
 
 application_session_fields_admin = {
@@ -92,6 +100,9 @@ application_session_log_fields = {
 
 MAX_APPLICATION_SESSIONS_PER_USER = 2
 
+# cached session lists are revalidated at least this often, as the lifetime left changes
+LIFETIME_LEFT_RESOLUTION_SECS = 30
+
 
 def marshal_based_on_role(user, application_session):
     if user.is_admin:
@@ -125,13 +136,27 @@ def positive_integer(input_value):
 class ApplicationSessionList(restful.Resource):
     list_parser = reqparse.RequestParser()
     list_parser.add_argument('limit', type=int, location='args')
+    # only sessions that need action from the worker, least recently attempted first
+    list_parser.add_argument('work_queue', type=inputs.boolean, default=False, location='args')
 
     @auth.login_required
+    @replica_read
     def get(self):
         user = g.user
 
         args = self.list_parser.parse_args()
         s = rules.generate_application_session_query(user, args)
+        # the worker polls the work queue with a limit, conditional GET is for full listings
+        if not (args.get('limit') or args.get('work_queue')):
+            not_modified = check_not_modified(
+                'application_sessions', user.id, args,
+                get_change_marker(s, ApplicationSession.updated_at, Application.updated_at),
+                # lifetime_left in the response changes with time
+                int(time.time() / LIFETIME_LEFT_RESOLUTION_SECS),
+            )
+            if not_modified:
+                return not_modified
+
         rows = db.session.execute(s).all()
         current_sessions = []
         for row in rows:
@@ -195,20 +220,21 @@ class ApplicationSessionList(restful.Resource):
             if session.application_id == application_id:
                 return 'There is already an existing session for this application', 409
 
-        # then check that workspace is not out of resources
-        application_sessions_in_ws = ApplicationSession.query \
-            .filter(ApplicationSession.state != 'deleted') \
-            .join(Application) \
-            .filter_by(workspace_id=application.workspace_id).all()
-        # sum up existing resources + the new session on top
-        ws_consumed_mem = application.config.get('memory_gib', application.base_config.get('memory_gib', 1.0))
-        for sess in application_sessions_in_ws:
-            ws_consumed_mem += sess.provisioning_config.get('memory_gib', 1.0)
-
-        if ws_consumed_mem > application.workspace.memory_limit_gib:
+        # then check that workspace is not out of resources. This applies to claimed warm sessions as well, they
+        # have the current provisioning config of the application and are not counted while they are idle.
+        if not workspace_has_memory_for(application):
             logging.info('workspace %s is over memory limit', application.workspace_id)
             return 'Concurrent session memory limit for workspace exceeded', 409
 
+        # regular users can take over a warm session that is already running. Managers and admins always get
+        # a fresh session, because their access to the shared folder differs from the one warm sessions have.
+        if not (user.is_admin or is_workspace_manager(user, application.workspace)):
+            application_session = claim_warm_application_session(application, user)
+            if application_session:
+                db.session.commit()
+                application_session.container_image = application_session.provisioning_config.get('image')
+                return marshal_based_on_role(user, application_session), 200
+
         # create the application_session and assign provisioning config from current application + template
         application_session = ApplicationSession(application, user)
         db.session.add(application_session)
@@ -217,24 +243,76 @@ class ApplicationSessionList(restful.Resource):
         # data for info field
         application_session.container_image = application_session.provisioning_config.get('image')
 
-        # Note: the potential race is solved by unique constraint in database
-        retry_count = 0
-        while True:
-            # decide on a name that is not used currently
-            c_name = ApplicationSession.generate_name(prefix=current_app.config.get('SESSION_NAME_PREFIX'))
-            if not db.session.query(exists().where(ApplicationSession.name == c_name)).scalar():
-                application_session.name = c_name
-                break
-            retry_count += 1
-
-        if retry_count > 10:
-            logging.warning('Session name retries: %d, consider expanding the number of permutations', retry_count)
+        assign_application_session_name(application_session)
 
         db.session.commit()
 
         return marshal_based_on_role(user, application_session), 200
 
 
+def workspace_has_memory_for(application, include_warm_sessions=False):
+    """
+    Check that a new session for the application fits in the workspace memory limit. Idle warm sessions are not
+    counted for user launches, so that a warm pool cannot use up the memory of the workspace. Warm pools pass
+    include_warm_sessions to stay within the limit themselves.
+    """
+    # sum up existing resources in the database + the new session on top
+    session_mem = func.coalesce(cast(json_field(ApplicationSession._provisioning_config, 'memory_gib'), Float), 1.0)
+    s = select(func.sum(session_mem)) \
+        .join(Application) \
+        .where(ApplicationSession.state != 'deleted') \
+        .where(Application.workspace_id == application.workspace_id)
+    if not include_warm_sessions:
+        s = s.where(ApplicationSession.is_warm == false())
+    sessions_mem = db.session.scalar(s)
+    ws_consumed_mem = application.config.get('memory_gib', application.base_config.get('memory_gib', 1.0))
+    ws_consumed_mem += sessions_mem or 0
+
+    return ws_consumed_mem <= application.workspace.memory_limit_gib
+
+
+def assign_application_session_name(application_session):
+    """Pick a name for a new application session"""
+    # Note: the potential race is solved by unique constraint in database
+    retry_count = 0
+    while True:
+        # decide on a name that is not used currently
+        c_name = ApplicationSession.generate_name(prefix=current_app.config.get('SESSION_NAME_PREFIX'))
+        if not db.session.query(exists().where(ApplicationSession.name == c_name)).scalar():
+            application_session.name = c_name
+            break
+        retry_count += 1
+
+    if retry_count > 10:
+        logging.warning('Session name retries: %d, consider expanding the number of permutations', retry_count)
+
+
+def claim_warm_application_session(application, user):
+    """Hand over a running warm session of the application to the user, if one with current config is available"""
+    provisioning_config = utils.get_provisioning_config(application)
+    s = select(ApplicationSession) \
+        .where(ApplicationSession.application_id == application.id) \
+        .where(ApplicationSession.is_warm == true()) \
+        .where(ApplicationSession.state == ApplicationSession.STATE_RUNNING) \
+        .where(ApplicationSession.to_be_deleted == false()) \
+        .order_by(ApplicationSession.provisioned_at) \
+        .with_for_update(skip_locked=True)
+    for application_session in db.session.scalars(s):
+        # sessions provisioned with outdated config are left for the worker to clean up
+        if application_session.provisioning_config != provisioning_config:
+            continue
+        logging.info('handing over warm session %s to user %s', application_session.name, user.id)
+        application_session.user_id = user.id
+        application_session.is_warm = False
+        # lifetime starts from the hand-over
+        now = datetime.now(timezone.utc)
+        application_session.created_at = now
+        application_session.provisioned_at = now
+        return application_session
+
+    return None
+
+
 class ApplicationSessionView(restful.Resource):
 
     @auth.login_required
@@ -341,6 +419,9 @@ class ApplicationSessionView(restful.Resource):
                 logging.warning("invalid session_data passed to view: %s" % args['session_data'])
             db.session.commit()
 
+        if args.get('state') or args.get('to_be_deleted') or args.get('error_msg') or args.get('session_data'):
+            publish_session_state_event(application_session)
+
 
 class ApplicationSessionLogs(restful.Resource):
 
@@ -365,39 +446,35 @@ class ApplicationSessionLogs(restful.Resource):
     def patch(self, application_session_id):
         patch_parser = reqparse.RequestParser()
         patch_parser.add_argument('log_record', type=dict)
+        # several records can be submitted at once
+        patch_parser.add_argument('log_records', type=dict, action='append')
         args = patch_parser.parse_args()
 
+        log_records = list(args.get('log_records') or [])
         if args.get('log_record'):
-            log_record = args['log_record']
-
-            application_session_log = None
-            # provisioning logs: check if we already have a matching line and can skip adding a duplicate
-            if log_record['log_type'] == 'provisioning':
-                existing_logs = get_logs_from_db(application_session_id, log_record['log_type'])
-                for log_line in existing_logs:
-                    if log_line.timestamp == log_record['timestamp'] and log_line.log_type == log_record['log_type']:
-                        return 'no change'
-
-            # running logs: patch the existing entry with new timestamp and message
-            if log_record['log_type'] == 'running':
-                existing_logs = get_logs_from_db(application_session_id, log_record['log_type'])
-                if existing_logs:
-                    application_session_log = existing_logs[0]
-                    application_session_log.timestamp = float(log_record['timestamp'])
-                    application_session_log.message = log_record['message']
-
-            # no previous log record found, add a new one to the session
-            if not application_session_log:
-                application_session_log = ApplicationSessionLog(
-                    application_session_id,
-                    log_record['log_level'],
-                    log_record['log_type'],
-                    log_record['timestamp'],
-                    log_record['message'],
-                )
-                db.session.add(application_session_log)
+            log_records.append(args['log_record'])
+        if not log_records:
+            return 'ok'
 
-            db.session.commit()
+        try:
+            log_records = [parse_log_record(log_record) for log_record in log_records]
+        except (KeyError, TypeError, ValueError) as e:
+            return 'invalid log record: %s' % e, 422
+
+        written_records = write_logs_to_db(application_session_id, log_records)
+        db.session.commit()
+        if not written_records:
+            return 'no change'
+
+        # owner and workspace of the session for routing the events to the right clients
+        row = db.session.execute(
+            select(ApplicationSession.user_id, Application.workspace_id)
+            .join(Application)
+            .where(ApplicationSession.id == application_session_id)
+        ).first()
+        if row:
+            for log_record in written_records:
+                publish_session_log_event(application_session_id, row.user_id, row.workspace_id, log_record)
 
         return 'ok'
 
@@ -410,6 +487,95 @@ class ApplicationSessionLogs(restful.Resource):
         delete_logs_from_db(application_session_id, args.get('log_type'))
 
 
+class ApplicationSessionLogRetention(restful.Resource):
+    """Prunes provisioning logs older than SESSION_LOG_RETENTION_DAYS, one bounded batch per call"""
+
+    @auth.login_required
+    @requires_admin
+    def post(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument('batch_size', type=int, default=None, required=False, location='args')
+        args = parser.parse_args()
+
+        retention_days = current_app.config['SESSION_LOG_RETENTION_DAYS']
+        if not retention_days:
+            return dict(num_deleted=0)
+        max_batch_size = current_app.config['SESSION_LOG_RETENTION_BATCH_SIZE']
+        batch_size = args.get('batch_size')
+        batch_size = max_batch_size if batch_size is None else min(batch_size, max_batch_size)
+        if batch_size < 1:
+            return 'batch_size has to be positive', 422
+
+        cutoff_ts = time.time() - retention_days * 24 * 3600
+        num_deleted = prune_logs_from_db(cutoff_ts, batch_size)
+        if num_deleted:
+            logging.info('pruned %d provisioning log lines older than %d days', num_deleted, retention_days)
+        return dict(num_deleted=num_deleted, batch_size=batch_size)
+
+
+class ApplicationSessionArchiveList(restful.Resource):
+    """Moves deleted sessions to the archive table, one bounded batch per call"""
+
+    @auth.login_required
+    @requires_admin
+    def post(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument('batch_size', type=int, default=None, required=False, location='args')
+        args = parser.parse_args()
+
+        max_batch_size = current_app.config['SESSION_ARCHIVE_BATCH_SIZE']
+        batch_size = args.get('batch_size')
+        batch_size = max_batch_size if batch_size is None else min(batch_size, max_batch_size)
+        if batch_size < 1:
+            return 'batch_size has to be positive', 422
+
+        deleted_before = get_utc_now() - timedelta(seconds=current_app.config['SESSION_ARCHIVE_GRACE_PERIOD'])
+        num_archived = archive_deleted_sessions(deleted_before, batch_size)
+        if num_archived:
+            logging.info('archived %d deleted application sessions', num_archived)
+        return dict(num_archived=num_archived, batch_size=batch_size)
+
+
+def archive_deleted_sessions(deleted_before, batch_size):
+    """
+    Move at most batch_size sessions that were deleted before given time to the archive table, along with the
+    workspace of their application. Logs of the archived sessions are removed. Returns the number of sessions.
+    """
+    session_ids = db.session.scalars(
+        select(ApplicationSession.id)
+        .where(ApplicationSession.state == ApplicationSession.STATE_DELETED)
+        .where(or_(ApplicationSession.updated_at < deleted_before, ApplicationSession.updated_at.is_(None)))
+        .limit(batch_size)
+    ).all()
+    if not session_ids:
+        return 0
+
+    sessions = ApplicationSession.__table__
+    archive = ApplicationSessionArchive.__table__
+    columns = ('id', 'name', 'user_id', 'application_id', 'created_at', 'provisioned_at', 'deprovisioned_at',
+               'errored', 'is_warm', 'error_msg', 'provisioning_config')
+    rows = select(*[sessions.c[c] for c in columns], Application.__table__.c.workspace_id) \
+        .select_from(sessions.outerjoin(Application.__table__)) \
+        .where(sessions.c.id.in_(session_ids))
+    # already archived rows are skipped, a batch that failed half way can be run again
+    stmt = insert_for(db.session, archive) \
+        .from_select([*columns, 'workspace_id'], rows) \
+        .on_conflict_do_nothing(index_elements=[archive.c.id])
+    db.session.execute(stmt)
+    db.session.execute(
+        delete(ApplicationSessionLog)
+        .where(ApplicationSessionLog.application_session_id.in_(session_ids))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        delete(ApplicationSession)
+        .where(ApplicationSession.id.in_(session_ids))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return len(session_ids)
+
+
 def get_logs_from_db(application_session_id, log_type=None):
     logs_query = ApplicationSessionLog.query \
         .filter_by(application_session_id=application_session_id) \
@@ -421,12 +587,80 @@ def get_logs_from_db(application_session_id, log_type=None):
     return logs
 
 
+def parse_log_record(log_record):
+    return dict(
+        log_level=str(log_record['log_level']),
+        log_type=str(log_record['log_type']),
+        timestamp=float(log_record['timestamp']),
+        message=log_record['message'],
+    )
+
+
+def write_logs_to_db(application_session_id, log_records):
+    """
+    Write log records of a session with a single statement per log type. Provisioning lines that already exist
+    are skipped and the running log is replaced with the latest record. Returns the records that were written.
+    """
+    table = ApplicationSessionLog.__table__
+    running_records = [r for r in log_records if r['log_type'] == ApplicationSessionLog.LOG_TYPE_RUNNING]
+    other_records = [r for r in log_records if r['log_type'] != ApplicationSessionLog.LOG_TYPE_RUNNING]
+    written_records = []
+
+    if other_records:
+        rows = [
+            dict(r, id=uuid.uuid4().hex, application_session_id=application_session_id) for r in other_records
+        ]
+        # duplicate provisioning lines hit the partial unique index and are skipped. The index predicate is given
+        # as a literal, bound parameters cannot be used with executemany and the database has to match the index.
+        stmt = insert_for(db.session, table).on_conflict_do_nothing(
+            index_elements=[table.c.application_session_id, table.c.log_type, table.c.timestamp],
+            index_where=text("log_type = '%s'" % ApplicationSessionLog.LOG_TYPE_PROVISIONING),
+        ).returning(table.c.id)
+        inserted_ids = set(db.session.scalars(stmt, rows))
+        written_records.extend(r for r, row in zip(other_records, rows) if row['id'] in inserted_ids)
+
+    if running_records:
+        # the running log is sent as a whole, only the latest one counts
+        record = running_records[-1]
+        stmt = insert_for(db.session, table).values(
+            id=uuid.uuid4().hex, application_session_id=application_session_id, **record
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.application_session_id, table.c.log_type],
+            index_where=text("log_type = '%s'" % ApplicationSessionLog.LOG_TYPE_RUNNING),
+            set_=dict(
+                log_level=stmt.excluded.log_level,
+                timestamp=stmt.excluded.timestamp,
+                message=stmt.excluded.message,
+            ),
+        )
+        db.session.execute(stmt)
+        written_records.append(record)
+
+    return written_records
+
+
 def delete_logs_from_db(application_session_id, log_type=None):
-    application_session_logs = get_logs_from_db(application_session_id, log_type)
-    if not application_session_logs:
+    stmt = delete(ApplicationSessionLog).where(ApplicationSessionLog.application_session_id == application_session_id)
+    if log_type:
+        stmt = stmt.where(ApplicationSessionLog.log_type == log_type)
+    num_deleted = db.session.execute(stmt.execution_options(synchronize_session=False)).rowcount
+    if not num_deleted:
         logging.debug('There are no application log entries to be deleted')
-        return
+        return 0
 
-    for application_session_log in application_session_logs:
-        db.session.delete(application_session_log)
     db.session.commit()
+    return num_deleted
+
+
+def prune_logs_from_db(cutoff_ts, batch_size):
+    """Delete at most batch_size provisioning log lines older than cutoff_ts, oldest first"""
+    expired_ids = select(ApplicationSessionLog.id) \
+        .where(ApplicationSessionLog.log_type == ApplicationSessionLog.LOG_TYPE_PROVISIONING) \
+        .where(ApplicationSessionLog.timestamp < cutoff_ts) \
+        .order_by(ApplicationSessionLog.timestamp) \
+        .limit(batch_size)
+    stmt = delete(ApplicationSessionLog).where(ApplicationSessionLog.id.in_(expired_ids.scalar_subquery()))
+    num_deleted = db.session.execute(stmt.execution_options(synchronize_session=False)).rowcount
+    db.session.commit()
+    return num_deleted
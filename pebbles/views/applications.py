@@ -1,20 +1,24 @@
 import logging
 import uuid
-from datetime import timezone, datetime
+from collections import defaultdict
+from datetime import timezone, datetime, timedelta
 
 import flask_restful as restful
 from flask import abort, g, request
 from flask_restful import fields, reqparse
-from sqlalchemy import select
+from sqlalchemy import select, func, false, union_all
 from sqlalchemy.orm.session import make_transient
 
 from pebbles import rules
+from pebbles.catalogue_cache import get_catalogue_cache
+from pebbles.db_replica import replica_read
 from pebbles.forms import ApplicationForm
-from pebbles.models import db, Application, ApplicationTemplate, Workspace, ApplicationSession
+from pebbles.models import db, Application, ApplicationTemplate, Workspace, ApplicationSession, \
+    ApplicationSessionArchive, WorkspaceMembership, list_active_applications, is_valid_image_reference
 from pebbles.utils import requires_admin, check_config_against_attribute_limits, \
     check_attribute_limit_format, validate_container_image_url
 from pebbles.views import commons
-from pebbles.views.commons import auth, requires_workspace_manager_or_admin
+from pebbles.views.commons import auth, requires_workspace_manager_or_admin, get_change_marker
 
 
 application_field_role_map = dict(
@@ -112,10 +116,27 @@ class ApplicationList(restful.Resource):
     get_parser.add_argument('workspace_id', type=str, default=None, required=False, location='args')
 
     @auth.login_required
+    @replica_read
     def get(self):
         args = self.get_parser.parse_args()
         user = g.user
         s = rules.generate_application_query(user, args)
+        timestamp_columns = [Application.updated_at, Workspace.updated_at]
+        if not user.is_admin:
+            timestamp_columns.append(WorkspaceMembership.updated_at)
+        not_modified = commons.check_not_modified(
+            'applications', user.id, args, get_change_marker(s, *timestamp_columns))
+        if not_modified:
+            return not_modified
+
+        cache = get_catalogue_cache() if not user.is_admin else None
+        if cache:
+            generation = cache.generation
+            cache_key = get_catalogue_cache_key(user, args)
+            results = cache.get(cache_key)
+            if results is not None:
+                return results
+
         rows = db.session.execute(s).all()
         results = []
         for row in rows:
@@ -127,6 +148,9 @@ class ApplicationList(restful.Resource):
             else:
                 results.append(marshal_based_on_role('user', application))
 
+        if cache:
+            cache.put(cache_key, results, generation)
+
         return results
 
     @auth.login_required
@@ -391,6 +415,90 @@ class ApplicationCopy(restful.Resource):
         db.session.commit()
 
 
+class ApplicationImageList(restful.Resource):
+    """
+    Images used by active applications, weighted by how likely they are to be launched soon.
+    Used by the worker to pick the images to pre-pull on cluster nodes.
+    """
+    get_parser = reqparse.RequestParser()
+    get_parser.add_argument('launch_window_days', type=int, default=14, location='args')
+
+    @auth.login_required
+    @requires_admin
+    def get(self):
+        args = self.get_parser.parse_args()
+        launch_window_start = (
+            datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=max(args.launch_window_days, 0))
+        )
+
+        # number of recent launches per application, deleted sessions are moved to the archive within the window.
+        # Idle warm sessions are not launches, claimed ones are.
+        launches = union_all(
+            select(ApplicationSession.application_id.label('application_id'))
+            .where(ApplicationSession.created_at >= launch_window_start)
+            .where(ApplicationSession.is_warm == false()),
+            select(ApplicationSessionArchive.application_id.label('application_id'))
+            .where(ApplicationSessionArchive.created_at >= launch_window_start)
+            .where(ApplicationSessionArchive.is_warm == false()),
+        ).subquery()
+        launch_counts = dict(db.session.execute(
+            select(launches.c.application_id, func.count())
+            .group_by(launches.c.application_id)
+        ).all())
+        # number of potential users per workspace
+        member_counts = dict(db.session.execute(
+            select(WorkspaceMembership.workspace_id, func.count(WorkspaceMembership.user_id))
+            .where(WorkspaceMembership.is_banned.is_(False))
+            .group_by(WorkspaceMembership.workspace_id)
+        ).all())
+
+        images = dict()
+        workspace_ids = defaultdict(set)
+        for application in list_active_applications():
+            image = application.get_image().strip()
+            if not is_valid_image_reference(image):
+                continue
+            key = (image, application.workspace.cluster)
+            entry = images.setdefault(key, dict(
+                image=image,
+                cluster=application.workspace.cluster,
+                application_count=0,
+                launch_count=0,
+                member_count=0,
+            ))
+            entry['application_count'] += 1
+            entry['launch_count'] += launch_counts.get(application.id, 0)
+            # members of a workspace are counted once per image, even if it has several applications using it
+            if application.workspace_id not in workspace_ids[key]:
+                workspace_ids[key].add(application.workspace_id)
+                entry['member_count'] += member_counts.get(application.workspace_id, 0)
+
+        # recent launches dominate, workspace size breaks ties and covers freshly created courses
+        for entry in images.values():
+            entry['weight'] = entry['launch_count'] + entry['member_count'] / 10
+
+        return sorted(images.values(), key=lambda x: (-x['weight'], x['image']))
+
+
+def get_catalogue_cache_key(user, args):
+    """
+    Catalogue cache key for a non-admin user: the workspace memberships with roles, the query arguments and
+    a change marker for the applications and workspaces in the memberships
+    """
+    memberships = tuple(tuple(row) for row in db.session.execute(
+        select(WorkspaceMembership.workspace_id, WorkspaceMembership.is_manager)
+        .where(WorkspaceMembership.user_id == user.id)
+        .where(WorkspaceMembership.is_banned == false())
+        .order_by(WorkspaceMembership.workspace_id)
+    ).all())
+    marker = get_change_marker(
+        select(Application).join(Workspace).where(Application.workspace_id.in_([m[0] for m in memberships])),
+        Application.updated_at,
+        Workspace.updated_at,
+    )
+    return memberships, args.get('workspace_id'), marker
+
+
 def process_application(application):
     # cache application template names in the request context to avoid lookups on every call
     template_name_cache = g.setdefault('template_name_cache', dict())
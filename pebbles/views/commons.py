@@ -1,9 +1,18 @@
+import base64
+import binascii
+import hashlib
+import json
 import logging
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
 from functools import wraps
 
-from flask import g, abort, current_app
+from flask import g, abort, current_app, request, Response
 from flask_httpauth import HTTPBasicAuth
+from flask_restful import inputs
+from sqlalchemy import func, or_, and_, select, DateTime
 
+from pebbles.app import bcrypt
 from pebbles.models import db, User, Workspace, WorkspaceMembership
 
 auth = HTTPBasicAuth()
@@ -12,6 +21,21 @@ auth.authenticate_header = lambda: "Authentication Required"
 # Delimiter between optional identity domain/prefix and username(eppn/vppn/email)
 EXT_ID_PREFIX_DELIMITER = '/'
 
+# Cache-Control policies for API responses, see cache_policy() and the after_request hook in app.py
+# - default: nothing is stored
+CACHE_POLICY_NO_STORE = 'no-cache, no-store, must-revalidate'
+# - responses with an ETag can be stored by the client, but have to be revalidated on every use
+CACHE_POLICY_REVALIDATE = 'private, no-cache'
+# - public data that changes only when the installation is reconfigured
+CACHE_POLICY_PUBLIC_MAX_AGE = 300
+CACHE_POLICY_PUBLIC = 'public, max-age=%d' % CACHE_POLICY_PUBLIC_MAX_AGE
+
+# upper limit for page size in keyset paginated lists
+MAX_PAGE_SIZE = 1000
+
+# number of users inserted and committed at a time in create_users()
+CREATE_USERS_BATCH_SIZE = 500
+
 
 @auth.verify_password
 def verify_password(userid_or_token, password):
@@ -46,6 +70,51 @@ def create_user(ext_id, password, is_admin=False, email_id=None, expiry_ts=None,
     return user
 
 
+def hash_password(password, rounds):
+    # top level function, it is run in the worker processes of create_users()
+    return bcrypt.generate_password_hash(password, rounds).decode('utf-8')
+
+
+def create_users(accounts, expiry_ts=None, batch_size=CREATE_USERS_BATCH_SIZE, max_workers=None):
+    """
+    Create regular users in bulk from (ext_id, password) pairs and add them to the default workspace.
+    Existing users are looked up with a single query and skipped. Passwords are hashed in a process pool,
+    and users are inserted with their memberships and committed in batches. Returns the ext_ids of the created users.
+    """
+    unique_accounts = dict()
+    for ext_id, password in accounts:
+        unique_accounts.setdefault(ext_id.lower(), password)
+    accounts = list(unique_accounts.items())
+    existing = set(db.session.scalars(
+        select(User._ext_id).where(User._ext_id.in_([ext_id for ext_id, _ in accounts]))
+    ))
+    for ext_id in existing:
+        logging.info("user %s already exists" % ext_id)
+    accounts = [(ext_id, password) for ext_id, password in accounts if ext_id not in existing]
+    if not accounts:
+        return []
+
+    system_default_workspace = Workspace.query.filter_by(name='System.default').first()
+    if not system_default_workspace:
+        logging.warning('System.default workspace not found, users are not added to it')
+
+    rounds = current_app.config.get('BCRYPT_LOG_ROUNDS', 12)
+    passwords = [password for _, password in accounts]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        password_hashes = list(executor.map(hash_password, passwords, [rounds] * len(passwords), chunksize=16))
+
+    for i in range(0, len(accounts), batch_size):
+        batch = []
+        for (ext_id, _), password_hash in zip(accounts[i:i + batch_size], password_hashes[i:i + batch_size]):
+            user = User(ext_id, expiry_ts=expiry_ts, password_hash=password_hash)
+            batch.append(user)
+            if system_default_workspace and can_user_join_workspace(user, system_default_workspace):
+                batch.append(WorkspaceMembership(workspace_id=system_default_workspace.id, user_id=user.id))
+        db.session.add_all(batch)
+        db.session.commit()
+    return [ext_id for ext_id, _ in accounts]
+
+
 def update_email(ext_id, email_id=None):
     user = User.query.filter_by(ext_id=ext_id).first()
     if email_id:
@@ -121,3 +190,110 @@ def is_workspace_owner(user, workspace=None):
     else:
         # generic property can be obtained from User
         return user.is_workspace_owner
+
+
+def cache_policy(policy):
+    """Decorator for setting the Cache-Control policy for successful responses of a handler"""
+
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            g.cache_policy = policy
+            return f(*args, **kwargs)
+
+        return decorated
+
+    return decorator
+
+
+def get_change_marker(s, *timestamp_columns):
+    """
+    Return a cheap marker for the state of the rows a query selects: the number of rows and
+    the latest update timestamps in given columns. Ordering and limits of the query are dropped.
+    """
+    marker_query = s.with_only_columns(
+        func.count(),
+        *[func.max(c) for c in timestamp_columns],
+        maintain_column_froms=True,
+    ).order_by(None).limit(None)
+    return tuple(db.session.execute(marker_query).one())
+
+
+def check_not_modified(*marker):
+    """
+    Conditional GET support. Sets a strong ETag computed from the marker for the response and returns
+    a '304 Not Modified' response if the client already has the current version, None otherwise.
+    """
+    etag = hashlib.sha1(json.dumps(marker, default=str).encode('utf-8')).hexdigest()
+    g.etag = etag
+    g.cache_policy = CACHE_POLICY_REVALIDATE
+    # proxies that compress the response turn ETags weak, so compare weakly as RFC 9110 allows for GET
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304)
+    return None
+
+
+def add_pagination_arguments(parser):
+    """Add the keyset pagination and time range arguments to a list parser, see paginate()"""
+    parser.add_argument('page_size', type=int, location='args')
+    parser.add_argument('cursor', type=str, location='args')
+    parser.add_argument('count', type=inputs.boolean, default=False, location='args')
+    parser.add_argument('from_ts', type=float, location='args')
+    parser.add_argument('to_ts', type=float, location='args')
+    return parser
+
+
+def encode_cursor(values):
+    data = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, columns):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError('cursor length does not match')
+        return [
+            datetime.fromisoformat(v) if isinstance(c.type, DateTime) and v is not None else v
+            for v, c in zip(values, columns)
+        ]
+    except (ValueError, TypeError, binascii.Error, UnicodeError):
+        abort(422, 'invalid cursor')
+
+
+def paginate(s, sort_column, id_column, args):
+    """
+    Keyset pagination for a select statement. Rows are ordered by (sort_column, id_column), and the time range
+    in args (from_ts, to_ts) applies to the sort column. Pagination is only used when the client asks for it
+    with page_size or cursor, otherwise all the rows are returned.
+
+    Returns the rows and response headers: X-Next-Cursor when there are more rows and X-Total-Count
+    when args has count set. Total count covers the whole filtered result, not the page.
+    """
+    if args.get('from_ts') is not None:
+        s = s.where(sort_column >= datetime.fromtimestamp(args.get('from_ts')))
+    if args.get('to_ts') is not None:
+        s = s.where(sort_column < datetime.fromtimestamp(args.get('to_ts')))
+
+    headers = dict()
+    if args.get('count'):
+        headers['X-Total-Count'] = str(db.session.scalar(select(func.count()).select_from(s.order_by(None).subquery())))
+
+    s = s.order_by(None).order_by(sort_column, id_column)
+    page_size = args.get('page_size')
+    cursor = args.get('cursor')
+    if not page_size and not cursor:
+        return db.session.scalars(s).all(), headers
+
+    page_size = min(max(page_size or MAX_PAGE_SIZE, 1), MAX_PAGE_SIZE)
+    if cursor:
+        sort_value, id_value = decode_cursor(cursor, (sort_column, id_column))
+        s = s.where(or_(sort_column > sort_value, and_(sort_column == sort_value, id_column > id_value)))
+
+    # fetch one extra row to find out if there is a next page
+    rows = db.session.scalars(s.limit(page_size + 1)).all()
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        headers['X-Next-Cursor'] = encode_cursor([getattr(rows[-1], c.key) for c in (sort_column, id_column)])
+
+    return rows, headers
@@ -12,7 +12,8 @@ from pebbles import rules
 from pebbles.forms import CustomImageForm
 from pebbles.models import db, CustomImage, Workspace
 from pebbles.utils import requires_admin
-from pebbles.views.commons import auth, is_workspace_manager, requires_workspace_manager_or_admin
+from pebbles.views.commons import auth, is_workspace_manager, requires_workspace_manager_or_admin, \
+    add_pagination_arguments, paginate
 
 
 custom_image_fields = {
@@ -106,10 +107,11 @@ class CustomImageView(restful.Resource):
 
 
 class CustomImageList(restful.Resource):
-    list_parser = reqparse.RequestParser()
+    list_parser = add_pagination_arguments(reqparse.RequestParser())
     list_parser.add_argument('limit', type=int, location='args')
     list_parser.add_argument('workspace_id', type=str, location='args')
     list_parser.add_argument('unfinished', type=str, location='args')
+    list_parser.add_argument('state', type=str, location='args')
 
     @auth.login_required
     @requires_workspace_manager_or_admin
@@ -118,8 +120,14 @@ class CustomImageList(restful.Resource):
         user = g.user
         args = self.list_parser.parse_args()
         s = rules.generate_custom_image_query(user, args)
-        images = db.session.execute(s).scalars().all()
-        return images
+        if args.get('state'):
+            s = s.where(CustomImage.state == args.get('state'))
+        # the worker polls with a limit in priority order, other clients can page through the images
+        if args.get('limit'):
+            return db.session.execute(s).scalars().all()
+
+        images, headers = paginate(s, CustomImage.created_at, CustomImage.id, args)
+        return images, 200, headers
 
     @auth.login_required
     @requires_workspace_manager_or_admin
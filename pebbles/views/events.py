@@ -0,0 +1,77 @@
+import json
+import time
+
+import flask_restful as restful
+from flask import g, current_app, Response
+from sqlalchemy import select
+
+from pebbles.models import db, WorkspaceMembership
+from pebbles.notifications import get_notification_bus
+from pebbles.views.commons import auth
+
+# clients reconnect after this many milliseconds when the stream ends
+EVENT_STREAM_RETRY_MS = 5000
+
+
+def format_event(event_type, data):
+    return 'event: %s\ndata: %s\n\n' % (event_type, json.dumps(data))
+
+
+class ApplicationSessionEventStream(restful.Resource):
+    """
+    Server-sent events stream of state changes and new log lines for the application sessions the user can see:
+    their own sessions, sessions in workspaces they manage and, for admins, all sessions.
+
+    The stream ends after EVENT_STREAM_MAX_DURATION seconds and the client is expected to reconnect. A 'resync'
+    event tells the client that events were lost and it should reload the sessions.
+    """
+
+    @auth.login_required
+    def get(self):
+        config = current_app.config
+        bus = get_notification_bus()
+        if not bus or not config['EVENT_STREAM_ENABLED']:
+            return 'Event stream is not enabled', 503
+
+        user = g.user
+        is_admin = user.is_admin
+        user_id = user.id
+        managed_workspace_ids = set(db.session.scalars(
+            select(WorkspaceMembership.workspace_id)
+            .where(WorkspaceMembership.user_id == user_id)
+            .where(WorkspaceMembership.is_manager)
+            .where(WorkspaceMembership.is_banned.is_not(True))
+        ).all())
+        # do not keep a database connection for the lifetime of the stream
+        db.session.close()
+
+        subscription = bus.subscribe()
+        if not subscription:
+            return 'Too many event stream clients, poll instead', 503
+
+        def is_visible(event):
+            return is_admin or event.get('user_id') == user_id or event.get('workspace_id') in managed_workspace_ids
+
+        def stream():
+            try:
+                yield 'retry: %d\n\n' % EVENT_STREAM_RETRY_MS
+                deadline = time.time() + config['EVENT_STREAM_MAX_DURATION']
+                while time.time() < deadline:
+                    timeout = min(config['EVENT_STREAM_KEEPALIVE_INTERVAL'], deadline - time.time())
+                    event = subscription.get(timeout=max(timeout, 0))
+                    if subscription.overflowed:
+                        subscription.overflowed = False
+                        yield format_event('resync', {})
+                    if event is None:
+                        # comment line keeps proxies from closing an idle connection
+                        yield ': keepalive\n\n'
+                    elif is_visible(event):
+                        yield format_event(event['type'], event)
+            finally:
+                bus.unsubscribe(subscription)
+
+        return Response(
+            stream(),
+            mimetype='text/event-stream',
+            headers={'X-Accel-Buffering': 'no'},
+        )
@@ -1,11 +1,12 @@
 from flask import abort
 from flask_restful import marshal_with, fields, reqparse
+from sqlalchemy import select, update
 
 from pebbles.forms import LockForm
-from pebbles.models import db, Lock
+from pebbles.models import db, Lock, ApplicationSession, get_utc_now
 import flask_restful as restful
 from pebbles.utils import requires_admin
-from pebbles.views.commons import auth
+from pebbles.views.commons import auth, add_pagination_arguments, paginate
 
 
 lock_fields = {
@@ -16,12 +17,23 @@ lock_fields = {
 
 
 class LockList(restful.Resource):
+    list_parser = add_pagination_arguments(reqparse.RequestParser())
+    list_parser.add_argument('id_prefix', type=str, location='args')
+    list_parser.add_argument('owner', type=str, location='args')
 
     @auth.login_required
     @requires_admin
     @marshal_with(lock_fields)
     def get(self):
-        return Lock.query.all()
+        args = self.list_parser.parse_args()
+        s = select(Lock)
+        if args.get('id_prefix'):
+            s = s.where(Lock.id.startswith(args.get('id_prefix'), autoescape=True))
+        if args.get('owner'):
+            s = s.where(Lock.owner == args.get('owner'))
+
+        locks, headers = paginate(s, Lock.acquired_at, Lock.id, args)
+        return locks, 200, headers
 
 
 class LockView(restful.Resource):
@@ -50,6 +62,13 @@ class LockView(restful.Resource):
 
         db.session.add(lock)
         try:
+            # the worker locks the sessions it processes, record the attempt for rotating the work queue. The change
+            # marker for session listings is left as it is.
+            db.session.execute(
+                update(ApplicationSession)
+                .where(ApplicationSession.id == lock_id)
+                .values(worker_attempted_at=get_utc_now(), updated_at=ApplicationSession.updated_at)
+            )
             db.session.commit()
         except Exception:
             db.session.rollback()
@@ -0,0 +1,59 @@
+from flask import abort, Response
+from flask_restful import marshal_with, fields, reqparse
+import flask_restful as restful
+
+from pebbles.profiling import get_profile_buffer
+from pebbles.utils import requires_admin
+from pebbles.views.commons import auth
+
+profile_fields = {
+    'id': fields.String,
+    'created_at': fields.Float,
+    'method': fields.String,
+    'path': fields.String,
+    'endpoint': fields.String,
+    'status_code': fields.Integer,
+    'duration_ms': fields.Float,
+    'sql_count': fields.Integer,
+    'sql_time_ms': fields.Float,
+}
+
+profile_report_fields = dict(profile_fields, report=fields.String)
+
+
+def get_profiles():
+    buffer = get_profile_buffer()
+    if not buffer:
+        abort(404)
+    return buffer
+
+
+class RequestProfileList(restful.Resource):
+    @auth.login_required
+    @requires_admin
+    @marshal_with(profile_fields)
+    def get(self):
+        return get_profiles().list()
+
+
+class RequestProfileView(restful.Resource):
+    get_parser = reqparse.RequestParser()
+    get_parser.add_argument('format', type=str, choices=('json', 'pstats'), default='json', location='args')
+
+    @auth.login_required
+    @requires_admin
+    def get(self, profile_id):
+        args = self.get_parser.parse_args()
+        profile = get_profiles().get(profile_id)
+        if not profile:
+            abort(404)
+
+        # raw statistics that can be loaded with pstats or visualisation tools like snakeviz
+        if args.get('format') == 'pstats':
+            return Response(
+                profile['stats'],
+                mimetype='application/octet-stream',
+                headers={'Content-Disposition': 'attachment; filename=%s.pstats' % profile_id},
+            )
+
+        return restful.marshal(profile, profile_report_fields)
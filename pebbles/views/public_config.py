@@ -5,6 +5,8 @@ import yaml
 from flask import current_app
 from flask_restful import fields, marshal_with
 
+from pebbles.views.commons import cache_policy, CACHE_POLICY_PUBLIC
+
 variable_fields = {
     'key': fields.String,
     'value': fields.Raw,
@@ -34,6 +36,7 @@ class PublicConfigList(restful.Resource):
     Installation name, logo url etc.
     """
 
+    @cache_policy(CACHE_POLICY_PUBLIC)
     @marshal_with(variable_fields)
     def get(self):
         try:
@@ -54,6 +57,7 @@ class PublicStructuredConfigList(restful.Resource):
     # cache for structured config to avoid yaml file load calls through public api
     _structured_config = None
 
+    @cache_policy(CACHE_POLICY_PUBLIC)
     def get(self):
         # load config only once
         if PublicStructuredConfigList._structured_config is None:
@@ -0,0 +1,29 @@
+from flask_restful import marshal_with, fields
+import flask_restful as restful
+
+from pebbles.query_stats import get_query_stats
+from pebbles.utils import requires_admin
+from pebbles.views.commons import auth
+
+query_stats_fields = {
+    'endpoint': fields.String,
+    'requests': fields.Integer,
+    'statements': fields.Integer,
+    'max_statements': fields.Integer,
+    'db_time': fields.Float,
+    'over_budget': fields.Integer,
+}
+
+
+class QueryStatsList(restful.Resource):
+    @auth.login_required
+    @requires_admin
+    @marshal_with(query_stats_fields)
+    def get(self):
+        return sorted(get_query_stats().list(), key=lambda stats: stats['statements'], reverse=True)
+
+    @auth.login_required
+    @requires_admin
+    def delete(self):
+        get_query_stats().reset()
+        return 'ok'
@@ -4,11 +4,12 @@ import time
 import flask_restful as restful
 from flask import abort, request
 from flask_restful import marshal_with, fields, reqparse
+from sqlalchemy import select
 
 from pebbles.models import Task
 from pebbles.models import db
 from pebbles.utils import requires_admin
-from pebbles.views.commons import auth
+from pebbles.views.commons import auth, add_pagination_arguments, paginate
 
 
 task_fields = {
@@ -24,7 +25,7 @@ task_fields = {
 
 
 class TaskList(restful.Resource):
-    get_parser = reqparse.RequestParser()
+    get_parser = add_pagination_arguments(reqparse.RequestParser())
     get_parser.add_argument('kind', type=str, location='args')
     get_parser.add_argument('state', type=str, location='args')
     get_parser.add_argument('unfinished', type=bool, location='args')
@@ -33,7 +34,7 @@ class TaskList(restful.Resource):
     @requires_admin
     @marshal_with(task_fields)
     def get(self):
-        q = Task.query
+        q = select(Task)
         args = self.get_parser.parse_args()
 
         unfinished = args.get('unfinished', False)
@@ -48,9 +49,8 @@ class TaskList(restful.Resource):
         if state:
             q = q.filter_by(state=state)
 
-        q = q.order_by(Task._create_ts)
-        results = q.all()
-        return results
+        tasks, headers = paginate(q, Task._create_ts, Task.id, args)
+        return tasks, 200, headers
 
     @auth.login_required
     @requires_admin
@@ -119,7 +119,7 @@ class TaskAddResults(restful.Resource):
 
         new_results = []
 
-        if type(task.results) is list:
+        if isinstance(task.results, list):
             new_results = task.results
 
         new_results.extend(args.results.splitlines())
@@ -6,11 +6,12 @@ from datetime import datetime, timezone
 import flask_restful as restful
 from flask import abort, g
 from flask_restful import marshal_with, reqparse, inputs, fields
+from sqlalchemy import select, false
 
 from pebbles.models import db, User
 from pebbles.rules import apply_filter_users, apply_rules_workspace_memberships
 from pebbles.utils import requires_admin, create_password
-from pebbles.views.commons import auth, create_user
+from pebbles.views.commons import auth, create_user, add_pagination_arguments, paginate
 
 
 user_fields_admin = {
@@ -56,6 +57,8 @@ workspace_membership_fields = {
 
 
 class UserList(restful.Resource):
+    list_parser = add_pagination_arguments(reqparse.RequestParser())
+    list_parser.add_argument('ext_id_prefix', type=str, location='args')
 
     @staticmethod
     def address_list(value):
@@ -65,7 +68,13 @@ class UserList(restful.Resource):
     @requires_admin
     @marshal_with(user_fields_admin)
     def get(self):
-        return apply_filter_users().order_by(User._joining_ts).all()
+        args = self.list_parser.parse_args()
+        s = select(User).where(User.is_deleted == false())
+        if args.get('ext_id_prefix'):
+            s = s.where(User._ext_id.startswith(args.get('ext_id_prefix').lower(), autoescape=True))
+
+        users, headers = paginate(s, User._joining_ts, User.id, args)
+        return users, 200, headers
 
     parser = reqparse.RequestParser()
     parser.add_argument('ext_id', type=str, required=True)
@@ -0,0 +1,154 @@
+import logging
+from datetime import datetime, timezone, timedelta
+
+import flask_restful as restful
+from flask import abort, g
+from flask_restful import fields, marshal_with
+from sqlalchemy import select, func, true, false
+
+from pebbles import utils
+from pebbles.models import db, Application, ApplicationSession, list_active_applications
+from pebbles.utils import requires_admin
+from pebbles.views.application_sessions import application_session_fields_admin, workspace_has_memory_for, \
+    assign_application_session_name
+from pebbles.views.commons import auth
+
+# upper limit for the configured pool size
+WARM_POOL_MAX_SIZE = 20
+# the pool is sized to cover the launches seen in this window
+WARM_POOL_LAUNCH_WINDOW_SECS = 600
+
+warm_pool_fields = {
+    'application_id': fields.String,
+    'workspace_id': fields.String,
+    'target_size': fields.Integer,
+    'session_ids': fields.List(fields.String),
+    'stale_session_ids': fields.List(fields.String),
+}
+
+
+def get_warm_pool_size(application):
+    """Return the configured maximum warm pool size for the application"""
+    try:
+        pool_size = int(application.config.get('warm_pool_size', 0))
+    except (TypeError, ValueError):
+        logging.warning('invalid warm_pool_size in application %s', application.id)
+        return 0
+
+    return min(max(pool_size, 0), WARM_POOL_MAX_SIZE)
+
+
+def get_warm_pool_provisioning_config(application):
+    """Return the provisioning config for warm sessions, or None if the application cannot have a warm pool"""
+    if not application.is_enabled or not get_warm_pool_size(application):
+        return None
+    try:
+        provisioning_config = utils.get_provisioning_config(application)
+    except ValueError as e:
+        logging.warning('no warm pool for application %s: %s', application.id, e)
+        return None
+    # persistent user work folder cannot be mounted before we know the user
+    if provisioning_config['custom_config'].get('enable_user_work_folder'):
+        return None
+
+    return provisioning_config
+
+
+class WarmPoolList(restful.Resource):
+    """
+    Lists the warm session pools with their target sizes. Pools for applications that are disabled or
+    no longer configured have target size zero, so that the worker drains them.
+    """
+
+    @auth.login_required
+    @requires_admin
+    @marshal_with(warm_pool_fields)
+    def get(self):
+        applications = {a.id: a for a in list_active_applications() if get_warm_pool_size(a)}
+
+        warm_sessions = db.session.scalars(
+            select(ApplicationSession)
+            .where(ApplicationSession.is_warm == true())
+            .where(ApplicationSession.state != ApplicationSession.STATE_DELETED)
+            .where(ApplicationSession.to_be_deleted == false())
+        ).all()
+        warm_sessions_by_application = dict()
+        for application_session in warm_sessions:
+            warm_sessions_by_application.setdefault(application_session.application_id, []).append(application_session)
+
+        # recent launches by users, including the hand-overs from warm pool
+        launch_window_start = (
+            datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=WARM_POOL_LAUNCH_WINDOW_SECS)
+        )
+        launch_counts = dict(db.session.execute(
+            select(ApplicationSession.application_id, func.count(ApplicationSession.id))
+            .where(ApplicationSession.is_warm == false())
+            .where(ApplicationSession.created_at >= launch_window_start)
+            .group_by(ApplicationSession.application_id)
+        ).all())
+
+        pools = []
+        for application_id in sorted(set(applications.keys()) | set(warm_sessions_by_application.keys())):
+            application = applications.get(application_id)
+            if application is None:
+                application = Application.query.filter_by(id=application_id).first()
+            provisioning_config = get_warm_pool_provisioning_config(application) if application else None
+
+            if provisioning_config:
+                # keep one instance ready at all times, more when the application is being launched actively
+                target_size = min(get_warm_pool_size(application), 1 + launch_counts.get(application_id, 0))
+            else:
+                target_size = 0
+
+            session_ids = []
+            stale_session_ids = []
+            for application_session in warm_sessions_by_application.get(application_id, []):
+                is_usable = application_session.state != ApplicationSession.STATE_FAILED and \
+                    application_session.provisioning_config == provisioning_config
+                if is_usable:
+                    session_ids.append(application_session.id)
+                else:
+                    stale_session_ids.append(application_session.id)
+
+            pools.append(dict(
+                application_id=application_id,
+                workspace_id=application.workspace_id if application else None,
+                target_size=target_size,
+                session_ids=session_ids,
+                stale_session_ids=stale_session_ids,
+            ))
+
+        return pools
+
+
+class WarmPoolView(restful.Resource):
+
+    @auth.login_required
+    @requires_admin
+    def post(self, application_id):
+        """Create a new warm session for the application"""
+        application = Application.query.filter_by(id=application_id).first()
+        if not application or application.status != Application.STATUS_ACTIVE:
+            abort(404)
+        if application.workspace.has_expired():
+            return 'Application has expired', 409
+
+        provisioning_config = get_warm_pool_provisioning_config(application)
+        if not provisioning_config:
+            return 'Application does not have a warm pool', 409
+
+        if not workspace_has_memory_for(application, include_warm_sessions=True):
+            logging.info('workspace %s is over memory limit, not adding warm sessions', application.workspace_id)
+            return 'Concurrent session memory limit for workspace exceeded', 409
+
+        # warm sessions are owned by the caller (the worker) until they are handed over
+        application_session = ApplicationSession(application, g.user)
+        application_session.is_warm = True
+        db.session.add(application_session)
+        application_session.provisioning_config = provisioning_config
+        assign_application_session_name(application_session)
+        db.session.commit()
+
+        application_session.container_image = provisioning_config.get('image')
+
+        return restful.marshal(application_session, application_session_fields_admin), 200
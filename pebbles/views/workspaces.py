@@ -12,8 +12,11 @@ from flask import current_app
 from flask import abort, g, request
 from flask_restful import marshal, reqparse, fields, inputs
 
+from pebbles.db_replica import replica_read
+from pebbles.db_types import json_field
 from pebbles.forms import WorkspaceForm, WS_TYPE_LONG_RUNNING
-from pebbles.models import db, Workspace, User, WorkspaceMembership, Application, ApplicationSession, Task
+from pebbles.models import db, Workspace, User, WorkspaceMembership, Application, ApplicationSession, \
+    ApplicationSessionArchive, Task
 from pebbles.utils import requires_admin, requires_workspace_owner_or_admin, load_cluster_config
 from pebbles.views import commons
 from pebbles.views.commons import auth, can_user_join_workspace
@@ -112,17 +115,43 @@ class WorkspaceList(restful.Resource):
     get_parser.add_argument('membership_expiry_policy_kind', type=str, location='args', required=False)
 
     @auth.login_required
+    @replica_read
     def get(self):
         user = g.user
         args = self.get_parser.parse_args()
 
+        # workspaces and memberships in the scope of the user, owner memberships for admins
+        workspace_scope = select(Workspace)
+        membership_scope = select(WorkspaceMembership)
+        if not user.is_admin:
+            workspace_scope = workspace_scope.join(WorkspaceMembership).where(WorkspaceMembership.user_id == user.id)
+            membership_scope = membership_scope.where(WorkspaceMembership.user_id == user.id)
+        else:
+            membership_scope = membership_scope.where(WorkspaceMembership.is_owner)
+        not_modified = commons.check_not_modified(
+            'workspaces', user.id, args,
+            commons.get_change_marker(workspace_scope, Workspace.updated_at),
+            commons.get_change_marker(membership_scope, WorkspaceMembership.updated_at),
+        )
+        if not_modified:
+            return not_modified
+
+        # filter based on membership expiry policy
+        mep_kind = args.get('membership_expiry_policy_kind', None)
+        mep_kind_filter = json_field(Workspace._membership_expiry_policy, 'kind') == mep_kind
+
         workspace_user_query = WorkspaceMembership.query
         results = []
         if not user.is_admin:
-            workspace_mappings = workspace_user_query.filter_by(user_id=user.id, is_banned=False).all()
+            workspace_user_query = workspace_user_query.filter_by(user_id=user.id, is_banned=False)
+            if mep_kind:
+                workspace_user_query = workspace_user_query.join(WorkspaceMembership.workspace).filter(mep_kind_filter)
+            workspace_mappings = workspace_user_query.all()
             workspaces = [workspace_obj.workspace for workspace_obj in workspace_mappings]
         else:
             query = Workspace.query
+            if mep_kind:
+                query = query.filter(mep_kind_filter)
             workspaces = query.all()
 
         workspaces = sorted(workspaces, key=lambda ws: ws.name)
@@ -133,11 +162,6 @@ class WorkspaceList(restful.Resource):
             if not workspace.status == Workspace.STATUS_ACTIVE:
                 continue
 
-            # filter based on membership expiry policy
-            mep_kind = args.get('membership_expiry_policy_kind', None)
-            if mep_kind and workspace.membership_expiry_policy.get('kind') != mep_kind:
-                continue
-
             owner = next((wm.user for wm in workspace.memberships if wm.is_owner), None)
             workspace.owner_ext_id = owner.ext_id if owner else None
 
@@ -457,8 +481,12 @@ class WorkspaceExit(restful.Resource):
 
 
 class WorkspaceMemberList(restful.Resource):
-    get_parser = reqparse.RequestParser()
+    get_parser = commons.add_pagination_arguments(reqparse.RequestParser())
     get_parser.add_argument('member_count', type=inputs.boolean, default=False, location='args')
+    get_parser.add_argument('search', type=str, location='args')
+    get_parser.add_argument('is_owner', type=inputs.boolean, location='args')
+    get_parser.add_argument('is_manager', type=inputs.boolean, location='args')
+    get_parser.add_argument('is_banned', type=inputs.boolean, location='args')
 
     @auth.login_required
     def get(self, workspace_id):
@@ -473,15 +501,30 @@ class WorkspaceMemberList(restful.Resource):
             logging.warning('workspace %s not managed by %s, cannot see users', workspace_id, user.ext_id)
             abort(403)
 
-        memberships = WorkspaceMembership.query \
-            .filter_by(workspace_id=workspace_id) \
-            .options(sa.orm.subqueryload(WorkspaceMembership.user)) \
-            .all()
+        s = select(WorkspaceMembership) \
+            .join(WorkspaceMembership.user) \
+            .where(WorkspaceMembership.workspace_id == workspace_id) \
+            .where(User.is_deleted == sa.false()) \
+            .options(sa.orm.contains_eager(WorkspaceMembership.user))
+
+        # ext_id and email_id are stored in lower case
+        if args.get('search'):
+            search = args.get('search').lower()
+            s = s.where(sa.or_(
+                User._ext_id.contains(search, autoescape=True),
+                User._email_id.contains(search, autoescape=True),
+            ))
+        for role in ('is_owner', 'is_manager', 'is_banned'):
+            if args.get(role) is not None:
+                s = s.where(getattr(WorkspaceMembership, role) == args.get(role))
+
+        if args.get('member_count'):
+            return db.session.scalar(select(sa.func.count()).select_from(s.subquery()))
+
+        memberships, headers = commons.paginate(s, WorkspaceMembership.created_at, WorkspaceMembership.user_id, args)
 
         members = []
         for wm in memberships:
-            if wm.user.is_deleted:
-                continue
             members.append(dict(
                 user_id=wm.user_id,
                 ext_id=wm.user.ext_id,
@@ -490,16 +533,24 @@ class WorkspaceMemberList(restful.Resource):
                 is_manager=wm.is_manager,
                 is_banned=wm.is_banned
             ))
-        if args is not None and 'member_count' in args and args.get('member_count'):
-            return len(members)
-        return marshal(members, member_fields)
+        return marshal(members, member_fields), 200, headers
 
     patch_parser = reqparse.RequestParser()
-    patch_parser.add_argument('user_id', type=str, required=True, location='json')
+    patch_parser.add_argument('user_id', type=str, location='json')
+    patch_parser.add_argument('user_ids', type=str, action='append', location='json')
     patch_parser.add_argument('operation', type=str, required=True, location='json')
 
+    # membership changes for the operations
+    member_operations = dict(
+        promote=dict(is_manager=True),
+        demote=dict(is_manager=False),
+        ban=dict(is_banned=True),
+        unban=dict(is_banned=False),
+    )
+
     @auth.login_required
     def patch(self, workspace_id):
+        """Change the role of a single member (user_id) or of many members at once (user_ids)"""
         user = g.user
         args = self.patch_parser.parse_args()
         workspace = Workspace.query.filter_by(id=workspace_id).first()
@@ -511,33 +562,39 @@ class WorkspaceMemberList(restful.Resource):
             logging.warning('workspace %s not managed by %s, cannot see users', workspace_id, user.ext_id)
             abort(403)
 
-        wm = WorkspaceMembership.query \
-            .filter_by(workspace_id=workspace_id) \
-            .filter_by(user_id=args.user_id) \
-            .options(sa.orm.subqueryload(WorkspaceMembership.user)) \
-            .first()
-        if not wm:
-            logging.warning('member %s not found', args.user_id)
+        user_ids = set(args.user_ids or [])
+        if args.user_id:
+            user_ids.add(args.user_id)
+        if not user_ids:
+            logging.info('no members given for operation %s', args.operation)
+            abort(422)
+
+        if args.operation not in self.member_operations:
+            logging.info('unknown operation %s', args.operation)
+            abort(422)
+
+        members = db.session.execute(
+            select(WorkspaceMembership.user_id, WorkspaceMembership.is_owner)
+            .where(WorkspaceMembership.workspace_id == workspace_id)
+            .where(WorkspaceMembership.user_id.in_(user_ids))
+        ).all()
+        if len(members) < len(user_ids):
+            logging.warning('members %s not found', user_ids - set(m.user_id for m in members))
             abort(404)
 
         # block operations on owners
-        if wm.is_owner:
+        if any(m.is_owner for m in members):
             logging.warning('cannot operate on owners, workspace %s', workspace_id)
             abort(403)
 
-        if args.operation == 'promote':
-            wm.is_manager = True
-        elif args.operation == 'demote':
-            wm.is_manager = False
-        elif args.operation == 'ban':
-            wm.is_banned = True
-        elif args.operation == 'unban':
-            wm.is_banned = False
-        else:
-            logging.info('unknown operation %s', args.operation)
-            abort(422)
-
-        logging.info('%s member %s in workspace %s', args.operation, wm.user_id, wm.workspace_id)
+        db.session.execute(
+            sa.update(WorkspaceMembership)
+            .where(WorkspaceMembership.workspace_id == workspace_id)
+            .where(WorkspaceMembership.user_id.in_(user_ids))
+            .values(**self.member_operations[args.operation])
+            .execution_options(synchronize_session=False)
+        )
+        logging.info('%s members %s in workspace %s', args.operation, ', '.join(sorted(user_ids)), workspace_id)
         db.session.commit()
 
 
@@ -682,23 +739,36 @@ class WorkspaceAccounting(restful.Resource):
     @auth.login_required
     @requires_admin
     def get(self, workspace_id):
-        applications = Application.query.filter_by(workspace_id=workspace_id).all()
+        # sessions that are still in the live table and the ones that have been moved to the archive
+        sessions = db.session.scalars(
+            select(ApplicationSession)
+            .join(Application)
+            .where(Application.workspace_id == workspace_id)
+            .where(ApplicationSession.deprovisioned_at.is_not(None))
+        ).all()
+        sessions += db.session.scalars(
+            select(ApplicationSessionArchive)
+            .where(ApplicationSessionArchive.workspace_id == workspace_id)
+            .where(ApplicationSessionArchive.deprovisioned_at.is_not(None))
+        ).all()
 
         session_accounting = {}
         total_gib_hours = 0
-        for application in applications:
-            for session in application.application_sessions:
-                if not (session.deprovisioned_at and session.provisioned_at):
-                    continue
+        for session in sessions:
+            if not (session.deprovisioned_at and session.provisioned_at):
+                continue
+            # warm sessions that were never handed over to a user are not accounted to the workspace
+            if session.is_warm:
+                continue
 
-                duration = session.deprovisioned_at - session.provisioned_at
+            duration = session.deprovisioned_at - session.provisioned_at
 
-                if not session.provisioning_config.get('memory_gib'):
-                    continue
+            if not session.provisioning_config.get('memory_gib'):
+                continue
 
-                gib_hours = session.provisioning_config['memory_gib'] * duration.total_seconds() / 3600
+            gib_hours = session.provisioning_config['memory_gib'] * duration.total_seconds() / 3600
 
-                total_gib_hours = total_gib_hours + gib_hours
+            total_gib_hours = total_gib_hours + gib_hours
 
         session_accounting['workspace_id'] = workspace_id
         session_accounting['gib_hours'] = total_gib_hours
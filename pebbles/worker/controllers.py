@@ -1,3 +1,4 @@
+import json
 import logging
 import os
 import time
@@ -16,11 +17,22 @@ WS_CONTROLLER_TASK_LOCK_NAME = 'workspace-controller-tasks'
 
 SESSION_CONTROLLER_LIMIT_SIZE = 50
 
+WARM_POOL_CONTROLLER_LOCK_NAME = 'warm-pool-controller'
+# limit the number of warm sessions created per pool per round to spread the load
+WARM_POOL_MAX_CREATE_PER_ROUND = 5
+
+IMAGE_PREPULL_CONTROLLER_LOCK_NAME = 'image-prepull-controller'
+IMAGE_PREPULL_DEFAULT_MAX_IMAGES = 10
+
 CUSTOM_IMAGE_CONTROLLER_TASK_LOCK_NAME = 'custom-image-controller-tasks'
 CUSTOM_IMAGE_CONTROLLER_LIMIT_SIZE = 1
 
 DRIVER_CACHE_LIFETIME = 900
 
+# unchanged cluster alerts are sent again after this many seconds, so that the API does not consider the data
+# expired (see EXPIRY_AGE_LIMIT in pebbles.views.alerts)
+CLUSTER_ALERT_REFRESH_INTERVAL = 60
+
 
 class ControllerBase:
     def __init__(self, worker_id: str, config: BaseConfig, cluster_config: dict, client: PBClient,
@@ -49,6 +61,7 @@ class ControllerBase:
             driver_instance = cluster.get('driver_instance')
             if driver_instance.create_ts + DRIVER_CACHE_LIFETIME > time.time() and not driver_instance.is_expired():
                 return driver_instance
+            driver_instance.disconnect()
 
         # create the driver by finding out the class and creating an instance
         driver_class = find_driver_class(cluster.get('driver'))
@@ -124,9 +137,9 @@ class ApplicationSessionController(ControllerBase):
             return
         self.update_next_check_ts(self.polling_interval_min, self.polling_interval_max)
 
-        # Query all non-deleted application sessions. This will be a list of candidates, because other
-        # workers could fetch the overlapping sessions as well.
-        sessions = self.client.get_application_sessions(limit=SESSION_CONTROLLER_LIMIT_SIZE)
+        # Query the sessions that need action, least recently attempted first. This will be a list of candidates,
+        # because other workers could fetch the overlapping sessions as well.
+        sessions = self.client.get_application_sessions(limit=SESSION_CONTROLLER_LIMIT_SIZE, work_queue=True)
         logging.debug('got %d sessions', len(sessions))
 
         # extract sessions that need to be processed
@@ -191,12 +204,19 @@ class ApplicationSessionController(ControllerBase):
 class ClusterController(ControllerBase):
     """
     Controller that takes care of cluster resources
-    The only task at the moment is to fetch and publish alerts.
+    The only task at the moment is to fetch and publish alerts. Alerts are only sent to the API when the set of
+    firing alerts of a cluster changes, or when the last update is about to expire.
     """
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.polling_interval_min, self.polling_interval_max = self.get_polling_interval(30, 90)
+        # cluster name -> (alert set key, timestamp) of the last successful update
+        self.sent_alerts = dict()
+
+    def is_alert_update_needed(self, cluster_name, alert_set_key):
+        sent_key, sent_ts = self.sent_alerts.get(cluster_name, (None, 0))
+        return sent_key != alert_set_key or sent_ts + CLUSTER_ALERT_REFRESH_INTERVAL < time.time()
 
     def process(self):
         # process clusters in increased intervals
@@ -253,6 +273,11 @@ class ClusterController(ControllerBase):
                     real_alerts
                 ))
 
+            alert_set_key = sorted(json.dumps(alert, sort_keys=True) for alert in real_alerts)
+            if not self.is_alert_update_needed(cluster_name, alert_set_key):
+                logging.debug('alerts unchanged for cluster %s', cluster_name)
+                continue
+
             if len(real_alerts) > 0:
                 json_data = []
                 logging.info('found %d alerts for cluster %s', len(real_alerts), cluster_name)
@@ -287,10 +312,144 @@ class ClusterController(ControllerBase):
                     object_url='alert_reset/%s/%s' % (cluster_name, 'prometheus'),
                     json_data=None)
 
-            if not res.ok:
+            if res.ok:
+                self.sent_alerts[cluster_name] = (alert_set_key, time.time())
+            else:
                 logging.warning('unable to update alerts in api, code/reason: %s/%s', res.status_code, res.reason)
 
 
+class WarmPoolController(ControllerBase):
+    """
+    Controller that maintains pools of warm sessions. Warm sessions are provisioned like any other session
+    and handed over by the API to the users launching the application. Pools are configured per application
+    with 'warm_pool_size' in application config, the API calculates the target sizes.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.polling_interval_min, self.polling_interval_max = self.get_polling_interval(15, 30)
+
+    def process(self):
+        # process pools in increased intervals
+        if time.time() < self.next_check_ts:
+            return
+        self.update_next_check_ts(self.polling_interval_min, self.polling_interval_max)
+
+        # Try to obtain a global lock, sizing the pools from multiple workers would overshoot
+        lock = self.client.obtain_lock(WARM_POOL_CONTROLLER_LOCK_NAME, self.worker_id)
+        if lock is None:
+            logging.debug('WarmPoolController did not acquire lock, skipping')
+            return
+
+        try:
+            for pool in self.client.get_warm_pools():
+                try:
+                    self.process_pool(pool)
+                except Exception as e:
+                    logging.warning('WarmPoolController failed for application %s: %s', pool['application_id'], e)
+        finally:
+            self.client.release_lock(WARM_POOL_CONTROLLER_LOCK_NAME, self.worker_id)
+
+    def process_pool(self, pool):
+        application_id = pool['application_id']
+
+        # remove sessions that have failed or have been provisioned with outdated config
+        for session_id in pool['stale_session_ids']:
+            logging.info('WarmPoolController deleting stale warm session %s', session_id)
+            self.client.delete_application_session(session_id)
+
+        # drain the surplus, the pool shrinks when launch rate goes down or the application is disabled
+        surplus = len(pool['session_ids']) - pool['target_size']
+        if surplus > 0:
+            for session_id in pool['session_ids'][-surplus:]:
+                logging.info('WarmPoolController deleting surplus warm session %s', session_id)
+                self.client.delete_application_session(session_id)
+            return
+
+        # fill the pool
+        for _ in range(min(-surplus, WARM_POOL_MAX_CREATE_PER_ROUND)):
+            application_session = self.client.create_warm_application_session(application_id)
+            if not application_session:
+                logging.info('WarmPoolController cannot add warm sessions for application %s', application_id)
+                break
+            logging.info(
+                'WarmPoolController created warm session %s for application %s',
+                application_session['name'], application_id
+            )
+
+
+class ImagePrePullController(ControllerBase):
+    """
+    Controller that keeps the most popular application images cached on cluster nodes.
+    Enabled per cluster by setting 'imagePrePullNamespace' in cluster config. The number of images
+    can be limited with 'imagePrePullMaxImages'.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.polling_interval_min, self.polling_interval_max = self.get_polling_interval(600, 1200)
+
+    def process(self):
+        # process image pre-pulling in increased intervals
+        if time.time() < self.next_check_ts:
+            return
+        self.update_next_check_ts(self.polling_interval_min, self.polling_interval_max)
+
+        clusters = [c for c in self.cluster_config['clusters'] if c.get('imagePrePullNamespace')]
+        if not clusters:
+            return
+
+        # Try to obtain a global lock, one worker is enough for maintaining the daemonsets
+        lock = self.client.obtain_lock(IMAGE_PREPULL_CONTROLLER_LOCK_NAME, self.worker_id)
+        if lock is None:
+            logging.debug('ImagePrePullController did not acquire lock, skipping')
+            return
+
+        try:
+            # images come sorted by weight, the most popular first
+            application_images = self.client.get_application_images()
+            for cluster in clusters:
+                try:
+                    self.process_cluster(cluster, application_images)
+                except Exception as e:
+                    logging.warning('ImagePrePullController failed for cluster %s: %s', cluster['name'], e)
+        finally:
+            self.client.release_lock(IMAGE_PREPULL_CONTROLLER_LOCK_NAME, self.worker_id)
+
+    def process_cluster(self, cluster, application_images):
+        cluster_name = cluster['name']
+        namespace = cluster['imagePrePullNamespace']
+        max_images = int(cluster.get('imagePrePullMaxImages', IMAGE_PREPULL_DEFAULT_MAX_IMAGES))
+
+        # skip images that need custom pull credentials, the daemonset does not have access to those
+        pull_cred_prefixes = [
+            c.get('prefix') for c in self.cluster_config.get('runtime_data', {}).get('pull_creds', []) if c.get('prefix')
+        ]
+        images = []
+        for entry in application_images:
+            if entry.get('cluster') != cluster_name or entry.get('weight', 0) <= 0:
+                continue
+            if any(entry['image'].startswith(prefix) for prefix in pull_cred_prefixes):
+                continue
+            images.append(entry['image'])
+        images = images[:max_images]
+
+        driver = self.get_driver(cluster_name)
+        if not images:
+            driver.delete_image_prepull_daemonset(namespace)
+            return
+
+        driver.ensure_image_prepull_daemonset(namespace, images)
+
+        # report how well the images are cached on the nodes
+        coverage, num_nodes = driver.get_image_cache_coverage(images)
+        for image in images:
+            logging.info(
+                'ImagePrePullController cluster %s image %s cached on %d/%d nodes',
+                cluster_name, image, coverage.get(image, 0), num_nodes
+            )
+
+
 class WorkspaceController(ControllerBase):
     """
     Controller that takes care of Workspace tasks
@@ -8,7 +8,7 @@ from pebbles.client import PBClient
 from pebbles.config import RuntimeConfig
 from pebbles.utils import init_logging, load_cluster_config
 from pebbles.worker.controllers import ApplicationSessionController, ClusterController, WorkspaceController, \
-    CustomImageController
+    CustomImageController, ImagePrePullController, WarmPoolController
 
 
 class Worker:
@@ -61,6 +61,24 @@ class Worker:
         )
         logging.info('WorkspaceController initialized')
 
+        self.warm_pool_controller = WarmPoolController(
+            worker_id=self.id,
+            config=self.config,
+            cluster_config=self.cluster_config,
+            client=self.client,
+            controller_name="WARM_POOL_CONTROLLER"
+        )
+        logging.info('WarmPoolController initialized')
+
+        self.image_prepull_controller = ImagePrePullController(
+            worker_id=self.id,
+            config=self.config,
+            cluster_config=self.cluster_config,
+            client=self.client,
+            controller_name="IMAGE_PREPULL_CONTROLLER"
+        )
+        logging.info('ImagePrePullController initialized')
+
         if os.environ.get('CUSTOM_IMAGE_CONTROLLER_BUILD_NAMESPACE'):
             self.custom_image_controller = CustomImageController(
                 worker_id=self.id,
@@ -111,12 +129,18 @@ class Worker:
             # process application sessions
             self.application_session_controller.process()
 
+            # keep warm session pools at their target size
+            self.warm_pool_controller.process()
+
             # process clusters
             self.cluster_controller.process()
 
             # process workspaces
             self.workspace_controller.process()
 
+            # keep popular images cached on the nodes
+            self.image_prepull_controller.process()
+
             # stop the watchdog
             signal.alarm(0)
 
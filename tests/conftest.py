@@ -4,6 +4,7 @@
 import base64
 import json
 import time
+from contextlib import contextmanager
 from datetime import datetime, timezone
 
 import pytest
@@ -15,6 +16,7 @@ from pebbles.models import (
     User, Workspace, WorkspaceMembership, ApplicationTemplate, Application,
     Message, ServiceAnnouncement, ApplicationSession, ApplicationSessionLog, PEBBLES_TAINT_KEY, CustomImage)
 from pebbles.models import db
+from pebbles.query_stats import QueryCounter
 
 ADMIN_TOKEN = None
 USER_TOKEN = None
@@ -441,6 +443,23 @@ def rmaker(client, pri_data):
     return RequestMaker(client, pri_data)
 
 
+@pytest.fixture
+def assert_max_queries():
+    """
+    Returns a context manager that fails the test if the block executes more SQL statements than given.
+    Use it to pin the number of queries a view makes, so that N+1 query regressions are caught in tests.
+    """
+
+    @contextmanager
+    def _assert_max_queries(max_count):
+        with QueryCounter() as counter:
+            yield counter
+        assert counter.count <= max_count, '%d SQL statements executed, expected at most %d:\n%s' % (
+            counter.count, max_count, '\n'.join(counter.statements))
+
+    return _assert_max_queries
+
+
 class RequestMaker():
     def __init__(self, client, pri_data: PrimaryData):
         self.client = client
@@ -10,3 +10,88 @@ def test_headers(app: Flask, rmaker: RequestMaker, pri_data: PrimaryData):
     required_headers = ('Cache-Control', 'Expires', 'Strict-Transport-Security', 'Content-Security-Policy')
     for h in required_headers:
         assert h in response.headers.keys()
+
+    # public configuration can be cached, other responses are not stored by default
+    assert response.headers['Cache-Control'].startswith('public')
+    response = rmaker.make_authenticated_user_request(path='/api/v1/users/%s' % pri_data.known_user_id)
+    for h in required_headers:
+        assert h in response.headers.keys()
+    assert 'no-store' in response.headers['Cache-Control']
+
+
+def test_replica_routing(app: Flask, rmaker: RequestMaker, pri_data: PrimaryData):
+    """Test that read-only GETs are served from replica, unless the client has just written or replica lags"""
+    from sqlalchemy import create_engine
+    from pebbles.db_replica import ReplicaRouter
+    from pebbles.models import db
+
+    # make sure we have a token before enabling replica
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/workspaces')
+    assert response.status_code == 200
+    num_workspaces = len(response.json)
+    assert num_workspaces > 0
+
+    # use an empty database as the replica, so that we can tell where the data came from
+    replica_engine = create_engine('sqlite://')
+    db.metadata.create_all(replica_engine)
+    router = ReplicaRouter(replica_engine, max_lag_secs=5, lag_check_interval=0, read_your_writes_secs=10)
+    app.extensions['pebbles_replica'] = router
+
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/workspaces')
+    assert response.status_code == 200
+    assert response.json == []
+
+    # endpoints that are not marked read-only use primary
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/users')
+    assert len(response.json) > 0
+
+    # a write pins the client to primary
+    response = rmaker.make_authenticated_admin_request(
+        method='PUT',
+        path='/api/v1/workspaces/%s/memory_limit_gib' % pri_data.known_workspace_id,
+        data='{"new_limit": 20}'
+    )
+    assert response.status_code == 200
+    assert response.headers.get('Set-Cookie', '').startswith('pb_read_primary_until=')
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/workspaces')
+    assert len(response.json) == num_workspaces
+
+    # replica lag over the limit falls back to primary
+    rmaker.client.delete_cookie('pb_read_primary_until')
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/workspaces')
+    assert response.json == []
+    router.measure_lag = lambda: 60.0
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/workspaces')
+    assert len(response.json) == num_workspaces
+
+    del app.extensions['pebbles_replica']
+
+
+def test_response_compression(app: Flask, rmaker: RequestMaker, pri_data: PrimaryData):
+    import gzip
+    import json
+
+    app.config['API_COMPRESSION_MIN_SIZE'] = 100
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/users', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers.get('Content-Encoding') == 'gzip'
+    assert 'Accept-Encoding' in response.headers.get('Vary')
+    users = json.loads(gzip.decompress(response.data))
+    assert len(users) > 1
+
+    # ETags become weak when the response is compressed, and still match
+    response = rmaker.make_authenticated_admin_request(
+        path='/api/v1/workspaces', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers.get('Content-Encoding') == 'gzip'
+    assert response.headers.get('ETag').startswith('W/')
+    response = rmaker.make_authenticated_admin_request(
+        path='/api/v1/workspaces', headers={'Accept-Encoding': 'gzip', 'If-None-Match': response.headers.get('ETag')})
+    assert response.status_code == 304
+
+    # small responses and clients that do not accept compression get plain responses
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/users')
+    assert 'Content-Encoding' not in response.headers
+    assert len(response.json) == len(users)
+    app.config['API_COMPRESSION_MIN_SIZE'] = 100000
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/users', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
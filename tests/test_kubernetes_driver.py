@@ -1,6 +1,9 @@
 import pytest
+import yaml
 
-from pebbles.drivers.provisioning.kubernetes_driver import calculate_cpu_request_limit_millicore
+from pebbles.drivers.provisioning.kubernetes_driver import calculate_cpu_request_limit_millicore, parse_template, \
+    get_session_label_selector, SESSION_LABEL, read_stream_tail, is_image_cached
+from pebbles.drivers.provisioning.kubernetes_informer import VOLUME_LABEL_SELECTOR
 
 DEFAULT_COEFF = 0.165  # roughly 14 / 85
 MIN_REQUEST = 100  # floor at 0.1 cores => 100m
@@ -92,3 +95,63 @@ def test_cpu_limit_with_invalid_memory_defaults_to_floor_8():
     for bad in ('', 'NaN', 'banana', object()):
         req, lim = calculate_cpu_request_limit_millicore({'memory_gib': bad}, {})
         assert lim == 8000
+
+
+@pytest.mark.parametrize(
+    'template_name',
+    ['deployment.yaml.j2', 'configmap.yaml.j2', 'service.yaml.j2', 'ingress.yaml.j2', 'route.yaml.j2',
+     'custom_image_pull_secret.yaml.j2']
+)
+def test_session_templates_have_session_label(template_name):
+    # deprovisioning relies on the session label being present in all session resources
+    res = yaml.safe_load(parse_template(template_name, dict(name='pb-session-1', namespace='ns', host='localhost')))
+    assert res['metadata']['labels'][SESSION_LABEL] == 'pb-session-1'
+    assert get_session_label_selector(dict(name='pb-session-1')) == '%s=pb-session-1' % SESSION_LABEL
+
+
+def test_volume_template_matches_informer_selector():
+    # the volume informer only caches the volumes with the label
+    res = yaml.safe_load(parse_template('pvc.yaml.j2', dict(name='pvc-1', access_mode='ReadWriteOnce',
+                                                            volume_size='1Gi')))
+    key, value = VOLUME_LABEL_SELECTOR.split('=')
+    assert res['metadata']['labels'][key] == value
+
+
+def test_read_stream_tail():
+    chunks = [b'line 1\n', b'line 2\n', b'line 3\n']
+    assert read_stream_tail(chunks, 1024) == 'line 1\nline 2\nline 3\n'
+    assert read_stream_tail(chunks, 7) == 'line 3\n'
+    assert read_stream_tail(iter(chunks), 9) == '2\nline 3\n'
+    assert read_stream_tail([], 10) == ''
+    # a multibyte character split at the cut point does not break decoding
+    assert read_stream_tail(['äö'.encode('utf-8')], 3).endswith('ö')
+
+
+@pytest.mark.parametrize(
+    'image,cached_names,expected',
+    [
+        ('registry.example.org/image:latest', ['registry.example.org/image:latest'], True),
+        ('registry.example.org/image', ['registry.example.org/image:latest'], True),
+        ('registry.example.org/image:v2', ['registry.example.org/image:latest'], False),
+        ('jupyter/minimal-notebook', ['docker.io/jupyter/minimal-notebook:latest'], True),
+        ('busybox', ['docker.io/library/busybox:latest'], True),
+        ('busybox', [], False),
+    ],
+)
+def test_is_image_cached(image, cached_names, expected):
+    assert is_image_cached(image, set(cached_names)) == expected
+
+
+def test_image_prepull_daemonset_template():
+    images = ['registry.example.org/image:latest', 'registry.example.org/other:v1']
+    ds = yaml.safe_load(parse_template(
+        'image_prepull_daemonset.yaml.j2',
+        dict(name='prepull', images=images, helper_image='registry.example.org/busybox:stable')
+    ))
+    pod_spec = ds['spec']['template']['spec']
+    assert [c['image'] for c in pod_spec['containers']] == images
+    # the idle process comes from the helper image, nothing is run from the pre-pulled images themselves
+    assert [c['image'] for c in pod_spec['initContainers']] == ['registry.example.org/busybox:stable']
+    for container in pod_spec['containers']:
+        assert container['command'][0] == '/prepull-bin/busybox'
+        assert container['volumeMounts'][0]['name'] == pod_spec['volumes'][0]['name']
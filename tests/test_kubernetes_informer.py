@@ -0,0 +1,65 @@
+from kubernetes.dynamic.resource import ResourceField
+
+from pebbles.drivers.provisioning.kubernetes_informer import ResourceInformer
+
+
+def make_object(namespace, name, labels=None, resource_version='1'):
+    return ResourceField(dict(
+        metadata=ResourceField(dict(namespace=namespace, name=name, labels=labels, resourceVersion=resource_version))
+    ))
+
+
+class FakeApi:
+    def __init__(self, items):
+        self.items = items
+
+    def get(self, label_selector=None):
+        return ResourceField(dict(items=self.items, metadata=ResourceField(dict(resourceVersion='10'))))
+
+
+class FakeResources:
+    def __init__(self, api):
+        self.api = api
+
+    def get(self, api_version, kind):
+        return self.api
+
+
+class FakeDynamicClient:
+    def __init__(self, items, events):
+        self.resources = FakeResources(FakeApi(items))
+        self.events = events
+
+    def watch(self, resource, **kwargs):
+        for event_type, obj in self.events:
+            yield dict(type=event_type, object=obj, raw_object=dict())
+
+
+def test_informer_list_and_watch():
+    items = [
+        make_object('ns1', 'pod-a', dict(name='session-a')),
+        make_object('ns1', 'pod-b', dict(name='session-b')),
+        make_object('ns2', 'pod-c', dict(name='session-a')),
+    ]
+    events = [
+        ('ADDED', make_object('ns1', 'pod-d', dict(name='session-d'), '11')),
+        ('MODIFIED', make_object('ns1', 'pod-a', dict(name='session-a', extra='yes'), '12')),
+        ('DELETED', make_object('ns1', 'pod-b', dict(name='session-b'), '13')),
+    ]
+    informer = ResourceInformer(FakeDynamicClient(items, events), 'v1', 'Pod')
+
+    assert not informer.has_synced()
+    assert informer.list() == '10'
+    assert informer.has_synced()
+    assert informer.get('ns1', 'pod-b') is not None
+    assert [p.metadata.name for p in informer.list_by_labels('ns1', dict(name='session-a'))] == ['pod-a']
+
+    # watch applies the events and returns the last seen resource version
+    assert informer.watch('10') == '13'
+    assert informer.get('ns1', 'pod-b') is None
+    assert informer.get('ns1', 'pod-d') is not None
+    assert informer.list_by_labels('ns1', dict(name='session-a', extra='yes'))[0].metadata.name == 'pod-a'
+    assert informer.list_by_labels('ns2', dict(name='session-d')) == []
+
+    informer.stop()
+    assert not informer.has_synced()
@@ -2,12 +2,14 @@
 from datetime import datetime, timezone
 import json
 import logging
+import time
 
 from flask import Flask
 
 import pebbles.utils
-from pebbles.maintenance.main import run_workspace_expiry_cleanup, WORKSPACE_EXPIRY_GRACE_PERIOD
-from pebbles.models import Workspace
+from pebbles.maintenance.main import run_workspace_expiry_cleanup, run_session_log_retention, \
+    run_session_archiving, WORKSPACE_EXPIRY_GRACE_PERIOD
+from pebbles.models import db, ApplicationSession, ApplicationSessionArchive, ApplicationSessionLog, Workspace
 from tests.conftest import PrimaryData
 
 
@@ -59,6 +61,15 @@ class PBClientMock:
         resp = self.request_api.delete('api/v1/%s' % url, headers=headers)
         return MockResponseAdapter(resp)
 
+    def do_post(self, url):
+        headers = {
+            'Accept': 'application/json',
+            'Authorization': 'Basic %s' % self.auth,
+            'token': self.token
+        }
+        resp = self.request_api.post('api/v1/%s' % url, headers=headers)
+        return MockResponseAdapter(resp)
+
     def delete_workspace(self, workspace_id):
         return self.do_delete('workspaces/%s' % workspace_id)
 
@@ -96,3 +107,31 @@ def test_workspace_cleanup(app: Flask, pri_data: PrimaryData):
         assert ws.id in [w.id for w in wss_after]
     for ws in expired_workspaces_beyond_grace:
         assert ws.id not in [w.id for w in wss_after]
+
+
+def test_session_log_retention(app: Flask, pri_data: PrimaryData):
+    session_id = pri_data.known_application_session_id
+    old_ts = datetime.now(timezone.utc).timestamp() - (app.config['SESSION_LOG_RETENTION_DAYS'] + 1) * 24 * 3600
+    for i in range(5):
+        db.session.add(ApplicationSessionLog(session_id, 'info', 'provisioning', old_ts + i, 'old line %d' % i))
+    db.session.add(ApplicationSessionLog(session_id, 'info', 'provisioning', time.time(), 'recent line'))
+    db.session.add(ApplicationSessionLog(session_id, 'info', 'running', old_ts, 'running log'))
+    db.session.commit()
+
+    pb_client = PBClientMock(app.test_client())
+    pb_client.login('admin@example.org', 'admin')
+    run_session_log_retention(pb_client, logging.getLogger(), batch_size=2)
+
+    # old provisioning lines are gone, including the one in the test data set, others are left alone
+    messages = [log.message for log in ApplicationSessionLog.query.all()]
+    assert sorted(messages) == ['recent line', 'running log']
+
+
+def test_session_archiving(app: Flask, pri_data: PrimaryData):
+    pb_client = PBClientMock(app.test_client())
+    pb_client.login('admin@example.org', 'admin')
+    app.config['SESSION_ARCHIVE_GRACE_PERIOD'] = 0
+    run_session_archiving(pb_client, logging.getLogger(), batch_size=1)
+
+    assert ApplicationSession.query.filter_by(state=ApplicationSession.STATE_DELETED).count() == 0
+    assert ApplicationSessionArchive.query.count() == 2
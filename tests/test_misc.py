@@ -63,3 +63,47 @@ def test_validate_container_image_url():
     ]
     for url in invalid_container_image_urls:
         assert validate_container_image_url(url)
+
+
+def test_db_pool_engine_options_and_telemetry():
+    from sqlalchemy import create_engine, text
+    from pebbles.config import BaseConfig, TestConfig
+    from pebbles.db_pool import get_engine_options, PoolTelemetry, TelemetryQueuePool
+
+    assert get_engine_options(TestConfig()) == dict()
+    options = get_engine_options(BaseConfig())
+    assert options['poolclass'] == TelemetryQueuePool
+    assert options['pool_pre_ping']
+    assert options['connect_args'] == dict(options='-c statement_timeout=60000')
+
+    engine = create_engine('sqlite://', poolclass=TelemetryQueuePool, pool_size=1, max_overflow=0)
+    telemetry = PoolTelemetry(capacity=1, report_interval=0)
+    telemetry.attach(engine)
+    with engine.connect() as conn:
+        conn.execute(text('select 1'))
+        assert telemetry.get_stats()['saturation'] == 1.0
+    with engine.connect() as conn:
+        conn.execute(text('select 1'))
+
+    stats = telemetry.get_stats()
+    assert stats['checkouts'] == 2
+    assert stats['checked_out'] == 0
+    assert stats['checked_out_peak'] == 1
+    assert stats['saturated_checkouts'] == 2
+    assert stats['connects'] == 1
+    assert stats['checkout_wait_max_ms'] >= 0.0
+
+    # telemetry survives pool recreation
+    engine.dispose()
+    assert engine.pool.telemetry is telemetry
+
+    telemetry.report()
+    assert telemetry.get_stats()['checkouts'] == 0
+
+
+def test_dumps_json():
+    from pebbles.representations import dumps_json
+    assert dumps_json(dict(a=1, b=[1, 2])) == b'{"a":1,"b":[1,2]}\n'
+    assert dumps_json({1: 'x'}) == b'{"1":"x"}\n'
+    # values orjson cannot handle fall back to the standard library
+    assert dumps_json(dict(big=2 ** 70)) == b'{"big": 1180591620717411303424}\n'
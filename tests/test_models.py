@@ -1,5 +1,6 @@
 # Test fixture methods to be called from app context so we can access the db
 import base64
+import copy
 import json
 import logging
 import time
@@ -7,13 +8,20 @@ import time
 import pytest
 from flask import Flask
 import jwt
+from sqlalchemy import create_engine, inspect, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex, CreateTable
 
 TEST_SECRET = 'test-secret-for-pebbles-unit-tests-not-for-production-aaaaaaaaaa'
 
 from pebbles import models
+from pebbles.data_import import import_data
+from pebbles.db_types import json_field
 from pebbles.models import PEBBLES_TAINT_KEY
 from pebbles.models import User, Workspace, ApplicationTemplate, Application, ApplicationSession
 from pebbles.models import db
+from pebbles.query_benchmark import run_benchmark
+from pebbles.views.commons import create_users
 
 
 @pytest.fixture()
@@ -80,6 +88,28 @@ def test_add_duplicate_user_will_fail(model_data: ModelDataFixture):
         db.session.commit()
 
 
+def test_create_users_bulk(model_data: ModelDataFixture):
+    default_ws = Workspace('System.default')
+    db.session.add(default_ws)
+    db.session.commit()
+
+    accounts = [('bulk-%d@example.org' % i, 'password-%d' % i) for i in range(5)]
+    # existing users and duplicates are skipped
+    accounts += [('USER@example.org', 'new-password'), ('Bulk-0@example.org', 'other-password')]
+    created = create_users(accounts, expiry_ts=time.time() + 3600, batch_size=2, max_workers=2)
+    assert created == ['bulk-%d@example.org' % i for i in range(5)]
+
+    for i in range(5):
+        user = User.query.filter_by(ext_id='bulk-%d@example.org' % i).first()
+        assert user.is_active
+        assert user.expiry_ts
+        assert user.check_password('password-%d' % i)
+        assert [wm.workspace_id for wm in user.workspace_memberships] == [default_ws.id]
+    assert model_data.known_user.check_password('user')
+
+    assert create_users(accounts[:2]) == []
+
+
 def test_application_session_states(model_data: ModelDataFixture):
     s1 = ApplicationSession(model_data.known_application, model_data.known_user)
     for state in ApplicationSession.VALID_STATES:
@@ -343,3 +373,112 @@ def test_replace_application_image(model_data: ModelDataFixture):
     a2.replace_application_image('example.org/foo/bar', 'example.org/foo/bar:next')
     assert a2.config == dict(image_url='example.org/foo/bar:stable')
     assert a2.base_config == dict(image='example.org/foo/bar:stable')
+
+
+def test_import_data(model_data: ModelDataFixture):
+    with open('devel_dataset.yaml') as f:
+        objects = list(models.iter_yaml_data(f))
+    with open('devel_dataset.yaml') as f:
+        assert [type(o) for o in objects] == [type(o) for o in models.load_yaml(f)['data']]
+
+    counts = import_data(objects, batch_size=7)
+    assert counts['users'] == dict(inserted=7, updated=0, skipped=0)
+    assert counts['workspace_memberships'] == dict(inserted=6, updated=0, skipped=0)
+    assert User.query.filter_by(ext_id='admin@example.org').first().check_password('admin')
+    assert Workspace.query.filter_by(id='ws-0').first().name == 'System.default'
+
+    # importing again skips existing rows
+    counts = import_data(objects)
+    assert counts['users'] == dict(inserted=0, updated=0, skipped=7)
+    assert counts['application_templates'] == dict(inserted=0, updated=0, skipped=3)
+
+    # with update, existing rows get the values from the data
+    objects[2].name = 'System.renamed'
+    counts = import_data(objects, update=True)
+    assert counts['users'] == dict(inserted=0, updated=7, skipped=0)
+    assert counts['workspaces'] == dict(inserted=0, updated=2, skipped=0)
+    db.session.expire_all()
+    assert Workspace.query.filter_by(id='ws-0').first().name == 'System.renamed'
+
+    # rows conflicting with other unique constraints are skipped
+    counts = import_data([User('ADMIN@example.org', 'other')])
+    assert counts['users'] == dict(inserted=0, updated=0, skipped=1)
+
+
+def test_json_columns_postgresql_sql():
+    pg_dialect = postgresql.dialect()
+    # documents are stored as jsonb and fetched as text
+    ddl = str(CreateTable(ApplicationSession.__table__).compile(dialect=pg_dialect))
+    assert 'provisioning_config JSONB' in ddl
+    query = str(select(Workspace).compile(dialect=pg_dialect))
+    assert 'CAST(workspaces.config AS TEXT)' in query
+
+    # lookups render the expressions the indexes are built on
+    query = str(
+        select(Workspace.id)
+        .where(json_field(Workspace._membership_expiry_policy, 'kind') == 'activity_timeout')
+        .compile(dialect=pg_dialect)
+    )
+    assert "(workspaces.membership_expiry_policy ->> 'kind')" in query
+    index_ddl = [str(CreateIndex(ix).compile(dialect=pg_dialect)) for ix in Workspace.__table__.indexes]
+    assert "CREATE INDEX ix_workspaces_membership_expiry_policy_kind ON workspaces " \
+           "((membership_expiry_policy ->> 'kind'))" in index_ddl
+
+
+def test_json_columns_memoized(model_data):
+    application = db.session.get(Application, model_data.known_application.id)
+    # documents are parsed once and reused
+    config = application.config
+    assert application.config is config
+    assert config == dict(cost_multiplier='1.5')
+
+    # assigning replaces the document
+    application.config = dict(memory_gib=2)
+    assert application.config is not config
+    assert application.config == dict(memory_gib=2)
+
+    # in place changes, also in nested containers, are written back to the column
+    application.config['environment'] = dict(FOO='bar')
+    application.config['environment']['BAZ'] = 'qux'
+    application.config.setdefault('labels', []).append('x')
+    db.session.commit()
+    db.session.expire_all()
+    config = application.config
+    assert config == dict(memory_gib=2, environment=dict(FOO='bar', BAZ='qux'), labels=['x'])
+
+    # refreshing from the database invalidates the parsed document
+    db.session.execute(
+        Application.__table__.update().where(Application.__table__.c.id == application.id).values(config='{}')
+    )
+    db.session.refresh(application)
+    assert application.config == {}
+    # changes to a stale document are not written back
+    config['memory_gib'] = 4
+    assert application.config == {}
+
+    # copies are plain containers
+    copied = copy.deepcopy(application.base_config)
+    assert type(copied) is dict
+    assert type(application.attribute_limits.copy()) is list
+
+
+def test_hot_query_indexes(tmp_path):
+    engine = create_engine('sqlite:///%s' % (tmp_path / 'benchmark.db'))
+    output = []
+    results = run_benchmark(engine, users=200, iterations=1, out=output.append)
+    # timings without and with the indexes
+    assert 'sessions of a user' in results
+    assert all(len(timings) == 2 for timings in results.values())
+    # the indexes are picked by the query planner
+    report = '\n'.join(output)
+    for index_name in ('ix_workspace_memberships_user_id', 'ix_application_sessions_user_id_active',
+                       'ix_tasks_state_create_ts', 'ix_alerts_target_source_status'):
+        assert 'USING INDEX %s' % index_name in report
+    # the scratch tables are dropped afterwards
+    assert inspect(engine).get_table_names() == []
+
+    # a database with tables is not touched
+    models.db.metadata.tables['users'].create(engine)
+    with pytest.raises(RuntimeError):
+        run_benchmark(engine, users=200, iterations=1, out=output.append)
+    assert inspect(engine).get_table_names() == ['users']
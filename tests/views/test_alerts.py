@@ -110,3 +110,51 @@ def test_alerts_admin(rmaker: RequestMaker, pri_data: PrimaryData):
     )
     assert response.status_code == 200
     assert len(response.json) == 3
+
+
+def test_alerts_bulk_upsert(rmaker: RequestMaker, pri_data: PrimaryData, assert_max_queries):
+    alerts = [
+        dict(target='cluster-1', source='prometheus', status='firing', data=dict(name='alert-%d' % i))
+        for i in range(20)
+    ]
+    # alert writes do not grow with the number of alerts
+    with assert_max_queries(5) as counter:
+        response = rmaker.make_authenticated_admin_request(
+            method='POST',
+            path='/api/v1/alerts',
+            data=json.dumps(alerts + [alerts[0]])
+        )
+    assert response.status_code == 200
+    assert len(response.json) == 21
+    assert response.json[0] == response.json[20]
+    assert len([s for s in counter.statements if s.startswith('INSERT')]) == 1
+    first_seen_ts = response.json[0]['first_seen_ts']
+
+    # posting again updates the status but keeps the first seen timestamp
+    alerts[0]['status'] = 'ok'
+    response = rmaker.make_authenticated_admin_request(
+        method='POST',
+        path='/api/v1/alerts',
+        data=json.dumps(alerts)
+    )
+    assert response.status_code == 200
+    assert response.json[0]['status'] == 'ok'
+    assert response.json[0]['first_seen_ts'] == first_seen_ts
+    assert response.json[1]['status'] == 'firing'
+
+    # reset archives the firing alerts with a single update and returns them
+    with assert_max_queries(6) as counter:
+        response = rmaker.make_authenticated_admin_request(
+            method='POST',
+            path='/api/v1/alert_reset/cluster-1/prometheus',
+        )
+    assert response.status_code == 200
+    assert len(response.json) == 19
+    assert set(a['status'] for a in response.json) == {'archived'}
+    assert len([s for s in counter.statements if s.startswith('UPDATE')]) == 1
+
+    response = rmaker.make_authenticated_admin_request(
+        path='/api/v1/alerts?status=firing',
+    )
+    assert response.status_code == 200
+    assert len(response.json) == 0
@@ -4,7 +4,7 @@ from datetime import datetime
 
 from sqlalchemy import select
 
-from pebbles.models import User, Application, ApplicationSession, ApplicationSessionLog
+from pebbles.models import User, Application, ApplicationSession, ApplicationSessionArchive, ApplicationSessionLog
 from pebbles.models import db
 from tests.conftest import PrimaryData, RequestMaker
 
@@ -237,6 +237,75 @@ def test_get_application_sessions_limit(rmaker: RequestMaker, pri_data: PrimaryD
         assert resp.json[2]['id'] == s7.id, f'state {state} did not get sorted as second priority'
 
 
+def test_get_application_sessions_work_queue(rmaker: RequestMaker, pri_data: PrimaryData):
+    path = '/api/v1/application_sessions?work_queue=1&limit=10'
+    # nothing to do for the worker in the test data set
+    resp = rmaker.make_authenticated_admin_request(path=path)
+    assert resp.status_code == 200
+    assert resp.json == []
+
+    s1 = db.session.get(ApplicationSession, pri_data.known_application_session_id)
+    s2 = db.session.get(ApplicationSession, pri_data.known_application_session_id_2)
+    s5 = db.session.get(ApplicationSession, pri_data.known_application_session_id_5)
+    s7 = ApplicationSession(
+        Application.query.filter_by(id=pri_data.known_application_id).first(),
+        User.query.filter_by(ext_id="user@example.org").first())
+    s7.name = 'pb-s7'
+    db.session.add(s7)
+    db.session.commit()
+    s2.state = ApplicationSession.STATE_STARTING
+    db.session.commit()
+    s1.log_fetch_pending = True
+    db.session.commit()
+    # running past the maximum lifetime
+    s5.provisioned_at = datetime.strptime("2023-12-19T13:00:00", "%Y-%m-%dT%H:%M:%S")
+    db.session.commit()
+
+    # actionable sessions, the ones that have waited longest since their last change first
+    resp = rmaker.make_authenticated_admin_request(path=path)
+    assert [s['id'] for s in resp.json] == [s7.id, s2.id, s1.id, s5.id]
+    resp = rmaker.make_authenticated_admin_request(path='/api/v1/application_sessions?work_queue=1&limit=2')
+    assert [s['id'] for s in resp.json] == [s7.id, s2.id]
+
+    # sessions locked by a worker are left out
+    resp = rmaker.make_authenticated_admin_request(method='PUT', path='/api/v1/locks/%s' % s7.id,
+                                                   data=json.dumps(dict(owner='worker-1')))
+    assert resp.status_code == 200
+    resp = rmaker.make_authenticated_admin_request(path=path)
+    assert [s['id'] for s in resp.json] == [s2.id, s1.id, s5.id]
+
+    # processed sessions drop out of the queue
+    s2.state = ApplicationSession.STATE_RUNNING
+    db.session.commit()
+    resp = rmaker.make_authenticated_admin_request(path=path)
+    assert [s['id'] for s in resp.json] == [s1.id, s5.id]
+
+    # failed sessions are picked up when they are to be deleted
+    s4 = db.session.get(ApplicationSession, pri_data.known_application_session_id_4)
+    s4.to_be_deleted = True
+    db.session.commit()
+    resp = rmaker.make_authenticated_admin_request(path=path)
+    assert [s['id'] for s in resp.json] == [s1.id, s5.id, s4.id]
+
+    # sessions that are still in the queue after an attempt are ordered by the attempt time, s7 was locked
+    # before s4 was marked to be deleted. The attempt does not change updated_at.
+    s7_updated_at = s7.updated_at
+    resp = rmaker.make_authenticated_admin_request(method='DELETE', path='/api/v1/locks/%s' % s7.id)
+    assert resp.status_code == 200
+    resp = rmaker.make_authenticated_admin_request(path=path)
+    assert [s['id'] for s in resp.json] == [s1.id, s5.id, s7.id, s4.id]
+    for session_id in [s1.id, s5.id]:
+        resp = rmaker.make_authenticated_admin_request(method='PUT', path='/api/v1/locks/%s' % session_id,
+                                                       data=json.dumps(dict(owner='worker-1')))
+        assert resp.status_code == 200
+        resp = rmaker.make_authenticated_admin_request(method='DELETE', path='/api/v1/locks/%s' % session_id)
+        assert resp.status_code == 200
+    resp = rmaker.make_authenticated_admin_request(path=path)
+    assert [s['id'] for s in resp.json] == [s7.id, s4.id, s1.id, s5.id]
+    db.session.refresh(s7)
+    assert s7.updated_at == s7_updated_at
+
+
 def test_get_application_session(rmaker: RequestMaker, pri_data: PrimaryData):
     # Anonymous
     response = rmaker.make_request(path='/api/v1/application_sessions/%s' % pri_data.known_application_session_id)
@@ -505,6 +574,111 @@ def test_application_session_logs(rmaker: RequestMaker, pri_data: PrimaryData):
     assert 'patched running logs' == response_get.json[0]['message']
 
 
+def test_application_session_logs_batch(rmaker: RequestMaker, pri_data: PrimaryData):
+    path = '/api/v1/application_sessions/%s/logs' % pri_data.known_application_session_id
+    log_records = [
+        dict(log_level='info', log_type='provisioning', timestamp=1000.0 + i, message='line %d' % i)
+        for i in range(3)
+    ]
+    # the batch contains a duplicate, it is stored only once
+    response = rmaker.make_authenticated_admin_request(
+        method='PATCH', path=path, data=json.dumps(dict(log_records=log_records + log_records[-1:])))
+    assert response.status_code == 200
+    assert response.json == 'ok'
+
+    # resubmitting the same lines makes no changes
+    response = rmaker.make_authenticated_admin_request(
+        method='PATCH', path=path, data=json.dumps(dict(log_records=log_records)))
+    assert response.status_code == 200
+    assert response.json == 'no change'
+
+    # new lines are added along with the old ones
+    log_records.append(dict(log_level='info', log_type='provisioning', timestamp=1010.0, message='ready'))
+    response = rmaker.make_authenticated_admin_request(
+        method='PATCH', path=path, data=json.dumps(dict(log_records=log_records)))
+    assert response.json == 'ok'
+    response = rmaker.make_authenticated_admin_request(method='GET', path=path + '?log_type=provisioning')
+    assert [log['message'] for log in response.json] == ['line 0', 'line 1', 'line 2', 'ready']
+
+    # the running log is replaced by the latest record in the batch
+    running_records = [
+        dict(log_level='info', log_type='running', timestamp=2000.0 + i, message='running %d' % i)
+        for i in range(2)
+    ]
+    for _ in range(2):
+        response = rmaker.make_authenticated_admin_request(
+            method='PATCH', path=path, data=json.dumps(dict(log_records=running_records)))
+        assert response.status_code == 200
+    response = rmaker.make_authenticated_admin_request(method='GET', path=path + '?log_type=running')
+    assert [log['message'] for log in response.json] == ['running 1']
+
+    # incomplete records are rejected
+    response = rmaker.make_authenticated_admin_request(
+        method='PATCH', path=path, data=json.dumps(dict(log_records=[dict(log_type='provisioning')])))
+    assert response.status_code == 422
+
+    # only admins can add logs
+    response = rmaker.make_authenticated_user_request(
+        method='PATCH', path=path, data=json.dumps(dict(log_records=log_records)))
+    assert response.status_code == 403
+
+
+def test_application_session_log_retention(rmaker: RequestMaker, pri_data: PrimaryData):
+    # only admins can prune logs
+    response = rmaker.make_authenticated_user_request(method='POST', path='/api/v1/application_session_logs/prune')
+    assert response.status_code == 403
+    response = rmaker.make_authenticated_admin_request(
+        method='POST', path='/api/v1/application_session_logs/prune?batch_size=0')
+    assert response.status_code == 422
+
+    # the test data set has one old provisioning line
+    response = rmaker.make_authenticated_admin_request(
+        method='POST', path='/api/v1/application_session_logs/prune?batch_size=10')
+    assert response.status_code == 200
+    assert response.json == dict(num_deleted=1, batch_size=10)
+    response = rmaker.make_authenticated_admin_request(
+        method='GET', path='/api/v1/application_sessions/%s/logs' % pri_data.known_application_session_id_2)
+    assert response.json == []
+
+    # batch size is capped by configuration
+    response = rmaker.make_authenticated_admin_request(
+        method='POST', path='/api/v1/application_session_logs/prune?batch_size=100000000')
+    assert response.json == dict(num_deleted=0, batch_size=5000)
+
+
+def test_application_session_archive(app, rmaker: RequestMaker, pri_data: PrimaryData):
+    # only admins can archive
+    response = rmaker.make_authenticated_user_request(method='POST', path='/api/v1/application_session_archive')
+    assert response.status_code == 403
+
+    # the deleted sessions in the test data set are within the grace period
+    response = rmaker.make_authenticated_admin_request(method='POST', path='/api/v1/application_session_archive')
+    assert response.status_code == 200
+    assert response.json['num_archived'] == 0
+
+    app.config['SESSION_ARCHIVE_GRACE_PERIOD'] = 0
+    assert ApplicationSession.query.filter_by(state=ApplicationSession.STATE_DELETED).count() == 2
+    response = rmaker.make_authenticated_admin_request(
+        method='POST', path='/api/v1/application_session_archive?batch_size=1')
+    assert response.json == dict(num_archived=1, batch_size=1)
+    response = rmaker.make_authenticated_admin_request(
+        method='POST', path='/api/v1/application_session_archive?batch_size=10')
+    assert response.json == dict(num_archived=1, batch_size=10)
+
+    # only live sessions are left, the deleted ones are in the archive with their usage data
+    db.session.expire_all()
+    assert ApplicationSession.query.filter_by(state=ApplicationSession.STATE_DELETED).count() == 0
+    archived = ApplicationSessionArchive.query.order_by(ApplicationSessionArchive.name).all()
+    assert [a.name for a in archived] == ['pb-s3', 'pb-s6']
+    assert archived[0].workspace_id == pri_data.known_workspace_id
+    assert archived[0].provisioning_config['memory_gib'] == 4
+
+    # accounting includes the archived sessions
+    response = rmaker.make_authenticated_admin_request(
+        method='GET', path='/api/v1/workspaces/%s/accounting' % pri_data.known_workspace_id)
+    assert response.json['gib_hours'] == 28
+
+
 def test_application_session_provisioning_config(rmaker: RequestMaker, pri_data: PrimaryData):
     # Authenticated User, should not see provisioning_config
     response = rmaker.make_authenticated_user_request(
@@ -543,3 +717,54 @@ def test_application_session_info(rmaker: RequestMaker, pri_data: PrimaryData):
         method='GET',
         path='/api/v1/application_sessions/%s' % pri_data.known_application_session_id)
     assert response.json.get('info') == dict(container_image='registry.example.org/pebbles/image1')
+
+
+def test_get_application_sessions_conditional(rmaker: RequestMaker, pri_data: PrimaryData):
+    response = rmaker.make_authenticated_user_request(path='/api/v1/application_sessions')
+    assert response.status_code == 200
+    etag = response.headers.get('ETag')
+    assert etag
+    assert response.headers.get('Cache-Control') == 'private, no-cache'
+
+    # nothing changed
+    response = rmaker.make_authenticated_user_request(
+        path='/api/v1/application_sessions', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers.get('ETag') == etag
+
+    # other users get a different tag for the same data
+    response = rmaker.make_authenticated_user_2_request(path='/api/v1/application_sessions')
+    assert response.headers.get('ETag') != etag
+
+    # state change in a session of the user
+    application_session = db.session.get(ApplicationSession, pri_data.known_application_session_id)
+    application_session.state = ApplicationSession.STATE_FAILED
+    db.session.commit()
+    response = rmaker.make_authenticated_user_request(
+        path='/api/v1/application_sessions', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers.get('ETag') != etag
+
+    # limited queries by the worker are not conditional
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/application_sessions?limit=1')
+    assert response.status_code == 200
+    assert 'ETag' not in response.headers
+    assert response.headers.get('Cache-Control') == 'no-cache, no-store, must-revalidate'
+
+
+def test_get_application_sessions_query_count(rmaker: RequestMaker, pri_data: PrimaryData, assert_max_queries):
+    # log in outside the counted blocks
+    rmaker.make_authenticated_admin_request(path='/api/v1/application_sessions')
+    rmaker.make_authenticated_user_request(path='/api/v1/application_sessions')
+    rmaker.make_authenticated_workspace_owner_request(path='/api/v1/application_sessions')
+
+    with assert_max_queries(5):
+        response = rmaker.make_authenticated_admin_request(path='/api/v1/application_sessions')
+        assert response.status_code == 200
+    with assert_max_queries(8):
+        response = rmaker.make_authenticated_user_request(path='/api/v1/application_sessions')
+        assert response.status_code == 200
+    with assert_max_queries(7):
+        response = rmaker.make_authenticated_workspace_owner_request(path='/api/v1/application_sessions')
+        assert response.status_code == 200
@@ -2,6 +2,7 @@ import json
 import uuid
 from sqlalchemy import select
 
+from pebbles.catalogue_cache import get_catalogue_cache
 from pebbles.models import Application, db, WorkspaceMembership
 from tests.conftest import PrimaryData, RequestMaker
 
@@ -535,3 +536,96 @@ def test_application_attribute_limits(rmaker: RequestMaker, pri_data: PrimaryDat
             data=json.dumps(data)
         )
         assert response.status_code == 422
+
+
+def test_get_application_images(rmaker: RequestMaker, pri_data: PrimaryData):
+    # Anonymous, user and owner cannot access
+    response = rmaker.make_request(path='/api/v1/application_images')
+    assert response.status_code == 401
+    response = rmaker.make_authenticated_user_request(path='/api/v1/application_images')
+    assert response.status_code == 403
+    response = rmaker.make_authenticated_workspace_owner_request(path='/api/v1/application_images')
+    assert response.status_code == 403
+
+    # Admin
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/application_images')
+    assert response.status_code == 200
+    assert len(response.json) > 0
+    for entry in response.json:
+        assert entry['image'] == 'registry.example.org/image:latest'
+        assert entry['application_count'] > 0
+        assert entry['weight'] == entry['launch_count'] + entry['member_count'] / 10
+    # one entry per cluster, sorted by weight
+    assert len(set(e['cluster'] for e in response.json)) == len(response.json)
+    weights = [e['weight'] for e in response.json]
+    assert weights == sorted(weights, reverse=True)
+    # test sessions have been launched just now
+    assert sum(e['launch_count'] for e in response.json) > 0
+    # members of workspaces with several applications using the same image are counted only once
+    num_members = len(db.session.scalars(
+        select(WorkspaceMembership).where(WorkspaceMembership.is_banned.is_(False))
+    ).all())
+    assert 0 < sum(e['member_count'] for e in response.json) <= num_members
+
+    # launches outside the window are not counted
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/application_images?launch_window_days=0')
+    assert response.status_code == 200
+
+
+def test_get_application_images_archived_launches(app, rmaker: RequestMaker, pri_data: PrimaryData):
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/application_images')
+    assert response.status_code == 200
+    launch_counts = {e['cluster']: e['launch_count'] for e in response.json}
+
+    # deleted sessions moved to the archive are still counted as launches
+    app.config['SESSION_ARCHIVE_GRACE_PERIOD'] = 0
+    response = rmaker.make_authenticated_admin_request(method='POST', path='/api/v1/application_session_archive')
+    assert response.json['num_archived'] > 0
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/application_images')
+    assert response.status_code == 200
+    assert {e['cluster']: e['launch_count'] for e in response.json} == launch_counts
+
+
+def test_get_applications_conditional(rmaker: RequestMaker, pri_data: PrimaryData):
+    response = rmaker.make_authenticated_user_request(path='/api/v1/applications')
+    assert response.status_code == 200
+    etag = response.headers.get('ETag')
+    response = rmaker.make_authenticated_user_request(path='/api/v1/applications', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    application = db.session.get(Application, pri_data.known_application_id)
+    application.name = 'renamed'
+    db.session.commit()
+    response = rmaker.make_authenticated_user_request(path='/api/v1/applications', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert 'renamed' in [a['name'] for a in response.json]
+
+
+def test_get_applications_catalogue_cache(rmaker: RequestMaker, pri_data: PrimaryData):
+    cache = get_catalogue_cache()
+    cache.invalidate()
+    response = rmaker.make_authenticated_user_request(path='/api/v1/applications')
+    assert response.status_code == 200
+    assert len(cache.entries) == 1
+    response_2 = rmaker.make_authenticated_user_request(path='/api/v1/applications')
+    assert response_2.json == response.json
+    assert len(cache.entries) == 1
+
+    # committing a change to an application invalidates the catalogue
+    application = db.session.get(Application, pri_data.known_application_id)
+    application.name = 'renamed'
+    db.session.commit()
+    assert len(cache.entries) == 0
+    response = rmaker.make_authenticated_user_request(path='/api/v1/applications')
+    assert 'renamed' in [a['name'] for a in response.json]
+
+    # a value computed before an invalidation is not stored
+    generation = cache.generation
+    cache.invalidate()
+    cache.put('stale', [], generation)
+    assert cache.get('stale') is None
+
+    # admins bypass the cache
+    cache.invalidate()
+    rmaker.make_authenticated_admin_request(path='/api/v1/applications')
+    assert len(cache.entries) == 0
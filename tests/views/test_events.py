@@ -0,0 +1,60 @@
+import json
+
+from flask import Flask
+
+from pebbles.models import ApplicationSession
+from tests.conftest import PrimaryData, RequestMaker
+
+
+def read_events(response):
+    """Parse server-sent events from a finished stream to a list of (event type, data)"""
+    events = []
+    for block in response.get_data(as_text=True).split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in block.split('\n') if line and not line.startswith(':'))
+        if 'event' in lines:
+            events.append((lines['event'], json.loads(lines['data'])))
+    return events
+
+
+def test_event_stream_disabled(rmaker: RequestMaker, pri_data: PrimaryData):
+    response = rmaker.make_request(path='/api/v1/application_session_events')
+    assert response.status_code == 401
+    response = rmaker.make_authenticated_user_request(path='/api/v1/application_session_events')
+    assert response.status_code == 503
+
+
+def test_event_stream(app: Flask, rmaker: RequestMaker, pri_data: PrimaryData):
+    app.config['EVENT_STREAM_ENABLED'] = True
+    app.config['EVENT_STREAM_MAX_DURATION'] = 0.5
+    app.config['EVENT_STREAM_KEEPALIVE_INTERVAL'] = 0.1
+
+    # open streams for the owner of the session and for another user, the stream is consumed later
+    user_stream = rmaker.make_authenticated_user_request(path='/api/v1/application_session_events')
+    assert user_stream.status_code == 200
+    assert user_stream.mimetype == 'text/event-stream'
+    user_2_stream = rmaker.make_authenticated_user_2_request(path='/api/v1/application_session_events')
+    assert user_2_stream.status_code == 200
+
+    response = rmaker.make_authenticated_admin_request(
+        method='PATCH',
+        path='/api/v1/application_sessions/%s' % pri_data.known_application_session_id,
+        data=json.dumps(dict(state=ApplicationSession.STATE_FAILED))
+    )
+    assert response.status_code == 200
+    response = rmaker.make_authenticated_admin_request(
+        method='PATCH',
+        path='/api/v1/application_sessions/%s/logs' % pri_data.known_application_session_id,
+        data=json.dumps(dict(log_record=dict(
+            log_level='info', log_type='provisioning', timestamp=1234567890.0, message='pulling image'
+        )))
+    )
+    assert response.status_code == 200
+
+    events = read_events(user_stream)
+    assert [e[0] for e in events] == ['session_state', 'session_log']
+    assert events[0][1]['application_session_id'] == pri_data.known_application_session_id
+    assert events[0][1]['state'] == ApplicationSession.STATE_FAILED
+    assert events[1][1]['message'] == 'pulling image'
+
+    # sessions of other users are not visible
+    assert read_events(user_2_stream) == []
@@ -53,3 +53,22 @@ def test_admin_acquire_lock(rmaker: RequestMaker, pri_data: PrimaryData):
         path='/api/v1/locks/%s?owner=test' % unique_id
     )
     assert response.status_code == 200
+
+
+def test_list_locks_paginated(rmaker: RequestMaker, pri_data: PrimaryData):
+    for lock_id in ('lock-a', 'lock-b', 'other'):
+        response = rmaker.make_authenticated_admin_request(
+            method='PUT',
+            path='/api/v1/locks/%s' % lock_id,
+            data=json.dumps(dict(owner='test'))
+        )
+        assert response.status_code == 200
+
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/locks?id_prefix=lock-&page_size=1&count=1')
+    assert response.status_code == 200
+    assert [lock['id'] for lock in response.json] == ['lock-a']
+    assert response.headers.get('X-Total-Count') == '2'
+    response = rmaker.make_authenticated_admin_request(
+        path='/api/v1/locks?id_prefix=lock-&page_size=1&cursor=%s' % response.headers.get('X-Next-Cursor'))
+    assert [lock['id'] for lock in response.json] == ['lock-b']
+    assert 'X-Next-Cursor' not in response.headers
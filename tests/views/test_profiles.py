@@ -0,0 +1,63 @@
+import cProfile
+import pstats
+
+from flask import Flask
+
+from tests.conftest import PrimaryData, RequestMaker
+
+
+def test_request_profile_requested(rmaker: RequestMaker, pri_data: PrimaryData, tmp_path, monkeypatch):
+    profilers = []
+
+    class RecordingProfile(cProfile.Profile):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            profilers.append(self)
+
+    monkeypatch.setattr(cProfile, 'Profile', RecordingProfile)
+
+    # requests by anonymous clients and non-admins are not profiled at all
+    response = rmaker.make_request(path='/api/v1/applications', headers={'X-Pebbles-Profile': '1'})
+    assert response.status_code == 401
+    response = rmaker.make_authenticated_user_request(path='/api/v1/applications', headers={'X-Pebbles-Profile': '1'})
+    assert response.status_code == 200
+    assert 'X-Pebbles-Profile-Id' not in response.headers
+    assert profilers == []
+    response = rmaker.make_authenticated_user_request(path='/api/v1/request_profiles')
+    assert response.status_code == 403
+
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/applications', headers={'X-Pebbles-Profile': '1'})
+    assert response.status_code == 200
+    profile_id = response.headers.get('X-Pebbles-Profile-Id')
+    assert profile_id
+    assert len(profilers) == 1
+
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/request_profiles')
+    assert response.status_code == 200
+    assert [p['id'] for p in response.json] == [profile_id]
+    assert response.json[0]['endpoint'] == 'applicationlist'
+    assert response.json[0]['sql_count'] > 0
+
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/request_profiles/%s' % profile_id)
+    assert response.status_code == 200
+    assert 'cumulative' in response.json['report']
+
+    # the raw statistics can be loaded with pstats
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/request_profiles/%s?format=pstats' % profile_id)
+    assert response.status_code == 200
+    stats_file = tmp_path / 'profile.pstats'
+    stats_file.write_bytes(response.get_data())
+    assert pstats.Stats(str(stats_file)).total_calls > 0
+
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/request_profiles/unknown')
+    assert response.status_code == 404
+
+
+def test_request_profile_sampled(app: Flask, rmaker: RequestMaker, pri_data: PrimaryData):
+    app.config['PROFILING_ENDPOINT_SAMPLE_RATES'] = {'applicationlist': 1.0}
+    response = rmaker.make_authenticated_user_request(path='/api/v1/workspaces')
+    assert 'X-Pebbles-Profile-Id' not in response.headers
+    response = rmaker.make_authenticated_user_request(path='/api/v1/applications')
+    assert response.headers.get('X-Pebbles-Profile-Id')
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/request_profiles')
+    assert len(response.json) == 1
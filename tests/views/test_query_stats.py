@@ -0,0 +1,29 @@
+import logging
+
+from flask import Flask
+
+from tests.conftest import PrimaryData, RequestMaker
+
+
+def test_query_stats(app: Flask, rmaker: RequestMaker, pri_data: PrimaryData, caplog):
+    response = rmaker.make_authenticated_user_request(path='/api/v1/query_stats')
+    assert response.status_code == 403
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/query_stats', method='DELETE')
+    assert response.status_code == 200
+
+    app.config['SQL_STATEMENT_ENDPOINT_BUDGETS'] = {'workspacelist': 1}
+    app.config['SQL_REPEATED_STATEMENT_THRESHOLD'] = 2
+    with caplog.at_level(logging.WARNING):
+        rmaker.make_authenticated_admin_request(path='/api/v1/workspaces')
+        rmaker.make_authenticated_admin_request(path='/api/v1/application_sessions')
+    assert 'endpoint workspacelist executed' in caplog.text
+    assert 'endpoint applicationsessionlist executed' not in caplog.text
+    assert 'possible N+1 query in endpoint workspacelist' in caplog.text
+
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/query_stats')
+    assert response.status_code == 200
+    stats = {s['endpoint']: s for s in response.json}
+    assert stats['workspacelist']['requests'] == 1
+    assert stats['workspacelist']['over_budget'] == 1
+    assert stats['workspacelist']['statements'] > 1
+    assert stats['applicationsessionlist']['over_budget'] == 0
@@ -329,3 +329,35 @@ def test_user_deletion_request(rmaker: RequestMaker, pri_data: PrimaryData):
         path='/api/v1/users/%s/request_deletion' % pri_data.known_user_id,
     )
     assert response.status_code == 403
+
+
+def test_get_users_paginated(rmaker: RequestMaker, pri_data: PrimaryData):
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/users?count=1')
+    assert response.status_code == 200
+    all_ids = [u['id'] for u in response.json]
+    assert response.headers.get('X-Total-Count') == str(len(all_ids))
+    assert 'X-Next-Cursor' not in response.headers
+
+    # page through the users, the pages cover the full list in the same order
+    paged_ids = []
+    path = '/api/v1/users?page_size=3'
+    while path:
+        response = rmaker.make_authenticated_admin_request(path=path)
+        assert response.status_code == 200
+        assert len(response.json) <= 3
+        paged_ids.extend(u['id'] for u in response.json)
+        cursor = response.headers.get('X-Next-Cursor')
+        path = '/api/v1/users?page_size=3&cursor=%s' % cursor if cursor else None
+    assert paged_ids == all_ids
+
+    # filter by ext_id prefix, count is for the filtered set
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/users?ext_id_prefix=Workspace_owner&count=1')
+    assert sorted(u['ext_id'] for u in response.json) == ['workspace_owner2@example.org', 'workspace_owner@example.org']
+    assert response.headers.get('X-Total-Count') == '2'
+
+    # time range on joining time
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/users?to_ts=1')
+    assert response.json == []
+
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/users?page_size=3&cursor=invalid')
+    assert response.status_code == 422
@@ -0,0 +1,178 @@
+import json
+
+from pebbles.models import Application, ApplicationSession
+from pebbles.models import db
+from tests.conftest import PrimaryData, RequestMaker
+
+
+def set_warm_pool_size(application_id, pool_size):
+    application = db.session.get(Application, application_id)
+    config = application.config
+    config['warm_pool_size'] = pool_size
+    application.config = config
+    db.session.commit()
+
+
+def test_warm_pools_access(rmaker: RequestMaker, pri_data: PrimaryData):
+    response = rmaker.make_request(path='/api/v1/warm_pools')
+    assert response.status_code == 401
+    response = rmaker.make_authenticated_user_request(path='/api/v1/warm_pools')
+    assert response.status_code == 403
+    response = rmaker.make_authenticated_workspace_owner_request(path='/api/v1/warm_pools')
+    assert response.status_code == 403
+    response = rmaker.make_authenticated_workspace_owner_request(
+        method='POST',
+        path='/api/v1/warm_pools/%s' % pri_data.known_application_id
+    )
+    assert response.status_code == 403
+
+
+def test_warm_pool_lifecycle(rmaker: RequestMaker, pri_data: PrimaryData):
+    # no pools configured
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/warm_pools')
+    assert response.status_code == 200
+    assert response.json == []
+
+    # cannot create warm sessions for an application without a pool
+    response = rmaker.make_authenticated_admin_request(
+        method='POST',
+        path='/api/v1/warm_pools/%s' % pri_data.known_application_id
+    )
+    assert response.status_code == 409
+
+    set_warm_pool_size(pri_data.known_application_id, 2)
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/warm_pools')
+    assert response.status_code == 200
+    assert len(response.json) == 1
+    assert response.json[0]['application_id'] == pri_data.known_application_id
+    # one recent launch in test data, so the pool grows from one to two
+    assert response.json[0]['target_size'] == 2
+    assert response.json[0]['session_ids'] == []
+
+    # create a warm session
+    response = rmaker.make_authenticated_admin_request(
+        method='POST',
+        path='/api/v1/warm_pools/%s' % pri_data.known_application_id
+    )
+    assert response.status_code == 200
+    warm_session_id = response.json['id']
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/warm_pools')
+    assert response.json[0]['session_ids'] == [warm_session_id]
+
+    # warm sessions are not visible to managers
+    response = rmaker.make_authenticated_workspace_owner_request(path='/api/v1/application_sessions')
+    assert response.status_code == 200
+    assert warm_session_id not in [s['id'] for s in response.json]
+
+    # a session that is not running yet is not handed over
+    response = rmaker.make_authenticated_user_2_request(
+        method='POST',
+        path='/api/v1/application_sessions',
+        data=json.dumps(dict(application_id=pri_data.known_application_id))
+    )
+    assert response.status_code == 200
+    assert response.json['id'] != warm_session_id
+    response = rmaker.make_authenticated_user_2_request(
+        method='DELETE',
+        path='/api/v1/application_sessions/%s' % response.json['id']
+    )
+    assert response.status_code == 202
+
+    # mark the warm session running and hand it over to the next user
+    response = rmaker.make_authenticated_admin_request(
+        method='PATCH',
+        path='/api/v1/application_sessions/%s' % warm_session_id,
+        data=json.dumps(dict(state=ApplicationSession.STATE_RUNNING))
+    )
+    assert response.status_code == 200
+    # regular user gets the warm session, once the existing session for the application is gone
+    assert db.session.get(ApplicationSession, warm_session_id).is_warm
+    db.session.delete(db.session.get(ApplicationSession, pri_data.known_application_session_id))
+    db.session.commit()
+    response = rmaker.make_authenticated_user_request(
+        method='POST',
+        path='/api/v1/application_sessions',
+        data=json.dumps(dict(application_id=pri_data.known_application_id))
+    )
+    assert response.status_code == 200
+    assert response.json['id'] == warm_session_id
+    assert response.json['user_id'] == pri_data.known_user_id
+    assert response.json['state'] == ApplicationSession.STATE_RUNNING
+    db.session.expire_all()
+    assert not db.session.get(ApplicationSession, warm_session_id).is_warm
+
+    # pool is now empty
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/warm_pools')
+    assert response.json[0]['session_ids'] == []
+
+
+def test_warm_pool_stale_and_drained(rmaker: RequestMaker, pri_data: PrimaryData):
+    set_warm_pool_size(pri_data.known_application_id, 1)
+    response = rmaker.make_authenticated_admin_request(
+        method='POST',
+        path='/api/v1/warm_pools/%s' % pri_data.known_application_id
+    )
+    assert response.status_code == 200
+    warm_session_id = response.json['id']
+
+    # changing application config makes the warm session stale
+    application = db.session.get(Application, pri_data.known_application_id)
+    application.config = dict(application.config, image_url='registry.example.org/other:latest')
+    db.session.commit()
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/warm_pools')
+    assert response.json[0]['session_ids'] == []
+    assert response.json[0]['stale_session_ids'] == [warm_session_id]
+
+    # disabling the pool drains it
+    set_warm_pool_size(pri_data.known_application_id, 0)
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/warm_pools')
+    assert len(response.json) == 1
+    assert response.json[0]['target_size'] == 0
+
+
+def test_warm_sessions_and_workspace_memory_limit(rmaker: RequestMaker, pri_data: PrimaryData):
+    application = db.session.get(Application, pri_data.known_application_id)
+    for application_session in ApplicationSession.query.join(Application).filter(
+            Application.workspace_id == application.workspace_id).all():
+        db.session.delete(application_session)
+    # there is room for exactly one session in the workspace
+    application.workspace.memory_limit_gib = application.config.get(
+        'memory_gib', application.base_config.get('memory_gib', 1.0))
+    db.session.commit()
+
+    set_warm_pool_size(pri_data.known_application_id, 2)
+    response = rmaker.make_authenticated_admin_request(
+        method='POST',
+        path='/api/v1/warm_pools/%s' % pri_data.known_application_id
+    )
+    assert response.status_code == 200
+
+    # the pool itself cannot grow over the limit
+    response = rmaker.make_authenticated_admin_request(
+        method='POST',
+        path='/api/v1/warm_pools/%s' % pri_data.known_application_id
+    )
+    assert response.status_code == 409
+
+    # an idle warm session does not use up the memory of the workspace for users
+    response = rmaker.make_authenticated_user_request(
+        method='POST',
+        path='/api/v1/application_sessions',
+        data=json.dumps(dict(application_id=pri_data.known_application_id))
+    )
+    assert response.status_code == 200
+    assert not response.json.get('is_warm')
+
+    # the workspace is now full of user sessions, so the running warm session cannot be claimed either
+    warm_session = ApplicationSession.query.filter_by(
+        application_id=pri_data.known_application_id, is_warm=True).one()
+    warm_session.state = ApplicationSession.STATE_RUNNING
+    db.session.commit()
+    response = rmaker.make_authenticated_user_2_request(
+        method='POST',
+        path='/api/v1/application_sessions',
+        data=json.dumps(dict(application_id=pri_data.known_application_id))
+    )
+    assert response.status_code == 409
+    db.session.expire_all()
+    assert db.session.get(ApplicationSession, warm_session.id).is_warm
@@ -894,6 +894,88 @@ def test_promote_and_demote_workspace_members(rmaker: RequestMaker, pri_data: Pr
     assert response.status_code == 403
 
 
+def test_get_workspace_members_paginated_and_filtered(rmaker: RequestMaker, pri_data: PrimaryData):
+    path = '/api/v1/workspaces/%s/members' % pri_data.known_workspace_id
+
+    # walk through the members two at a time
+    member_ids = []
+    response = rmaker.make_authenticated_workspace_owner_request(path=path + '?page_size=2&count=1')
+    assert response.status_code == 200
+    assert response.headers['X-Total-Count'] == '4'
+    while True:
+        assert len(response.json) <= 2
+        member_ids.extend(m['user_id'] for m in response.json)
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            break
+        response = rmaker.make_authenticated_workspace_owner_request(path=path + '?page_size=2&cursor=' + cursor)
+        assert response.status_code == 200
+    assert sorted(member_ids) == ['u2', 'u3', 'u4', 'u6']
+
+    # search matches ext_id and email_id, case insensitive
+    response = rmaker.make_authenticated_workspace_owner_request(path=path + '?search=WORKSPACE_owner')
+    assert response.status_code == 200
+    assert sorted(m['user_id'] for m in response.json) == ['u3', 'u4']
+    response = rmaker.make_authenticated_workspace_owner_request(path=path + '?search=%25')
+    assert response.status_code == 200
+    assert response.json == []
+
+    # role filters
+    response = rmaker.make_authenticated_workspace_owner_request(path=path + '?is_manager=true&is_owner=false')
+    assert response.status_code == 200
+    assert [m['user_id'] for m in response.json] == ['u4']
+    response = rmaker.make_authenticated_workspace_owner_request(path=path + '?is_manager=false&member_count=1')
+    assert response.status_code == 200
+    assert response.json == 2
+    response = rmaker.make_authenticated_workspace_owner_request(path=path + '?is_banned=true')
+    assert response.status_code == 200
+    assert response.json == []
+
+
+def test_bulk_change_workspace_member_roles(rmaker: RequestMaker, pri_data: PrimaryData):
+    path = '/api/v1/workspaces/%s/members' % pri_data.known_workspace_id
+
+    # ban two members in one request
+    response = rmaker.make_authenticated_workspace_owner_request(
+        method='PATCH',
+        path=path,
+        data=json.dumps(dict(user_ids=['u2', 'u6'], operation='ban'))
+    )
+    assert response.status_code == 200
+    response = rmaker.make_authenticated_workspace_owner_request(path=path + '?is_banned=true')
+    assert sorted(m['user_id'] for m in response.json) == ['u2', 'u6']
+
+    # a single owner or unknown member fails the whole request
+    for user_ids, status_code in ((['u2', 'u3'], 403), (['u2', 'u5', 'unknown'], 404)):
+        response = rmaker.make_authenticated_workspace_owner_request(
+            method='PATCH',
+            path=path,
+            data=json.dumps(dict(user_ids=user_ids, operation='unban'))
+        )
+        assert response.status_code == status_code
+    response = rmaker.make_authenticated_workspace_owner_request(path=path + '?is_banned=true')
+    assert sorted(m['user_id'] for m in response.json) == ['u2', 'u6']
+
+    # user_id and user_ids can be combined
+    response = rmaker.make_authenticated_workspace_owner_request(
+        method='PATCH',
+        path=path,
+        data=json.dumps(dict(user_id='u2', user_ids=['u6'], operation='unban'))
+    )
+    assert response.status_code == 200
+    response = rmaker.make_authenticated_workspace_owner_request(path=path + '?is_banned=true')
+    assert response.json == []
+
+    # invalid requests
+    for data in (dict(operation='ban'), dict(user_ids=['u2'], operation='explode')):
+        response = rmaker.make_authenticated_workspace_owner_request(
+            method='PATCH',
+            path=path,
+            data=json.dumps(data)
+        )
+        assert response.status_code == 422
+
+
 def test_transfer_ownership_workspace(rmaker: RequestMaker, pri_data: PrimaryData):
     ws = Workspace('TestWorkspaceTransferOwnership')
     ws.id = 'TestWorkspaceId'
@@ -1617,3 +1699,58 @@ def test_regenerate_workspace_join_code(rmaker: RequestMaker, pri_data: PrimaryD
         path='/api/v1/workspaces/%s/regenerate_join_code' % pri_data.known_workspace_id
     )
     assert response.status_code == 403
+
+
+def test_get_workspaces_conditional(rmaker: RequestMaker, pri_data: PrimaryData):
+    response = rmaker.make_authenticated_user_request(path='/api/v1/workspaces')
+    assert response.status_code == 200
+    etag = response.headers.get('ETag')
+    response = rmaker.make_authenticated_user_request(path='/api/v1/workspaces', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    # banning the user changes the list
+    membership = db.session.scalar(
+        select(WorkspaceMembership)
+        .where(WorkspaceMembership.user_id == pri_data.known_user_id)
+        .where(WorkspaceMembership.workspace_id == pri_data.known_workspace_id)
+    )
+    membership.is_banned = True
+    db.session.commit()
+    response = rmaker.make_authenticated_user_request(path='/api/v1/workspaces', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    etag = response.headers.get('ETag')
+
+    # workspace updates are seen by the admin
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/workspaces')
+    etag = response.headers.get('ETag')
+    workspace = db.session.get(Workspace, pri_data.known_workspace_id)
+    workspace.description = 'changed'
+    db.session.commit()
+    response = rmaker.make_authenticated_admin_request(path='/api/v1/workspaces', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers.get('ETag') != etag
+
+
+def test_workspace_views_query_count(rmaker: RequestMaker, pri_data: PrimaryData, assert_max_queries):
+    members_path = '/api/v1/workspaces/%s/members' % pri_data.known_workspace_id
+    accounting_path = '/api/v1/workspaces/%s/accounting' % pri_data.known_workspace_id
+    # log in outside the counted blocks
+    rmaker.make_authenticated_admin_request(path='/api/v1/workspaces')
+    rmaker.make_authenticated_user_request(path='/api/v1/workspaces')
+    rmaker.make_authenticated_workspace_owner_request(path='/api/v1/workspaces')
+
+    with assert_max_queries(14):
+        response = rmaker.make_authenticated_admin_request(path='/api/v1/workspaces')
+        assert response.status_code == 200
+    with assert_max_queries(9):
+        response = rmaker.make_authenticated_user_request(path='/api/v1/workspaces')
+        assert response.status_code == 200
+    with assert_max_queries(10):
+        response = rmaker.make_authenticated_workspace_owner_request(path='/api/v1/workspaces')
+        assert response.status_code == 200
+    with assert_max_queries(5):
+        response = rmaker.make_authenticated_workspace_owner_request(path=members_path)
+        assert response.status_code == 200
+    with assert_max_queries(6):
+        response = rmaker.make_authenticated_admin_request(path=accounting_path)
+        assert response.status_code == 200